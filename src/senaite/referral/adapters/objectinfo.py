@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from senaite.referral.interfaces import IReferralObjectInfo
+from zope.interface import implementer
+
+from bika.lims import api
+
+
+@implementer(IReferralObjectInfo)
+class ObjectInfo(object):
+    """Base adapter that returns the values of the accessors defined in
+    `accessors`, keyed by the name of the field the remote laboratory expects
+    """
+
+    # Tuples of (key, accessor name)
+    accessors = ()
+
+    def __init__(self, context):
+        self.context = context
+
+    def to_dict(self):
+        info = {}
+        for key, accessor in self.accessors:
+            value = getattr(self.context, accessor)()
+            if api.is_date(value):
+                value = value.ISO8601()
+            info[key] = value
+        return info
+
+
+class SampleInfo(ObjectInfo):
+    """Information of a sample needed by the remote laboratory to find the
+    counterpart sample and to reject it, if necessary
+    """
+    accessors = (
+        ("ClientSampleID", "getClientSampleID"),
+        ("RejectionReasons", "getRejectionReasons"),
+    )
+
+
+class ShipmentInfo(ObjectInfo):
+    """Information of an inbound or outbound shipment needed by the remote
+    laboratory to find the counterpart shipment
+    """
+    accessors = (
+        ("shipment_id", "getShipmentID"),
+    )
+
+
+class InboundSampleInfo(ObjectInfo):
+    """Information of an inbound sample needed by the remote laboratory to
+    find the counterpart sample
+    """
+    accessors = (
+        ("referring_id", "getReferringID"),
+    )
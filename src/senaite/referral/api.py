@@ -1,17 +1,16 @@
 # -*- coding: utf-8 -*-
 
-import json
-
 from bika.lims.api import get_object
+from bika.lims.api import get_portal
 from bika.lims.api import get_tool
-from bika.lims.api import is_at_content
-from bika.lims.api import parse_json
+from bika.lims.api import get_uid
 from bika.lims.api import UID_CATALOG
 from BTrees.OOBTree import OOBTree
-from Products.Archetypes.utils import getRelURL
 from senaite.referral.config import REFERRAL_STORAGE
+from senaite.referral.config import REMOTE_UIDS_STORAGE
 from senaite.referral.interfaces import IRemoteContent
 from senaite.referral.interfaces import IRemoteResource
+from senaite.referral.reindex import reindex_on_commit
 from zope.annotation.interfaces import IAnnotations
 from zope.interface import alsoProvides
 from zope.interface import noLongerProvides
@@ -61,6 +60,37 @@ def get_referral_storage(obj):
     return annotation[REFERRAL_STORAGE]
 
 
+def get_remote_uids_storage(create=False):
+    """Returns the storage with the UIDs of the local objects linked to remote
+    referral contents, keyed by remote UID. The storage is only created if
+    `create` is True, so reads do not write to the database
+
+    :param create: whether the storage has to be created if it does not exist
+    :returns: OOBTree or an empty dict if the storage does not exist
+    """
+    annotation = IAnnotations(get_portal())
+    storage = annotation.get(REMOTE_UIDS_STORAGE)
+    if storage is None:
+        if not create:
+            return {}
+        storage = OOBTree()
+        annotation[REMOTE_UIDS_STORAGE] = storage
+    return storage
+
+
+def index_remote_uid(obj, remote_uid, previous=None):
+    """Maps the remote UID passed-in to the given object, so the object can be
+    searched by its remote UID. The mapping of the previous remote UID of the
+    object, if any, is removed. Mappings are only written when they change
+    """
+    storage = get_remote_uids_storage(create=bool(remote_uid))
+    uid = get_uid(obj)
+    if previous and previous != remote_uid and storage.get(previous) == uid:
+        del storage[previous]
+    if remote_uid and storage.get(remote_uid) != uid:
+        storage[remote_uid] = uid
+
+
 def get_remote_uid(obj):
     """Returns the UID of the remote object, if any
     """
@@ -79,8 +109,9 @@ def get_remote_resource(obj):
         return obj
     if is_remote_content(obj):
         storage = get_referral_storage(obj)
+        # the data might be stored as a JSON string by former versions. The
+        # remote resource decodes it only if necessary
         data = storage.get("remote_data", None)
-        data = parse_json(data, default=None)
         if data:
             # Prevent circular dependencies
             from senaite.referral.remote.resource import RemoteResource
@@ -99,19 +130,19 @@ def link_remote_resource(obj, resource):
     # if this object has a counterpart resource in a remote lab
     if not IRemoteContent.providedBy(obj):
         alsoProvides(obj, IRemoteContent)
-
-    # json-ify
-    data = resource.to_dict()
-    data = json.dumps(data)
+        reindex_on_commit(obj, idxs=["object_provides"])
 
     # assign the remote uid, along with current data so we can always use
-    # the original information, even when connection with remove lab is lost
+    # the original information, even when connection with remove lab is lost.
+    # The data is stored as is, the remote resource is read-only and the data
+    # is always replaced as a whole
     annotation = get_referral_storage(obj)
+    previous = annotation.get("remote_uid")
     annotation["remote_uid"] = resource.UID
-    annotation["remote_data"] = data
+    annotation["remote_data"] = resource.to_dict(deep=False)
 
-    # re-catalog object
-    catalog_object(obj)
+    # make the object searchable by its remote uid
+    index_remote_uid(obj, resource.UID, previous=previous)
 
 
 def unlink_remote_resource(obj):
@@ -119,16 +150,17 @@ def unlink_remote_resource(obj):
     """
     if IRemoteContent.providedBy(obj):
         noLongerProvides(obj, IRemoteContent)
+        reindex_on_commit(obj, idxs=["object_provides"])
 
-    IAnnotations(obj)
     annotation = get_referral_storage(obj)
+    previous = annotation.get("remote_uid")
     if "remote_uid" in annotation:
         del(annotation["remote_uid"])
-    if "remote_date" in annotation:
+    if "remote_data" in annotation:
         del(annotation["remote_data"])
 
-    # re-catalog object
-    catalog_object(obj)
+    # the object is no longer searchable by its remote uid
+    index_remote_uid(obj, None, previous=previous)
 
 
 def get_brain_by_remote_uid(uid, default=None):
@@ -143,8 +175,12 @@ def get_brain_by_remote_uid(uid, default=None):
     if not uid:
         return default
 
+    local_uid = get_remote_uids_storage().get(uid)
+    if not local_uid:
+        return default
+
     uc = get_tool(UID_CATALOG)
-    brains = uc(remote_uid=uid)
+    brains = uc(UID=local_uid)
     if len(brains) != 1:
         return default
     return brains[0]
@@ -171,23 +207,3 @@ def get_object_by_remote_uid(uid, default=_marker):
         raise ValueError("No object found for remote uid %s" % uid)
 
     return get_object(brain)
-
-
-def catalog_object(obj):
-    """Catalog the object in all registered catalogs
-    """
-    uid_catalog = get_tool(UID_CATALOG)
-    if is_at_content(obj):
-        # For ATs, the uids of uid_catalog are relative paths to portal root
-        # see Products.Archetypes.UIDCatalog.UIDResolver.catalog_object
-        url = getRelURL(uid_catalog, obj.getPhysicalPath())
-    else:
-        # For DXs, the uids of uid_catalog are absolute paths to portal root
-        # see plone.app.referencablebehavior.uidcatalog
-        url = "/".join(obj.getPhysicalPath())
-
-    # explicitly catalog in uid_catalog
-    uid_catalog.catalog_object(obj, url)
-
-    # reindex in registered catalogs
-    obj.reindexObject()
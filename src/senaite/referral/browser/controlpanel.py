@@ -83,6 +83,42 @@ class IReferralControlPanel(Interface):
         required=0,
     )
 
+    chunk_size_create_inbound_sample = schema.Int(
+        title=_(
+            u"label_chunk_size_create_inbound_sample",
+            u"Maximum number of inbound samples to create in a single task"
+        ),
+        description=_(
+            u"description_chunk_size_create_inbound_sample",
+            u"When an inbound shipment is received from a referring "
+            u"laboratory, the shipment is created right-away and its inbound "
+            u"samples are created asynchronously in chunks of this size. If "
+            u"the value is 0 or senaite queue is not installed, all inbound "
+            u"samples are created in the same request the shipment is "
+            u"received"
+        ),
+        default=5,
+        required=0,
+    )
+
+    chunk_size_referral_consumer = schema.Int(
+        title=_(
+            u"label_chunk_size_referral_consumer",
+            u"Maximum number of remote actions to process in a single task"
+        ),
+        description=_(
+            u"description_chunk_size_referral_consumer",
+            u"Actions requested by remote laboratories with deferred actions "
+            u"enabled (e.g. the rejection or reception of samples) are "
+            u"performed asynchronously in chunks of this size and their "
+            u"outcomes are reported back once done. If the value is 0 or "
+            u"senaite queue is not installed, all actions are performed in "
+            u"the same request they are received"
+        ),
+        default=5,
+        required=0,
+    )
+
     outbound_samples_order = schema.Choice(
         title=_(
             u"label_referral_outbound_samples_order",
@@ -160,6 +196,251 @@ class IReferralControlPanel(Interface):
         required=False,
     )
 
+    session_pool_size = schema.Int(
+        title=_(
+            u"label_referral_session_pool_size",
+            u"Connections pool size"
+        ),
+        description=_(
+            u"description_referral_session_pool_size",
+            u"Maximum number of connections to keep open with each remote "
+            u"laboratory for reuse in subsequent notifications"
+        ),
+        default=10,
+        min=1,
+        required=False,
+    )
+
+    session_keep_alive = schema.Bool(
+        title=_(
+            u"label_referral_session_keep_alive",
+            u"Keep connections alive"
+        ),
+        description=_(
+            u"description_referral_session_keep_alive",
+            u"If selected, the connections with remote laboratories are kept "
+            u"open after each notification, so the cost of establishing a "
+            u"new connection is only paid once"
+        ),
+        default=True,
+        required=False,
+    )
+
+    session_idle_timeout = schema.Int(
+        title=_(
+            u"label_referral_session_idle_timeout",
+            u"Idle connections timeout"
+        ),
+        description=_(
+            u"description_referral_session_idle_timeout",
+            u"Number of seconds a connection with a remote laboratory can "
+            u"remain unused before it is closed. Set 0 to never close idle "
+            u"connections"
+        ),
+        default=300,
+        min=0,
+        required=False,
+    )
+
+    outbox_enabled = schema.Bool(
+        title=_(
+            u"label_referral_outbox_enabled",
+            u"Deliver notifications asynchronously"
+        ),
+        description=_(
+            u"description_referral_outbox_enabled",
+            u"If selected, notifications to remote laboratories are stored in "
+            u"an outbox and delivered in background once the changes are "
+            u"saved, so users do not have to wait for the remote laboratory "
+            u"to respond. Otherwise, notifications are sent while the user "
+            u"request is processed"
+        ),
+        default=False,
+        required=False,
+    )
+
+    outbox_max_attempts = schema.Int(
+        title=_(
+            u"label_referral_outbox_max_attempts",
+            u"Maximum delivery attempts"
+        ),
+        description=_(
+            u"description_referral_outbox_max_attempts",
+            u"Maximum number of times the system tries to deliver a "
+            u"notification from the outbox when the remote laboratory cannot "
+            u"be reached"
+        ),
+        default=5,
+        min=1,
+        required=False,
+    )
+
+    notifications_retention = schema.Int(
+        title=_(
+            u"label_referral_notifications_retention",
+            u"Notifications history size"
+        ),
+        description=_(
+            u"description_referral_notifications_retention",
+            u"Maximum number of notifications (POST requests) to remote "
+            u"laboratories kept in the history of each object. Oldest "
+            u"notifications are discarded when this limit is exceeded. Set "
+            u"to 0 to keep them all"
+        ),
+        default=20,
+        min=0,
+        required=False,
+    )
+
+    notifications_compression = schema.Bool(
+        title=_(
+            u"label_referral_notifications_compression",
+            u"Compress notifications history"
+        ),
+        description=_(
+            u"description_referral_notifications_compression",
+            u"When selected, the notifications (POST requests) to remote "
+            u"laboratories kept in the history of each object are stored "
+            u"compressed. This reduces the size of the database at the cost "
+            u"of a little overhead when the history is read"
+        ),
+        default=False,
+        required=False,
+    )
+
+    notifications_max_content_size = schema.Int(
+        title=_(
+            u"label_referral_notifications_max_content_size",
+            u"Maximum size of responses in history"
+        ),
+        description=_(
+            u"description_referral_notifications_max_content_size",
+            u"Maximum number of characters of the responses from remote "
+            u"laboratories kept in the history of notifications (POST "
+            u"requests) of each object. Longer responses are truncated. Set "
+            u"to 0 to keep the whole responses"
+        ),
+        default=10240,
+        min=0,
+        required=False,
+    )
+
+    notifications_log_sampling = schema.Int(
+        title=_(
+            u"label_referral_notifications_log_sampling",
+            u"Notifications logged in full (%)"
+        ),
+        description=_(
+            u"description_referral_notifications_log_sampling",
+            u"Percentage of notifications (POST requests) to remote "
+            u"laboratories whose whole payload is written to the log. The "
+            u"rest are logged with their size, number of items, digest, "
+            u"status and elapsed time only. Payloads are always logged in "
+            u"full when the log level is DEBUG"
+        ),
+        default=0,
+        min=0,
+        max=100,
+        required=False,
+    )
+
+    retry_max_workers = schema.Int(
+        title=_(
+            u"label_referral_retry_max_workers",
+            u"Concurrent retries"
+        ),
+        description=_(
+            u"description_referral_retry_max_workers",
+            u"Maximum number of failed notifications (POST requests) that "
+            u"are re-sent to remote laboratories concurrently on retry"
+        ),
+        default=4,
+        min=1,
+        required=False,
+    )
+
+    retry_backoff = schema.Int(
+        title=_(
+            u"label_referral_retry_backoff",
+            u"Retry delay (seconds)"
+        ),
+        description=_(
+            u"description_referral_retry_backoff",
+            u"Time to wait before the automatic retry of a failed "
+            u"notification (POST request). This time is doubled after each "
+            u"consecutive failure, up to the maximum delay"
+        ),
+        default=300,
+        min=1,
+        required=False,
+    )
+
+    retry_backoff_max = schema.Int(
+        title=_(
+            u"label_referral_retry_backoff_max",
+            u"Maximum retry delay (seconds)"
+        ),
+        description=_(
+            u"description_referral_retry_backoff_max",
+            u"Maximum time to wait before the automatic retry of a failed "
+            u"notification (POST request)"
+        ),
+        default=21600,
+        min=1,
+        required=False,
+    )
+
+    dispatch_max_workers = schema.Int(
+        title=_(
+            u"label_referral_dispatch_max_workers",
+            u"Concurrent laboratories"
+        ),
+        description=_(
+            u"description_referral_dispatch_max_workers",
+            u"Maximum number of remote laboratories notified concurrently. "
+            u"Notifications (POST requests) are sent when the changes are "
+            u"about to be saved, grouped by laboratory"
+        ),
+        default=4,
+        min=1,
+        required=False,
+    )
+
+    circuit_failure_threshold = schema.Int(
+        title=_(
+            u"label_referral_circuit_failure_threshold",
+            u"Failures before pausing notifications"
+        ),
+        description=_(
+            u"description_referral_circuit_failure_threshold",
+            u"Number of consecutive times a remote laboratory cannot be "
+            u"reached before the system stops sending notifications (POST "
+            u"requests) to it for a while. Notifications are recorded as "
+            u"failed meanwhile, so they can be retried later. Set to 0 to "
+            u"always send the notifications"
+        ),
+        default=5,
+        min=0,
+        required=False,
+    )
+
+    circuit_cooldown = schema.Int(
+        title=_(
+            u"label_referral_circuit_cooldown",
+            u"Notifications pause (seconds)"
+        ),
+        description=_(
+            u"description_referral_circuit_cooldown",
+            u"Time to wait before trying to notify again a remote laboratory "
+            u"that could not be reached. After this time, a single "
+            u"notification is sent to check whether the remote laboratory "
+            u"is reachable again"
+        ),
+        default=300,
+        min=1,
+        required=False,
+    )
+
 
 class ReferralControlPanelForm(RegistryEditForm):
     schema = IReferralControlPanel
@@ -19,14 +19,29 @@
 # Some rights reserved, see README and LICENSE.
 
 import collections
+
+from DateTime import DateTime
 from pkg_resources import resource_listdir
 from senaite.app.listing import ListingView
 from senaite.referral import messageFactory as _
 from senaite.referral import PRODUCT_NAME
+from senaite.referral.health import FAILING
+from senaite.referral.health import get_health
+from senaite.referral.health import HEALTHY
+from senaite.referral.health import UNREACHABLE
 
 from bika.lims import api
+from bika.lims.browser import ulocalized_time
 from bika.lims.utils import get_link
 from bika.lims.utils import get_link_for
+from bika.lims.utils import t
+
+
+HEALTH_TITLES = {
+    HEALTHY: _("Reachable"),
+    FAILING: _("Failing"),
+    UNREACHABLE: _("Unreachable"),
+}
 
 
 class ExternalLaboratoryFolderView(ListingView):
@@ -71,7 +86,19 @@ class ExternalLaboratoryFolderView(ListingView):
             }),
             ("referring", {
                 "title": _("Referring"),
-            })
+            }),
+            ("health", {
+                "title": _("Connection status"),
+                "sortable": False,
+            }),
+            ("last_success", {
+                "title": _("Last successful notification"),
+                "sortable": False,
+            }),
+            ("latency", {
+                "title": _("Response time"),
+                "sortable": False,
+            }),
         ))
 
         self.review_states = [
@@ -118,4 +145,25 @@ class ExternalLaboratoryFolderView(ListingView):
 
         item["reference"] = obj.getReference()
         item["referring"] = obj.getReferring()
+
+        # Health of the connection with the remote laboratory
+        health = get_health(obj)
+        status = health.get("status")
+        failures = health.get("failures", 0)
+        if status:
+            item["health"] = t(HEALTH_TITLES.get(status, status))
+        if failures:
+            msg = _("Consecutive failures: ${failures}",
+                    mapping={"failures": failures})
+            item["health"] = "{} ({})".format(item["health"], t(msg))
+
+        last_success = health.get("last_success")
+        if last_success:
+            last_success = DateTime(last_success)
+            item["last_success"] = ulocalized_time(last_success,
+                                                   long_format=1)
+
+        latency = health.get("latency")
+        if latency is not None:
+            item["latency"] = "{:.0f} ms".format(latency * 1000)
         return item
@@ -30,7 +30,7 @@ from senaite.app.listing import ListingView
 from senaite.core.api import dtime
 from senaite.referral import messageFactory as _
 from senaite.referral.catalog import INBOUND_SAMPLE_CATALOG
-from senaite.referral.notifications import get_last_post
+from senaite.referral.notifications import POST_FAILED
 from senaite.referral.utils import get_image_url
 from senaite.referral.utils import get_sample_types_mapping
 from senaite.referral.utils import translate
@@ -123,6 +123,14 @@ class SamplesListingView(ListingView):
                 },
                 "custom_transitions": [],
                 "columns": self.columns.keys(),
+            }, {
+                "id": "failed_notifications",
+                "title": _("Failed notifications"),
+                "contentFilter": {
+                    "last_post_status": POST_FAILED,
+                },
+                "custom_transitions": [],
+                "columns": self.columns.keys(),
             }, {
                 "id": "all",
                 "title": _("All"),
@@ -178,6 +186,7 @@ class SamplesListingView(ListingView):
         super(SamplesListingView, self).before_render()
 
     def folderitem(self, obj, item, index):
+        failed_notification = self.is_failed_notification(obj)
         obj = api.get_object(obj)
         sample = obj.getSample()
         if api.is_object(sample):
@@ -210,7 +219,7 @@ class SamplesListingView(ListingView):
             item["replace"]["state_title"] = state_title
 
             # Add an icon if last POST notification for this Sample failed
-            if self.is_failed_notification(sample):
+            if failed_notification:
                 msg = _("Notification to remote lab failed")
                 img = get_image("exclamation.png", title=msg)
                 item["after"]["sample_id"] = img
@@ -272,15 +281,11 @@ class SamplesListingView(ListingView):
             return title
         return translate("Received (${status})", mapping={"status": title})
 
-    def is_failed_notification(self, obj):
-        """Returns whether the last notification POST for the given object
-        failed or not
+    def is_failed_notification(self, brain):
+        """Returns whether the last notification POST for the sample
+        counterpart of the inbound sample passed-in failed or not
         """
-        post = get_last_post(obj)
-        if not post:
-            return False
-        success = post.get("success", False)
-        return not success
+        return getattr(brain, "last_post_status", None) == POST_FAILED
 
     @view.memoize
     def get_sample_types(self):
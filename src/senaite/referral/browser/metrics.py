@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import json
+
+from Products.Five.browser import BrowserView
+from senaite.referral.metrics import LATENCY_BUCKETS
+from senaite.referral.metrics import metrics_registry
+
+# Prefix of the metric names in Prometheus text format
+PROMETHEUS_PREFIX = "senaite_referral"
+
+
+def escape(value):
+    """Returns the value passed-in escaped for its use as a label value in
+    Prometheus text format
+    """
+    value = str(value or "")
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def get_labels(series, **extra):
+    """Returns the labels of the series passed-in in Prometheus text format
+    """
+    labels = [
+        ("direction", series["direction"]),
+        ("name", series["name"]),
+        ("laboratory", series["laboratory"]),
+    ]
+    labels.extend(sorted(extra.items()))
+    labels = ['{}="{}"'.format(key, escape(val)) for key, val in labels]
+    return "{{{}}}".format(",".join(labels))
+
+
+class MetricsView(BrowserView):
+    """Returns the metrics of the calls to and from remote laboratories known
+    by the current process, as JSON or, with `format=prometheus`, in
+    Prometheus text format. Meant to be scraped from each ZEO client
+    """
+
+    def __call__(self):
+        snapshot = metrics_registry.snapshot()
+        output = self.request.form.get("format")
+        if output == "prometheus":
+            self.request.response.setHeader(
+                "Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            return self.to_prometheus(snapshot)
+
+        self.request.response.setHeader("Content-Type", "application/json")
+        return json.dumps({
+            "buckets": LATENCY_BUCKETS,
+            "metrics": snapshot,
+        })
+
+    def to_prometheus(self, snapshot):
+        """Returns the snapshot of the metrics in Prometheus text format
+        """
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            "# HELP {}_call_seconds Latency of the calls".format(prefix),
+            "# TYPE {}_call_seconds histogram".format(prefix),
+        ]
+        for series in snapshot:
+            for bound, count in zip(LATENCY_BUCKETS, series["buckets"]):
+                labels = get_labels(series, le=bound)
+                lines.append("{}_call_seconds_bucket{} {}".format(
+                    prefix, labels, count))
+            labels = get_labels(series, le="+Inf")
+            lines.append("{}_call_seconds_bucket{} {}".format(
+                prefix, labels, series["count"]))
+            labels = get_labels(series)
+            lines.append("{}_call_seconds_sum{} {}".format(
+                prefix, labels, series["elapsed"]))
+            lines.append("{}_call_seconds_count{} {}".format(
+                prefix, labels, series["count"]))
+
+        counters = [
+            ("bytes", "Size in bytes of the payloads"),
+            ("items", "Number of items of the payloads"),
+            ("loads", "Objects loaded from the database by the consumers"),
+        ]
+        for key, help_text in counters:
+            name = "{}_{}_total".format(prefix, key)
+            lines.append("# HELP {} {}".format(name, help_text))
+            lines.append("# TYPE {} counter".format(name))
+            for series in snapshot:
+                lines.append("{}{} {}".format(
+                    name, get_labels(series), series[key]))
+
+        name = "{}_errors_total".format(prefix)
+        lines.append("# HELP {} Failed calls by reason".format(name))
+        lines.append("# TYPE {} counter".format(name))
+        for series in snapshot:
+            for reason, count in sorted(series["errors"].items()):
+                labels = get_labels(series, reason=reason)
+                lines.append("{}{} {}".format(name, labels, count))
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import json
+
+from Products.Five.browser import BrowserView
+from senaite.referral.outbox import get_due_index
+from senaite.referral.outbox import get_due_keys
+from senaite.referral.outbox import get_outbox
+from senaite.referral.outbox import start_worker
+
+from bika.lims import api
+
+
+class ProcessOutboxView(BrowserView):
+    """Starts the delivery of the notifications from the outbox that are
+    ready. Meant to be called periodically (e.g. from a clock-server or a cron
+    job) to deliver the notifications that could not be sent on commit, like
+    those pending after an instance restart or waiting for a retry.
+
+    The notifications are delivered by the outbox worker, that commits each
+    delivery with its own connection to the database. This view does not
+    write, so the transaction of the request is left to the publisher
+    """
+
+    def __call__(self):
+        portal = api.get_portal()
+        due = len(list(get_due_keys(portal)))
+        # records added by former versions are not indexed yet
+        unindexed = get_outbox(portal) and not get_due_index(portal)
+        started = bool(due or unindexed)
+        if started:
+            db = portal._p_jar.db()
+            start_worker(db, api.get_path(portal))
+        self.request.response.setHeader("Content-Type", "application/json")
+        return json.dumps({
+            "due": due,
+            "started": started,
+        })
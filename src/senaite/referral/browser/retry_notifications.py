@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import json
+
+from Products.Five.browser import BrowserView
+from senaite.referral.retry import retry_failed_notifications
+from senaite.referral.utils import get_by_code
+from senaite.referral.utils import is_true
+
+from bika.lims import api
+
+
+class RetryFailedNotificationsView(BrowserView):
+    """Re-sends the failed notifications (POST requests) that are due for a
+    retry in accordance with the backoff policy. Meant to be called
+    periodically (e.g. from a clock-server or a cron job). Accepts the
+    optional parameters "laboratory" (UID or code), "limit" and "force"
+    """
+
+    def __call__(self):
+        form = self.request.form
+        laboratory = self.get_laboratory(form.get("laboratory"))
+        limit = api.to_int(form.get("limit"), 0)
+        force = is_true(form.get("force", False))
+        report = retry_failed_notifications(laboratory=laboratory,
+                                            limit=limit, force=force)
+        self.request.response.setHeader("Content-Type", "application/json")
+        return json.dumps(report)
+
+    def get_laboratory(self, uid_or_code):
+        """Returns the external laboratory for the UID or code passed-in
+        """
+        if not uid_or_code:
+            return None
+        if api.is_uid(uid_or_code):
+            return api.get_object_by_uid(uid_or_code, default=None)
+        return get_by_code("ExternalLaboratory", uid_or_code)
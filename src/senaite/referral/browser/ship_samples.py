@@ -23,7 +23,7 @@ from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from senaite.referral import messageFactory as _
 from senaite.referral.browser import BaseView
 from senaite.referral.interfaces import IOutboundSampleShipment
-from senaite.referral.workflow import ship_sample
+from senaite.referral.workflow import ship_samples
 
 from bika.lims import api
 from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
@@ -59,13 +59,23 @@ class ShipSamplesView(BaseView):
 
         if shipment:
             # Ship the samples
-            for sample in samples:
-                sample_obj = sample["obj"]
-                ship_sample(sample_obj, shipment)
-
-            titles = ", ".join(map(lambda samp: samp["title"], samples))
-            message = _("Shipped {} samples: {}".format(len(samples), titles))
-            self.redirect(message=message)
+            objects = map(lambda samp: samp["obj"], samples)
+            shipped = ship_samples(objects, shipment)
+            if not shipped:
+                return self.redirect(message=_("No samples shipped"),
+                                     level="error")
+
+            titles = ", ".join(map(api.get_title, shipped))
+            message = _("Shipped {} samples: {}".format(len(shipped), titles))
+            level = "info"
+
+            not_shipped = len(samples) - len(shipped)
+            if not_shipped:
+                message = _("Shipped {} samples: {}. {} samples could not be "
+                            "shipped".format(len(shipped), titles,
+                                             not_shipped))
+                level = "warning"
+            self.redirect(message=message, level=level)
 
         return self.template()
 
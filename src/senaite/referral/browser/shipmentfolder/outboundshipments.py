@@ -22,8 +22,8 @@ import collections
 from senaite.app.listing import ListingView
 from senaite.referral import messageFactory as _
 from senaite.referral.catalog import SHIPMENT_CATALOG
-from senaite.referral.notifications import get_last_post
-from senaite.referral.notifications import is_error
+from senaite.referral.notifications import get_last_post_summary
+from senaite.referral.notifications import POST_FAILED
 from senaite.referral.utils import get_image_url
 from senaite.referral.utils import translate as t
 
@@ -142,6 +142,11 @@ class OutboundSampleShipmentFolderView(ListingView):
                 "title": _("Cancelled"),
                 "contentFilter": {"review_state": "cancelled"},
                 "columns": self.columns.keys(),
+            }, {
+                "id": "failed_notifications",
+                "title": _("Failed notifications"),
+                "contentFilter": {"last_post_status": POST_FAILED},
+                "columns": self.columns.keys(),
             }, {
                 "id": "all",
                 "title": _("All"),
@@ -158,6 +163,7 @@ class OutboundSampleShipmentFolderView(ListingView):
             the template
         :index: current index of the item
         """
+        post_status = getattr(obj, "last_post_status", None)
         obj = api.get_object(obj)
         href = api.get_url(obj)
         shipment_id = obj.getShipmentID()
@@ -191,15 +197,15 @@ class OutboundSampleShipmentFolderView(ListingView):
         })
 
         # If the notification errored, then add an icon
-        post = get_last_post(obj)
-        if not post:
+        if not post_status:
             # Not notified to the reference lab
             msg = t(_("Reference lab not notified"))
             icon = get_image("warning.png", title=msg)
             self._append_html_element(item, "shipment_id", icon)
 
-        elif is_error(post):
+        elif post_status == POST_FAILED:
             # Notification to the reference lab errored
+            post = get_last_post_summary(obj) or {}
             msg = t(_("The notification to reference lab errored: {}"))
             message = "[{}] {}".format(post.get("status"), post.get("message"))
             msg = msg.format(message)
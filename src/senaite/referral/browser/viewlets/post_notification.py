@@ -22,8 +22,11 @@ from plone.app.layout.viewlets import ViewletBase
 from plone.memoize import view
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from senaite.referral import check_installed
+from senaite.referral.catalog import INBOUND_SAMPLE_CATALOG
 from senaite.referral.interfaces import IInboundSampleShipment
-from senaite.referral.notifications import get_last_post
+from senaite.referral.notifications import get_last_post_summary
+from senaite.referral.notifications import POST_FAILED
+from senaite.referral.notifications import POST_SUCCEEDED
 
 from bika.lims import api
 
@@ -47,8 +50,12 @@ class PostNotificationViewlet(ViewletBase):
             if self.is_error():
                 return True
 
-            samples = self.context.getSamples()
-            posts = filter(None, [get_last_post(sample) for sample in samples])
+            query = {
+                "portal_type": "InboundSample",
+                "shipment_uid": api.get_uid(self.context),
+                "last_post_status": [POST_SUCCEEDED, POST_FAILED],
+            }
+            posts = api.search(query, INBOUND_SAMPLE_CATALOG)
             if not posts and self.get_notification():
                 return True
 
@@ -59,7 +66,7 @@ class PostNotificationViewlet(ViewletBase):
 
     @view.memoize
     def get_notification(self):
-        return get_last_post(self.context)
+        return get_last_post_summary(self.context)
 
     def is_error(self):
         post = self.get_notification()
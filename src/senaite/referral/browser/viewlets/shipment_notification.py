@@ -21,7 +21,10 @@
 from plone.app.layout.viewlets import ViewletBase
 from plone.memoize import view
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
-from senaite.referral.notifications import get_last_post
+from senaite.referral.catalog import INBOUND_SAMPLE_CATALOG
+from senaite.referral.notifications import get_last_post_summary
+from senaite.referral.notifications import POST_FAILED
+from senaite.referral.notifications import POST_SUCCEEDED
 
 from bika.lims import api
 
@@ -63,8 +66,13 @@ class ShipmentNotificationViewlet(ViewletBase):
         """Returns a list of dicts with information about the POST notifications
         for all samples from this current shipment
         """
-        samples = self.context.getSamples()
-        return filter(None, [self.get_post_info(sample) for sample in samples])
+        query = {
+            "portal_type": "InboundSample",
+            "shipment_uid": api.get_uid(self.context),
+            "last_post_status": [POST_SUCCEEDED, POST_FAILED],
+        }
+        brains = api.search(query, INBOUND_SAMPLE_CATALOG)
+        return map(self.get_brain_post_info, brains)
 
     def get_failed_samples_posts(self):
         """Return a list of dicts with information about the POST notifications
@@ -90,7 +98,7 @@ class ShipmentNotificationViewlet(ViewletBase):
         """Returns a dict with the information about the POST notification
         for the given object
         """
-        post = get_last_post(obj)
+        post = get_last_post_summary(obj)
         if not post:
             return None
 
@@ -101,6 +109,19 @@ class ShipmentNotificationViewlet(ViewletBase):
         })
         return post
 
+    def get_brain_post_info(self, brain):
+        """Returns a dict with the information about the POST notification
+        for the sample counterpart of the inbound sample brain passed-in
+        """
+        sample_id = filter(None, brain.sample_id or [])
+        sample_uid = filter(None, brain.sample_uid or [])
+        return {
+            "id": sample_id and sample_id[0] or None,
+            "uid": sample_uid and sample_uid[0] or None,
+            "success": brain.last_post_status == POST_SUCCEEDED,
+            "datetime": brain.last_post_datetime,
+        }
+
     def is_synced(self):
         """Returns whether the POST for all samples from this shipment succeed
         """
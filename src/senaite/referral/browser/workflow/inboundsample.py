@@ -19,7 +19,7 @@
 # Some rights reserved, see README and LICENSE.
 
 from senaite.referral import messageFactory as _
-from senaite.referral import PRODUCT_NAME
+from senaite.referral.settings import get_settings
 from senaite.referral.workflow import do_queue_or_action_for
 
 from bika.lims import api
@@ -66,5 +66,4 @@ class WorkflowActionReceiveAdapter(WorkflowActionGenericAdapter):
         """Returns whether the system is configured so user has to be redirected
         to the barcode stickers preview after receiveing inbound samples
         """
-        key = "{}.barcodes_preview_reception".format(PRODUCT_NAME)
-        return api.get_registry_record(key, default=False)
+        return get_settings().get("barcodes_preview_reception", False)
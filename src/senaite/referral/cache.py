@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from BTrees.Length import Length
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+
+# Annotation key of the per-site counter that is increased each time setup
+# objects the cached values depend on are changed. The counter is persistent,
+# so the caches of all ZEO clients are invalidated on commit
+GENERATION_STORAGE = "senaite.referral.setup_generation"
+
+# Annotation key of the per-site counter that is increased each time users or
+# lab contacts the cached user information depends on are changed
+USERS_GENERATION_STORAGE = "senaite.referral.users_generation"
+
+# Cached values, keyed by (site path, name), as tuples (generation, value)
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def get_generation_counter(portal=None, create=False,
+                           storage=GENERATION_STORAGE):
+    """Returns the persistent counter of the site, if any
+    :returns: BTrees.Length.Length
+    """
+    portal = portal or api.get_portal()
+    annotation = IAnnotations(portal)
+    counter = annotation.get(storage)
+    if counter is None and create:
+        counter = Length()
+        annotation[storage] = counter
+    return counter
+
+
+def get_generation(portal=None, storage=GENERATION_STORAGE):
+    """Returns the current generation of the cached values for the site
+    """
+    counter = get_generation_counter(portal, storage=storage)
+    if counter is None:
+        return 0
+    return counter()
+
+
+def invalidate(portal=None, storage=GENERATION_STORAGE):
+    """Invalidates the cached values of the site in all processes by
+    increasing its generation counter. Concurrent increases do not conflict
+    """
+    counter = get_generation_counter(portal, create=True, storage=storage)
+    counter.change(1)
+
+
+def is_dirty(portal=None, storage=GENERATION_STORAGE):
+    """Returns whether the generation of the site was increased within the
+    current transaction, but not committed yet
+    """
+    counter = get_generation_counter(portal, storage=storage)
+    if counter is None:
+        return False
+    return counter._p_jar is None or bool(counter._p_changed)
+
+
+def setup_cache(name):
+    """Decorator that caches the value returned by the function in the
+    current process until the generation of the site changes. Returns a
+    shallow copy of the cached value, so callers can safely modify it
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper():
+            portal = api.get_portal()
+            key = (api.get_path(portal), name)
+            generation = get_generation(portal)
+            cached = _cache.get(key)
+            if cached and cached[0] == generation:
+                return cached[1].copy()
+
+            value = func()
+            if not is_dirty(portal):
+                # do not cache values built from uncommitted changes
+                with _cache_lock:
+                    _cache[key] = (generation, value)
+            return value.copy()
+        return wrapper
+    return decorator
+
+
+class LRUCache(object):
+    """Thread-safe cache that discards the least recently used values once
+    the maximum number of values is reached
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value for the given key, if any
+        """
+        with self._lock:
+            if key not in self._values:
+                return default
+            # move the value to the end, so it is discarded last
+            value = self._values.pop(key)
+            self._values[key] = value
+            return value
+
+    def set(self, key, value):
+        """Stores the value for the given key. Discards the least recently
+        used values if the maximum number of values is exceeded
+        """
+        with self._lock:
+            self._values.pop(key, None)
+            self._values[key] = value
+            while len(self._values) > self.size:
+                self._values.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._values
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
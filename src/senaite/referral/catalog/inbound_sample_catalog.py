@@ -33,6 +33,8 @@ INDEXES = BASE_INDEXES + [
     # id, indexed attribute, type
     ("laboratory_code", "", "FieldIndex"),
     ("laboratory_uid", "", "FieldIndex"),
+    ("last_post_status", "", "FieldIndex"),
+    ("post_failures_count", "", "FieldIndex"),
     ("referring_id", "", "FieldIndex"),
     ("sample_id", "", "KeywordIndex"),
     ("sample_uid", "", "KeywordIndex"),
@@ -46,8 +48,12 @@ COLUMNS = BASE_COLUMNS + [
     "date_sampled",
     "laboratory_code",
     "laboratory_title",
+    "last_post_datetime",
+    "last_post_status",
+    "post_failures_count",
     "referring_id",
     "sample_id",
+    "sample_uid",
     "shipment_id",
 ]
 
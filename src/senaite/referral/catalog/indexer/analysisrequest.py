@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from bika.lims.interfaces import IAnalysisRequest
+from plone.indexer import indexer
+from senaite.core.interfaces import ISampleCatalog
+from senaite.referral.notifications import get_last_post_datetime
+from senaite.referral.notifications import get_last_post_status
+from senaite.referral.notifications import get_post_failures_count
+
+
+@indexer(IAnalysisRequest, ISampleCatalog)
+def last_post_status(instance):
+    """Returns the status of the last notification (POST) sent to the remote
+    laboratory about this sample
+    """
+    return get_last_post_status(instance)
+
+
+@indexer(IAnalysisRequest, ISampleCatalog)
+def last_post_datetime(instance):
+    """Returns the datetime of the last notification (POST) sent to the remote
+    laboratory about this sample
+    """
+    return get_last_post_datetime(instance)
+
+
+@indexer(IAnalysisRequest, ISampleCatalog)
+def post_failures_count(instance):
+    """Returns the number of consecutive failed notifications (POST) sent to
+    the remote laboratory about this sample
+    """
+    return get_post_failures_count(instance)
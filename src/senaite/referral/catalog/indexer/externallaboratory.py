@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from plone.indexer import indexer
+from senaite.referral.interfaces import IExternalLaboratory
+
+
+@indexer(IExternalLaboratory)
+def code(instance):
+    """Returns the code that uniquely identifies the external laboratory
+    """
+    return instance.getCode()
+
+
+@indexer(IExternalLaboratory)
+def is_reference(instance):
+    """Returns whether the external laboratory acts as a reference laboratory
+    """
+    return bool(instance.getReference())
+
+
+@indexer(IExternalLaboratory)
+def is_referring(instance):
+    """Returns whether the external laboratory acts as a referring laboratory
+    """
+    return bool(instance.getReferring())
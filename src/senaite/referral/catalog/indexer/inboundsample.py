@@ -21,6 +21,9 @@
 from plone.indexer import indexer
 from senaite.referral.interfaces import IInboundSample
 from senaite.referral.interfaces import IInboundSampleCatalog
+from senaite.referral.notifications import get_last_post_datetime
+from senaite.referral.notifications import get_last_post_status
+from senaite.referral.notifications import get_post_failures_count
 
 from bika.lims import api
 
@@ -131,3 +134,30 @@ def inbound_sample_searchable_text(instance):
     ]
     searchable_text_tokens = filter(None, searchable_text_tokens)
     return u" ".join(searchable_text_tokens)
+
+
+@indexer(IInboundSample, IInboundSampleCatalog)
+def last_post_status(instance):
+    """Returns the status of the last notification (POST) sent to the
+    referring laboratory about the sample counterpart, if any
+    """
+    sample = instance.getSample()
+    return get_last_post_status(sample) if sample else ""
+
+
+@indexer(IInboundSample, IInboundSampleCatalog)
+def last_post_datetime(instance):
+    """Returns the datetime of the last notification (POST) sent to the
+    referring laboratory about the sample counterpart, if any
+    """
+    sample = instance.getSample()
+    return get_last_post_datetime(sample) if sample else ""
+
+
+@indexer(IInboundSample, IInboundSampleCatalog)
+def post_failures_count(instance):
+    """Returns the number of consecutive failed notifications (POST) sent to
+    the referring laboratory about the sample counterpart, if any
+    """
+    sample = instance.getSample()
+    return get_post_failures_count(sample) if sample else 0
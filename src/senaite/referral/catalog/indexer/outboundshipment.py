@@ -21,6 +21,9 @@
 from plone.indexer import indexer
 from senaite.referral.interfaces import IOutboundSampleShipment
 from senaite.referral.interfaces import IShipmentCatalog
+from senaite.referral.notifications import get_last_post_datetime
+from senaite.referral.notifications import get_last_post_status
+from senaite.referral.notifications import get_post_failures_count
 
 from bika.lims import api
 
@@ -52,3 +55,27 @@ def shipment_searchable_text(instance):
     ]
     searchable_text_tokens = filter(None, searchable_text_tokens)
     return u" ".join(searchable_text_tokens)
+
+
+@indexer(IOutboundSampleShipment, IShipmentCatalog)
+def last_post_status(instance):
+    """Returns the status of the last notification (POST) sent to the remote
+    laboratory about this shipment
+    """
+    return get_last_post_status(instance)
+
+
+@indexer(IOutboundSampleShipment, IShipmentCatalog)
+def last_post_datetime(instance):
+    """Returns the datetime of the last notification (POST) sent to the remote
+    laboratory about this shipment
+    """
+    return get_last_post_datetime(instance)
+
+
+@indexer(IOutboundSampleShipment, IShipmentCatalog)
+def post_failures_count(instance):
+    """Returns the number of consecutive failed notifications (POST) sent to
+    the remote laboratory about this shipment
+    """
+    return get_post_failures_count(instance)
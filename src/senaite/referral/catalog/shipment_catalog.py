@@ -32,6 +32,8 @@ CATALOG_TITLE = "Senaite Shipment Catalog"
 INDEXES = BASE_INDEXES + [
     # id, indexed attribute, type
     ("laboratory_uid", "", "FieldIndex"),
+    ("last_post_status", "", "FieldIndex"),
+    ("post_failures_count", "", "FieldIndex"),
     ("shipment_id", "", "FieldIndex"),
     ("shipment_searchable_text", "", "ZCTextIndex"),
     ("sortable_title", "", "FieldIndex"),
@@ -40,6 +42,9 @@ INDEXES = BASE_INDEXES + [
 COLUMNS = BASE_COLUMNS + [
     # attribute name
     "laboratory_uid",
+    "last_post_datetime",
+    "last_post_status",
+    "post_failures_count",
     "shipment_id",
 ]
 
@@ -25,6 +25,15 @@ UNINSTALL_ID = "profile-{}:uninstall".format(PRODUCT_NAME)
 
 REFERRAL_STORAGE = "senaite.referral.storage"
 
+# Storage with the UIDs of local objects linked to remote referral contents,
+# keyed by remote UID
+REMOTE_UIDS_STORAGE = "senaite.referral.remote_uids"
+
+# Version of the referral protocol for payloads sent as a single JSON document
+# compressed with gzip. Former versions send each top-level value of the
+# payload as a JSON string
+PROTOCOL_VERSION = 2
+
 PRODUCT_TYPES = (
     "ExternalLaboratory",
     "ExternalLaboratoryFolder",
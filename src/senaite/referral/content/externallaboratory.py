@@ -165,6 +165,47 @@ class IExternalLaboratorySchema(model.Schema):
         required=False,
     )
 
+    batch_notifications = schema.Bool(
+        title=_(u"label_externallaboratory_batch_notifications",
+                default=u"Batched notifications"),
+        description=_(
+            u"Whether the SENAITE instance of the external laboratory accepts "
+            u"the results of multiple samples in a single request. When "
+            u"checked, the results of the samples verified together are sent "
+            u"to the referring laboratory in a single request instead of one "
+            u"request per sample. Requires the same version of "
+            u"senaite.referral in both instances"
+        ),
+        required=False,
+    )
+
+    compressed_notifications = schema.Bool(
+        title=_(u"label_externallaboratory_compressed_notifications",
+                default=u"Compressed notifications"),
+        description=_(
+            u"Whether the SENAITE instance of the external laboratory accepts "
+            u"notifications sent as a single JSON document compressed with "
+            u"gzip. When checked, notifications are smaller and decoded at "
+            u"once by the external laboratory. Requires the same version of "
+            u"senaite.referral in both instances"
+        ),
+        required=False,
+    )
+
+    deferred_actions = schema.Bool(
+        title=_(u"label_externallaboratory_deferred_actions",
+                default=u"Deferred actions"),
+        description=_(
+            u"Whether the SENAITE instance of the external laboratory accepts "
+            u"that the actions it requests are performed asynchronously. When "
+            u"checked and senaite.queue is installed, the requests from the "
+            u"external laboratory are acknowledged once their actions are "
+            u"queued, and the outcomes are reported back when done. Requires "
+            u"the same version of senaite.referral in both instances"
+        ),
+        required=False,
+    )
+
     # Make the code the first field
     directives.order_before(code='*')
 
@@ -186,7 +227,8 @@ class IExternalLaboratorySchema(model.Schema):
     fieldset(
         "connectivity",
         label=_(u"Connectivity"),
-        fields=["url", "username", "password"]
+        fields=["url", "username", "password", "batch_notifications",
+                "compressed_notifications", "deferred_actions"]
     )
 
     # Do not display the password in view mode
@@ -440,3 +482,51 @@ class ExternalLaboratory(Container):
         """
         accessor = self.accessor("default_contact", raw=True)
         return accessor(self)
+
+    @security.protected(permissions.ModifyPortalContent)
+    def setBatchNotifications(self, value):
+        """Sets whether the SENAITE instance of the external laboratory accepts
+        the results of multiple samples in a single POST request
+        """
+        mutator = self.mutator("batch_notifications")
+        mutator(self, bool(value))
+
+    @security.protected(permissions.View)
+    def getBatchNotifications(self):
+        """Returns whether the SENAITE instance of the external laboratory
+        accepts the results of multiple samples in a single POST request
+        """
+        accessor = self.accessor("batch_notifications")
+        return bool(accessor(self))
+
+    @security.protected(permissions.ModifyPortalContent)
+    def setCompressedNotifications(self, value):
+        """Sets whether the SENAITE instance of the external laboratory accepts
+        notifications as a single JSON document compressed with gzip
+        """
+        mutator = self.mutator("compressed_notifications")
+        mutator(self, bool(value))
+
+    @security.protected(permissions.View)
+    def getCompressedNotifications(self):
+        """Returns whether the SENAITE instance of the external laboratory
+        accepts notifications as a single JSON document compressed with gzip
+        """
+        accessor = self.accessor("compressed_notifications")
+        return bool(accessor(self))
+
+    @security.protected(permissions.ModifyPortalContent)
+    def setDeferredActions(self, value):
+        """Sets whether the SENAITE instance of the external laboratory accepts
+        that the actions it requests are performed asynchronously
+        """
+        mutator = self.mutator("deferred_actions")
+        mutator(self, bool(value))
+
+    @security.protected(permissions.View)
+    def getDeferredActions(self):
+        """Returns whether the SENAITE instance of the external laboratory
+        accepts that the actions it requests are performed asynchronously
+        """
+        accessor = self.accessor("deferred_actions")
+        return bool(accessor(self))
@@ -19,6 +19,8 @@
 # Some rights reserved, see README and LICENSE.
 
 from AccessControl import ClassSecurityInfo
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
 from plone.autoform import directives
 from plone.supermodel import model
 from plone.namedfile.field import NamedBlobFile
@@ -32,16 +34,30 @@ from senaite.referral.content import get_string_value
 from senaite.referral.content import get_uids_field_value
 from senaite.referral.content import set_string_value
 from senaite.referral.interfaces import IOutboundSampleShipment
-from senaite.referral.utils import cmp_by_created
-from senaite.referral.utils import cmp_by_id
 from senaite.referral.utils import get_action_date
 from senaite.referral.utils import get_outbound_samples_order
+from senaite.referral.utils import get_samples_sort_keys
+from senaite.referral.utils import to_uids
 from zope import schema
+from zope.annotation.interfaces import IAnnotations
 from zope.interface import implementer
 
 from bika.lims import api
 from bika.lims.interfaces import IAnalysisRequest
 
+# Storage with the (sort key, uid) of the samples assigned to the shipment
+SAMPLES_STORAGE = "senaite.referral.outbound_shipment_samples"
+
+# Storage with the sort keys of the samples assigned to the shipment, by uid
+SAMPLES_INDEX_STORAGE = "senaite.referral.outbound_shipment_samples_index"
+
+# Storage with the order the sort keys of the samples were built for
+SAMPLES_ORDER_STORAGE = "senaite.referral.outbound_shipment_samples_order"
+
+# Orders supported for the samples of a shipment. Samples are kept in the
+# order they were added for any other value
+SAMPLES_ORDERS = ("sid", "created")
+
 
 class IOutboundSampleShipmentSchema(model.Schema):
     """OutboundSampleShipment content schema
@@ -72,6 +88,8 @@ class IOutboundSampleShipmentSchema(model.Schema):
         readonly=True,
     )
 
+    # Legacy storage of the samples assigned to the shipment. Samples are now
+    # kept in annotations, see OutboundSampleShipment.getRawSamples
     directives.omitted("samples")
     samples = schema.List(
         title=_(u"Samples"),
@@ -172,10 +190,47 @@ class OutboundSampleShipment(Container):
         """
         return get_action_date(self, "cancel_outbound_shipment", default=None)
 
+    def _get_samples_storage(self, create=False):
+        """Returns a tuple with the set of (sort key, uid) of the samples
+        assigned to this shipment and the mapping of uids to sort keys. Moves
+        the samples from the legacy "samples" field on creation. Returns
+        (None, None) if the storage does not exist and create is False
+        """
+        annotations = IAnnotations(self)
+        samples = annotations.get(SAMPLES_STORAGE)
+        if samples is None:
+            if not create:
+                return None, None
+
+            # migrate from the legacy field, keeping the order
+            uids = get_uids_field_value(self, "samples")
+            keys = get_samples_sort_keys(uids, "keep")
+            samples = OOTreeSet([(keys[uid], uid) for uid in uids])
+            annotations[SAMPLES_STORAGE] = samples
+            annotations[SAMPLES_INDEX_STORAGE] = OOBTree(keys)
+            annotations[SAMPLES_ORDER_STORAGE] = "keep"
+            setter = mutator(self, "samples")
+            setter(self, [])
+
+        return samples, annotations[SAMPLES_INDEX_STORAGE]
+
+    def iterRawSamples(self):
+        """Iterates over the uids of the samples assigned to this shipment, in
+        accordance with the order set in system settings
+        """
+        samples, index = self._get_samples_storage()
+        if samples is None:
+            for uid in get_uids_field_value(self, "samples"):
+                yield uid
+            return
+
+        for key, uid in samples:
+            yield uid
+
     def getRawSamples(self):
         """Returns the list of sample uids assigned to this shipment
         """
-        return get_uids_field_value(self, "samples")
+        return list(self.iterRawSamples())
 
     def getSamples(self):
         """Returns the list of samples assigned to this shipment
@@ -186,33 +241,54 @@ class OutboundSampleShipment(Container):
     def setSamples(self, samples):
         """Assigns the samples assigned to this shipment
         """
-        # sort the samples in accordance with system settings
-        order = get_outbound_samples_order()
-        if order == "sid":
-            # sort by sample id
-            samples = sorted(samples, cmp=cmp_by_id)
-        elif order == "created":
-            # sort by creation date
-            samples = sorted(samples, cmp=cmp_by_created)
-
-        # store as uids
-        uids = list(map(api.get_uid, samples))
-        setter = mutator(self, "samples")
-        setter(self, uids)
+        values = list(samples or [])
+        storage, index = self._get_samples_storage(create=True)
+        storage.clear()
+        index.clear()
+        self.addSamples(values)
 
     def addSample(self, value):
         """Adds a sample to this shipment
         """
         if not value:
             return
+        self.addSamples([value])
 
-        uids = self.getRawSamples()
-        sample_uid = api.get_uid(value)
-        if sample_uid in uids:
+    def addSamples(self, values):
+        """Adds the samples passed-in to this shipment. Each sample is stored
+        with its own sort key, so the samples already assigned are not
+        rewritten and concurrent additions do not conflict, unless the order
+        set in system settings changed since they were added
+        """
+        samples, index = self._get_samples_storage(create=True)
+        uids = to_uids(filter(None, values))
+        uids = [uid for uid in uids if uid not in index]
+        if not uids:
             return
 
-        uids.append(sample_uid)
-        self.setSamples(uids)
+        # sort the samples in accordance with system settings
+        order = get_outbound_samples_order()
+        if order not in SAMPLES_ORDERS:
+            order = "keep"
+
+        # keys built for different orders are not comparable. Re-key the
+        # samples assigned already if the order changed since they were added
+        annotations = IAnnotations(self)
+        if annotations.get(SAMPLES_ORDER_STORAGE) != order:
+            uids = [uid for key, uid in samples] + uids
+            samples.clear()
+            index.clear()
+            annotations[SAMPLES_ORDER_STORAGE] = order
+
+        # with "keep" order, new samples go after the last one
+        start = 0
+        if order == "keep" and samples:
+            start = api.to_int(samples.maxKey()[0], 0) + 1
+
+        keys = get_samples_sort_keys(uids, order, start=start)
+        for uid in uids:
+            samples.insert((keys[uid], uid))
+            index[uid] = keys[uid]
 
     def removeSample(self, value):
         """Removes a sample from this shipment
@@ -220,13 +296,14 @@ class OutboundSampleShipment(Container):
         if not value:
             return
 
-        uids = self.getRawSamples()
+        samples, index = self._get_samples_storage(create=True)
         sample_uid = api.get_uid(value)
-        if sample_uid not in uids:
+        key = index.get(sample_uid)
+        if key is None:
             return
 
-        uids.remove(sample_uid)
-        self.setSamples(uids)
+        samples.remove((key, sample_uid))
+        del index[sample_uid]
 
     def in_preparation(self):
         """Return whether the status of the shipment is "preparation"
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+
+import transaction
+from senaite.referral.utils import get_dispatch_max_workers
+
+from bika.lims import api
+
+
+def get_dispatcher():
+    """Returns the dispatcher of the notifications (POST requests) to remote
+    laboratories for the current transaction
+    """
+    txn = transaction.get()
+    for hook, args, kwargs in txn.getBeforeCommitHooks():
+        # notifications might be added while dispatching (e.g. from another
+        # before commit hook), so skip the dispatchers that already did
+        if hook is dispatch and not args[0].dispatched:
+            return args[0]
+
+    dispatcher = Dispatcher()
+    txn.addBeforeCommitHook(dispatch, args=(dispatcher,))
+    return dispatcher
+
+
+def dispatch(dispatcher):
+    """Sends the notifications added to the dispatcher passed-in
+    """
+    dispatcher.dispatch()
+
+
+def send_requests(requests):
+    """Sends the requests (remote_lab, payload, timeout, endpoint) passed-in
+    one after the other and returns the list of responses. Does not access the
+    database, so it can be called from a thread other than the main one
+    """
+    responses = []
+    for remote_lab, payload, timeout, endpoint in requests:
+        response = remote_lab.post(payload, timeout=timeout, endpoint=endpoint)
+        responses.append(response)
+    return responses
+
+
+def dispatch_requests(groups, max_workers=None):
+    """Sends the groups of requests (remote_lab, payload, timeout, endpoint)
+    passed-in. Requests from the same group are sent sequentially, while the
+    groups are sent concurrently through a bounded pool of threads. Yields the
+    list of responses of each group, in the same order as the groups
+    """
+    if not groups:
+        return
+
+    # Initialize the sessions beforehand, they read from the database
+    for group in groups:
+        for request in group:
+            request[0].session
+
+    max_workers = max_workers or get_dispatch_max_workers()
+    workers = min(max_workers, len(groups))
+    if workers < 2:
+        for group in groups:
+            yield send_requests(group)
+        return
+
+    pool = ThreadPool(workers)
+    try:
+        for responses in pool.imap(send_requests, groups):
+            yield responses
+    finally:
+        pool.close()
+        pool.join()
+
+
+class Dispatcher(object):
+    """Collects the notifications (POST requests) to remote laboratories and
+    sends them grouped by laboratory. Notifications for the same laboratory
+    are sent in the same order they were added, while notifications for
+    different laboratories are sent concurrently. The responses are stored
+    from the main thread once all them have been received
+    """
+
+    def __init__(self):
+        self.queues = OrderedDict()
+        self.dispatched = False
+
+    def add(self, remote_lab, obj, payload, timeout=5, endpoint="push"):
+        """Adds a notification about the object or objects passed-in
+        """
+        key = api.get_uid(remote_lab.laboratory)
+        if key not in self.queues:
+            self.queues[key] = (remote_lab, [])
+        self.queues[key][1].append((obj, payload, timeout, endpoint))
+
+    def dispatch(self):
+        """Sends the notifications and stores the responses
+        """
+        self.dispatched = True
+        queues = self.queues.values()
+        self.queues = OrderedDict()
+
+        groups = []
+        for remote_lab, items in queues:
+            group = [(remote_lab, payload, timeout, endpoint)
+                     for obj, payload, timeout, endpoint in items]
+            groups.append(group)
+
+        responses = list(dispatch_requests(groups))
+        for (remote_lab, items), group_responses in zip(queues, responses):
+            for item, response in zip(items, group_responses):
+                obj, payload = item[:2]
+                remote_lab.store(obj, payload, response)
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import hashlib
+import threading
+import time
+
+from requests import Response
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+
+HEALTH_STORAGE = "senaite.referral.health"
+
+# Storage of the fingerprint of the url and credentials of a laboratory
+CONNECTION_STORAGE = "senaite.referral.connection"
+
+# Min seconds between two writes of the health of a laboratory in the
+# database, unless its status changes. Prevents conflicts on the laboratory
+# when many notifications are sent at the same time
+HEALTH_WRITE_INTERVAL = 60
+
+# Weight of the last request in the rolling average of the latency
+LATENCY_WEIGHT = 0.2
+
+# Health status of a laboratory
+HEALTHY = "healthy"
+FAILING = "failing"
+UNREACHABLE = "unreachable"
+
+# HTTP status codes that denote the remote laboratory is not available. Note
+# senaite.jsonapi replies with a 500 when the data is not valid, so this is
+# not considered an availability failure
+UNAVAILABLE_STATUSES = [502, 503, 504]
+
+
+def is_unavailable(response):
+    """Returns whether the response passed-in denotes the remote laboratory
+    could not be reached or is not available
+    """
+    if isinstance(response, Response):
+        return response.status_code in UNAVAILABLE_STATUSES
+    # dummy response, the POST was not even done
+    return True
+
+
+def get_elapsed(response):
+    """Returns the seconds elapsed for the response passed-in
+    """
+    if isinstance(response, Response):
+        return response.elapsed.total_seconds()
+    return response.get("elapsed", 0)
+
+
+class HealthRegistry(object):
+    """Keeps track of the health of remote laboratories in memory and acts as
+    a circuit breaker: after a number of consecutive failures, no more
+    requests are allowed for the laboratory until a cool-down period passes.
+    Then, a single request is allowed (half-open) to probe the laboratory.
+    Does not access the database, so it can be used from any thread
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._health = {}
+
+    def seed(self, key, health):
+        """Sets the health of the laboratory with the given key, unless known
+        """
+        with self._lock:
+            if key not in self._health:
+                self._health[key] = dict(health or {})
+
+    def forget(self, key):
+        """Removes the health of the laboratory with the given key
+        """
+        with self._lock:
+            self._health.pop(key, None)
+
+    def get(self, key):
+        """Returns a copy of the health of the laboratory with the given key
+        or None if not known
+        """
+        with self._lock:
+            health = self._health.get(key)
+            return dict(health) if health is not None else None
+
+    def allow(self, key, threshold, cooldown, now=None):
+        """Returns whether a request to the laboratory with the given key is
+        allowed, taking the failure threshold and cool-down passed-in
+        """
+        if threshold < 1:
+            return True
+
+        now = now or time.time()
+        with self._lock:
+            health = self._health.setdefault(key, {})
+            if health.get("failures", 0) < threshold:
+                return True
+            if now - health.get("last_failure", 0) < cooldown:
+                return False
+            if health.get("probing", 0) > now - cooldown:
+                # a probe request is in progress already
+                return False
+            health["probing"] = now
+            return True
+
+    def is_open(self, key, threshold, cooldown, now=None):
+        """Returns whether the circuit for the laboratory with the given key is
+        open, so no requests are allowed until the cool-down period passes.
+        Unlike `allow`, it does not start a probe request
+        """
+        if threshold < 1:
+            return False
+
+        now = now or time.time()
+        with self._lock:
+            health = self._health.get(key) or {}
+            if health.get("failures", 0) < threshold:
+                return False
+            return now - health.get("last_failure", 0) < cooldown
+
+    def get_reopen_time(self, key, cooldown):
+        """Returns the time (in seconds since the epoch) from which a request
+        to the laboratory with the given key is allowed again
+        """
+        with self._lock:
+            health = self._health.get(key) or {}
+            return health.get("last_failure", 0) + cooldown
+
+    def record(self, key, response, threshold, now=None):
+        """Updates the health of the laboratory with the given key with the
+        response passed-in
+        """
+        now = now or time.time()
+        elapsed = get_elapsed(response)
+        with self._lock:
+            health = self._health.setdefault(key, {})
+            health["probing"] = 0
+            if is_unavailable(response):
+                health["failures"] = health.get("failures", 0) + 1
+                health["last_failure"] = now
+            else:
+                health["failures"] = 0
+                health["last_success"] = now
+                latency = health.get("latency")
+                if latency is not None:
+                    elapsed = LATENCY_WEIGHT * elapsed \
+                              + (1 - LATENCY_WEIGHT) * latency
+                health["latency"] = elapsed
+
+            failures = health["failures"]
+            if not failures:
+                health["status"] = HEALTHY
+            elif threshold and failures >= threshold:
+                health["status"] = UNREACHABLE
+            else:
+                health["status"] = FAILING
+
+
+# Health of the remote laboratories known by this process, keyed by UID
+health_registry = HealthRegistry()
+
+
+def get_health(laboratory):
+    """Returns a dict with the health of the laboratory passed-in: status,
+    consecutive failures, last success, last failure and rolling latency
+    """
+    health = health_registry.get(api.get_uid(laboratory))
+    if health is None:
+        health = IAnnotations(laboratory).get(HEALTH_STORAGE)
+    return dict(health or {})
+
+
+def persist_health(laboratory, now=None):
+    """Stores the health of the laboratory passed-in, as known by this process,
+    in the database. The health is only written if the status changed or
+    enough time passed since the last write
+    """
+    health = health_registry.get(api.get_uid(laboratory))
+    if not health:
+        return
+
+    now = now or time.time()
+    annotations = IAnnotations(laboratory)
+    stored = annotations.get(HEALTH_STORAGE) or {}
+    if stored.get("status") == health.get("status"):
+        if now - stored.get("updated", 0) < HEALTH_WRITE_INTERVAL:
+            return
+
+    health.pop("probing", None)
+    health["updated"] = now
+    annotations[HEALTH_STORAGE] = health
+
+
+def get_connection_fingerprint(laboratory):
+    """Returns a digest of the url and credentials of the laboratory passed-in
+    """
+    values = [laboratory.getUrl(), laboratory.getUsername(),
+              laboratory.getPassword()]
+    values = [api.to_utf8(value or "") for value in values]
+    return hashlib.sha1(b"\n".join(values)).hexdigest()
+
+
+def update_connection(laboratory):
+    """Stores the fingerprint of the url and credentials of the laboratory
+    passed-in. Returns whether they changed since last time
+    """
+    fingerprint = get_connection_fingerprint(laboratory)
+    annotations = IAnnotations(laboratory)
+    if annotations.get(CONNECTION_STORAGE) == fingerprint:
+        return False
+    annotations[CONNECTION_STORAGE] = fingerprint
+    return True
+
+
+def reset_health(laboratory):
+    """Resets the health of the laboratory passed-in, so the circuit is closed
+    and the next POST is sent
+    """
+    health_registry.forget(api.get_uid(laboratory))
+    annotations = IAnnotations(laboratory)
+    if annotations.get(HEALTH_STORAGE) is not None:
+        del annotations[HEALTH_STORAGE]
@@ -112,3 +112,13 @@ class IRemoteContent(Interface):
     """Marker interface for objects that maintain a reference to corresponding
     referral content in a remote laboratory
     """
+
+
+class IReferralObjectInfo(Interface):
+    """Adapter that returns the information of an object that is required by
+    the referral protocol when notifying a remote laboratory
+    """
+
+    def to_dict(self):
+        """Returns a dict with the information of the object
+        """
@@ -17,3 +17,5 @@
 #
 # Copyright 2021-2022 by it's authors.
 # Some rights reserved, see README and LICENSE.
+
+from senaite.referral.jsonapi import routes  # noqa
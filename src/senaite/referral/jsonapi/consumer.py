@@ -19,17 +19,32 @@
 # Some rights reserved, see README and LICENSE.
 
 import copy
+from collections import OrderedDict
 
 import json
+import transaction
 from plone.memoize.instance import memoize
 from senaite.jsonapi.interfaces import IPushConsumer
+from senaite.referral import logger
 from senaite.referral import utils
 from senaite.referral.catalog import SHIPMENT_CATALOG
+from senaite.referral.config import PROTOCOL_VERSION
+from senaite.referral.metrics import instrument_consumer
+from senaite.referral.interfaces import IInboundSampleShipment
+from senaite.referral.interfaces import IOutboundSampleShipment
+from senaite.referral.notifications import get_post_base_info
+from senaite.referral.notifications import get_post_info
+from senaite.referral.notifications import get_posts
+from senaite.referral.notifications import save_post
 from senaite.referral.workflow import change_workflow_state
+from senaite.referral.workflow import do_queue_or_action_for
+from senaite.referral.workflow import get_queue_chunk_size
+from ZODB.POSException import ConflictError
 from zope.interface import implementer
 
 from bika.lims import api
 from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
+from bika.lims.interfaces import IAnalysisRequest
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import isTransitionAllowed
 
@@ -51,8 +66,19 @@ class BaseConsumer(object):
                 self._data[key] = self.get_record(self.raw_data, key)
         return self._data
 
+    @property
+    def protocol(self):
+        """Returns the version of the referral protocol the payload was sent
+        with. Former versions do not set the version explicitly
+        """
+        return api.to_int(self.raw_data.get("protocol"), default=1)
+
     def get_record(self, payload, id):
         record = payload.get(id)
+        if self.protocol >= PROTOCOL_VERSION:
+            # Payload was sent as a single JSON document. The values are
+            # already decoded and owned by this request, no need to copy
+            return record
         if isinstance(record, (list, tuple, list, dict)):
             return copy.deepcopy(record)
         try:
@@ -79,6 +105,15 @@ class ReferralConsumer(BaseConsumer):
     """Handles push requests for name senaite.referral.consumer
     """
 
+    # Actions to be performed asynchronously, as action: [(obj, remote_uid)]
+    deferred = None
+
+    # Item from the POST request that is being processed
+    current_item = None
+
+    # Outcome of the request, reported back to the remote laboratory
+    results = None
+
     @property
     def items(self):
         return self.get_value(self.data, "items")
@@ -96,6 +131,7 @@ class ReferralConsumer(BaseConsumer):
         """
         return utils.get_by_code("ExternalLaboratory", self.lab_code)
 
+    @instrument_consumer("senaite.referral.consumer")
     def process(self):
         """Processes the data sent via POST in accordance with the value for
         'action' parameter of the POST request
@@ -118,8 +154,18 @@ class ReferralConsumer(BaseConsumer):
         # see https://github.com/senaite/senaite.referral/pull/21
         default_action = self.get_value(self.data, "action", default=None)
 
+        # Defer the actions to the queue if possible and the laboratory
+        # accepts it. Counterparts are resolved and validated here, but
+        # actions are performed in chunks afterwards
+        chunk_size = 0
+        if laboratory.getDeferredActions():
+            chunk_size = get_queue_chunk_size("referral_consumer")
+        if chunk_size > 0:
+            self.deferred = OrderedDict()
+
         # Iterate through items and process them
         for item in self.items:
+            self.current_item = item
 
             # Try to delegate to an existing function
             portal_type = self.get_value(item, "portal_type").lower()
@@ -135,12 +181,19 @@ class ReferralConsumer(BaseConsumer):
                 # Rely on default 'do_action'
                 self.do_action(item, action)
 
+        self.current_item = None
+        if self.deferred:
+            tasks = queue_actions(laboratory, self.deferred,
+                                  chunk_size=chunk_size)
+            self.results = {
+                "task_uids": [task.task_uid for task in filter(None, tasks)],
+                "queued": sum(map(len, self.deferred.values())),
+            }
         return True
 
     def do_analysisrequest_reject(self, item):
         """Rejects a referred sample
         """
-        # TODO Performance - convert to queue task
         rejection_reasons = self.get_value(item, "RejectionReasons")
         obj = self.get_object_for(item)
         obj.setRejectionReasons(rejection_reasons)
@@ -156,40 +209,21 @@ class ReferralConsumer(BaseConsumer):
             self.do_action(sample, "reject_at_reference")
 
     def do_action(self, item_or_object, action):
-        """Performs an action against the given object
+        """Performs an action against the given object, or defers the action
+        to the queue if the consumer processes the items asynchronously
         """
-        # TODO Performance - convert to queue task
         # Get the object counterpart
         obj = self.get_object_for(item_or_object)
 
-        # Prevent callbacks to referring lab for these same items
-        request = api.get_request()
-        skip = request.get("skip_post_action_uids", [])
-        skip.append(api.get_uid(obj))
-        request.set("skip_post_action_uids", skip)
-
-        # Try with basic transition machinery
-        if isTransitionAllowed(obj, action):
-            doActionFor(obj, action)
-            return
-
-        # Check whether the action was performed already
-        history = api.get_review_history(obj)
-        if history and history[0].get("action", None) == action:
+        if self.deferred is None:
+            do_action_for(obj, action)
             return
 
-        # Do force the transition
-        # TODO Remove force the transition
-        workflows = api.get_workflows_for(obj)
-        wf_tool = api.get_tool("portal_workflow")
-        for wf_id in workflows:
-            workflow = wf_tool.getWorkflowById(wf_id)
-            if action not in workflow.transitions:
-                continue
-            transition = workflow.transitions[action]
-            status = transition.new_state_id
-            kwargs = {"action": action}
-            change_workflow_state(obj, wf_id, status, **kwargs)
+        # Keep track of the item the action relates to, so the outcome can be
+        # reported back to the remote laboratory
+        remote_uid = self.get_value(self.current_item or {}, "uid",
+                                    default=None)
+        self.deferred.setdefault(action, []).append((obj, remote_uid))
 
     def get_counterpart_type(self, portal_type):
         """Returns the counterpart type for the portal type passed in
@@ -281,3 +315,244 @@ class ReferralConsumer(BaseConsumer):
         """
         statuses = ["invalid", "invalidated_at_reference"]
         return api.get_review_status(sample) in statuses
+
+
+@implementer(IPushConsumer)
+class ActionResultsConsumer(BaseConsumer):
+    """Handles push requests for name senaite.referral.action_results
+    Receives the outcomes of the actions a remote laboratory performed
+    asynchronously and flags the notifications that failed, so they can be
+    retried
+    """
+
+    # Outcome of each item, reported back to the remote laboratory
+    results = None
+
+    @property
+    def items(self):
+        return self.get_value(self.data, "items")
+
+    def process(self):
+        """Stores a failed notification for the objects whose actions could
+        not be performed by the remote laboratory
+        """
+        lab_code = self.get_value(self.data, "lab_code")
+        laboratory = utils.get_by_code("ExternalLaboratory", lab_code)
+        if not laboratory:
+            raise ValueError("Laboratory not found: {}".format(lab_code))
+
+        # Only laboratories that perform actions asynchronously report them
+        if not laboratory.getDeferredActions():
+            raise ValueError("Deferred actions not enabled for {}".format(
+                lab_code))
+
+        self.results = []
+        for item in self.items:
+            result = {
+                "uid": item.get("uid"),
+                "success": True,
+                "message": "",
+            }
+            try:
+                self.process_item(laboratory, item)
+            except ValueError as e:
+                result.update({
+                    "success": False,
+                    "message": str(e),
+                })
+            self.results.append(result)
+
+        return True
+
+    def process_item(self, laboratory, item):
+        """Stores a failed notification for the object the item passed-in
+        refers to, unless the remote laboratory succeeded
+        """
+        if utils.is_true(item.get("success")):
+            return
+
+        uid = self.get_value(item, "uid")
+        obj = api.get_object_by_uid(uid, default=None)
+        if not obj:
+            raise ValueError("Object not found: {}".format(uid))
+
+        # Only the laboratory the object was sent to or received from can
+        # report the outcome of its actions
+        lab_uid = api.get_uid(laboratory)
+        if lab_uid not in map(api.get_uid, get_laboratories_for(obj)):
+            raise ValueError("Object not found: {}".format(uid))
+
+        # Store the failure along with the payload of the notification the
+        # remote laboratory received, so it can be sent again
+        post = get_action_post(obj, item.get("actions"))
+        if not post:
+            raise ValueError("No notification found for {}".format(uid))
+
+        data = get_post_base_info()
+        data.update({
+            "url": post.get("url", ""),
+            "message": item.get("message", ""),
+            "content_json": item,
+        })
+        save_post(obj, post.get("payload", ""), data)
+
+
+def get_laboratories_for(obj):
+    """Returns the external laboratories the object passed-in was sent to or
+    received from, through its shipments
+    """
+    shipments = [obj]
+    if IAnalysisRequest.providedBy(obj):
+        shipments = [obj.getOutboundShipment(), obj.getInboundShipment()]
+
+    laboratories = []
+    for shipment in shipments:
+        if IOutboundSampleShipment.providedBy(shipment):
+            laboratories.append(shipment.getReferenceLaboratory())
+        elif IInboundSampleShipment.providedBy(shipment):
+            laboratories.append(shipment.getReferringLaboratory())
+    return filter(None, laboratories)
+
+
+def get_action_post(obj, actions=None):
+    """Returns the last notification (POST request) sent about the object
+    passed-in that requested any of the actions passed-in to the remote
+    laboratory. Returns None if no notification was found
+    """
+    uid = api.get_uid(obj)
+    for post in reversed(list(get_posts(obj))):
+        payload = post.get("payload") or {}
+        if not isinstance(payload, dict):
+            continue
+        if payload.get("consumer") != "senaite.referral.consumer":
+            continue
+        for item in payload.get("items") or []:
+            if item.get("uid") != uid:
+                continue
+            if not actions or item.get("action") in actions:
+                return post
+    return None
+
+
+def do_action_for(obj, action):
+    """Performs an action requested by a remote laboratory against the given
+    object. Forces the transition if not allowed
+    """
+    # Prevent callbacks to referring lab for these same items
+    request = api.get_request()
+    skip = request.get("skip_post_action_uids", [])
+    skip.append(api.get_uid(obj))
+    request.set("skip_post_action_uids", skip)
+
+    # Try with basic transition machinery
+    if isTransitionAllowed(obj, action):
+        doActionFor(obj, action)
+        return
+
+    # Check whether the action was performed already
+    history = api.get_review_history(obj)
+    if history and history[0].get("action", None) == action:
+        return
+
+    # Do force the transition
+    # TODO Remove force the transition
+    workflows = api.get_workflows_for(obj)
+    wf_tool = api.get_tool("portal_workflow")
+    for wf_id in workflows:
+        workflow = wf_tool.getWorkflowById(wf_id)
+        if action not in workflow.transitions:
+            continue
+        transition = workflow.transitions[action]
+        status = transition.new_state_id
+        kwargs = {"action": action}
+        change_workflow_state(obj, wf_id, status, **kwargs)
+
+
+def queue_actions(laboratory, actions, chunk_size=None):
+    """Adds a queue task for each action requested by the laboratory passed-in,
+    as a dict of action: [(obj, remote_uid)]. The uids of the counterparts at
+    the laboratory are kept, so the outcomes can be reported back
+    :returns: the list of tasks added to the queue
+    """
+    tasks = []
+    for action, objects_uids in actions.items():
+        objects = [obj for obj, remote_uid in objects_uids]
+        remote_uids = dict([(api.get_uid(obj), remote_uid)
+                            for obj, remote_uid in objects_uids])
+        task = do_queue_or_action_for(objects, action, context=laboratory,
+                                      chunk_size=chunk_size,
+                                      lab_code=laboratory.getCode(),
+                                      remote_uids=remote_uids)
+        tasks.append(task)
+    return tasks
+
+
+def do_queued_action(uid, action):
+    """Performs an action requested by a remote laboratory that was deferred
+    to the queue. Changes are rolled back if the action fails
+    :returns: a tuple (success, message)
+    """
+    obj = api.get_object_by_uid(uid, default=None)
+    if not obj:
+        return False, "Object not found: {}".format(uid)
+
+    savepoint = transaction.savepoint()
+    try:
+        do_action_for(obj, action)
+    except ConflictError:
+        raise
+    except Exception as e:
+        savepoint.rollback()
+        logger.error("Cannot do '{}' for {}: {}".format(action, uid, str(e)))
+        return False, "Cannot do '{}' for {}: {}".format(
+            action, api.get_id(obj), str(e))
+    return True, ""
+
+
+def report_outcomes(laboratory, outcomes):
+    """Sends the outcomes of the actions requested by the laboratory passed-in
+    back, grouped by the item of the original request
+    """
+    # Prevent circular dependencies
+    from senaite.referral.remotelab import get_remote_connection
+
+    items = OrderedDict()
+    for outcome in outcomes:
+        remote_uid, success, message = outcome[:3]
+        if not remote_uid:
+            continue
+        item = items.setdefault(remote_uid, {
+            "uid": remote_uid,
+            "success": True,
+            "message": "",
+            "actions": [],
+        })
+        if not success:
+            item["success"] = False
+            item["message"] = "; ".join(filter(None, [item["message"],
+                                                      message]))
+            # outcomes from former versions do not keep the action
+            if len(outcome) > 3:
+                item["actions"].append(outcome[3])
+
+    # Former versions of the laboratory do not support the consumer
+    if not laboratory.getDeferredActions():
+        return
+
+    remote_lab = get_remote_connection(laboratory)
+    if not all([items, remote_lab]):
+        return
+
+    # The report is not stored in the laboratory. Failures are kept by the
+    # remote laboratory in the objects the actions were requested for
+    payload = {
+        "consumer": "senaite.referral.action_results",
+        "items": items.values(),
+    }
+    data = remote_lab.get_notification_data(payload)
+    response = remote_lab.post(data)
+    if not isinstance(response, dict):
+        response = get_post_info(response)
+    if not response.get("success"):
+        logger.error("Cannot report the outcomes of {} actions to {}".format(
+            len(outcomes), laboratory.getCode()))
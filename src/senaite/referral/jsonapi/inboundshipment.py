@@ -25,14 +25,32 @@ from Products.ATContentTypes.utils import DT2dt
 from Products.CMFCore.permissions import AddPortalContent
 from senaite.jsonapi.interfaces import IPushConsumer
 from senaite.jsonapi.request import is_json_deserializable
+from senaite.referral import logger
 from senaite.referral import utils
+from senaite.referral.catalog import INBOUND_SAMPLE_CATALOG
 from senaite.referral.catalog import SHIPMENT_CATALOG
+from senaite.referral.metrics import instrument_consumer
+from senaite.referral.workflow import get_queue_chunk_size
 from zope.annotation.interfaces import IAnnotations
 from zope.interface import implementer
 
 from bika.lims import api
 from bika.lims.api.security import revoke_permission_for
 
+try:
+    from senaite.queue.api import add_task
+    from senaite.queue.api import is_queued
+except ImportError:
+    # Queue is not installed
+    is_queued = None
+
+# Name of the queue task that creates the inbound samples of a shipment
+CREATE_INBOUND_SAMPLES_TASK = "task_referral_create_inbound_samples"
+
+# Annotation key where the number of inbound samples the referring laboratory
+# sent along with the shipment is stored
+EXPECTED_SAMPLES_STORAGE = "senaite.referral.expected_samples"
+
 
 @implementer(IPushConsumer)
 class InboundShipmentConsumer(object):
@@ -43,7 +61,9 @@ class InboundShipmentConsumer(object):
 
     def __init__(self, data):
         self.data = data
+        self.results = None
 
+    @instrument_consumer("senaite.referral.inbound_shipment")
     def process(self):
         """Processes the data sent via POST. Imports the inbound shipment by
         creating the necessary samples and analyses
@@ -82,8 +102,7 @@ class InboundShipmentConsumer(object):
             raise ValueError("Inbound shipment already exists: {}"
                              .format(shipment_id))
 
-        # Create the Inbound Shipment and the Inbound Samples
-        # TODO Performance - convert to queue task
+        # Create the Inbound Shipment. Inbound Samples are created afterwards
         comments = self.data.get("comments", "")
         values = {
             "shipment_id": str(shipment_id),
@@ -95,13 +114,15 @@ class InboundShipmentConsumer(object):
             "samples": sample_records,
         }
         shipment = api.create(lab, "InboundSampleShipment", **values)
-        for record in sample_records:
-            self.create_inbound_sample(shipment, record)
+        annotation = IAnnotations(shipment)
+        annotation[EXPECTED_SAMPLES_STORAGE] = len(sample_records)
 
-        # Disallow the "Add portal content" permission so no more InboundSample
-        # objects can be added (and the "Add new..." menu item is not displayed)
-        revoke_permission_for(shipment, AddPortalContent, [])
+        # Create the inbound samples, asynchronously if possible
+        task = queue_or_create_inbound_samples(shipment, sample_records)
 
+        # Acknowledgement the sender can use to poll the status of the import
+        self.results = get_import_status(shipment)
+        self.results["task_uid"] = task and task.task_uid or None
         return True
 
     def get_inbound_shipment(self, shipment_id, laboratory, full_object=False):
@@ -177,18 +198,110 @@ class InboundShipmentConsumer(object):
         """Creates an inbound sample inside the shipment with the information
         provided
         """
-        date_sampled = api.to_date(record.get("date_sampled"))
-        values = {
-            "referring_id": record.get("id"),
-            "date_sampled": date_sampled,
-            "sample_type": record.get("sample_type"),
-            "priority": record.get("priority", ""),
-            "analyses": record.get("analyses"),
-        }
-        inbound_sample = api.create(shipment, "InboundSample", **values)
+        return create_inbound_sample(shipment, record)
+
+
+def create_inbound_sample(shipment, record):
+    """Creates an inbound sample inside the shipment with the information
+    provided
+    """
+    date_sampled = api.to_date(record.get("date_sampled"))
+    values = {
+        "referring_id": record.get("id"),
+        "date_sampled": date_sampled,
+        "sample_type": record.get("sample_type"),
+        "priority": record.get("priority", ""),
+        "analyses": record.get("analyses"),
+    }
+    inbound_sample = api.create(shipment, "InboundSample", **values)
+
+    # Store original data in annotations
+    annotation = IAnnotations(inbound_sample)
+    annotation["__original__"] = json.dumps(record)
+
+    return inbound_sample
+
+
+def get_inbound_samples_brains(shipment, **kwargs):
+    """Returns the catalog brains of the inbound samples of the shipment
+    passed-in, so they are not woken up
+    """
+    query = dict(kwargs, portal_type="InboundSample",
+                 shipment_uid=api.get_uid(shipment))
+    return api.search(query, INBOUND_SAMPLE_CATALOG)
+
 
-        # Store original data in annotations
-        annotation = IAnnotations(inbound_sample)
-        annotation["__original__"] = json.dumps(record)
+def create_inbound_samples(shipment, records):
+    """Creates the inbound samples inside the shipment for the records
+    passed-in. Records for which an inbound sample exists already in the
+    shipment are skipped, so the creation can be safely resumed
+    :returns: the list of inbound samples created
+    """
+    ids = filter(None, [rec.get("id") for rec in records])
+    brains = get_inbound_samples_brains(shipment, referring_id=ids)
+    existing = [brain.referring_id for brain in brains]
+    records = filter(lambda rec: rec.get("id") not in existing, records)
+    return map(lambda rec: create_inbound_sample(shipment, rec), records)
+
+
+def create_inbound_samples_chunk(shipment, records, chunk_size):
+    """Creates the inbound samples for the first chunk of records passed-in
+    and closes the shipment if there are no more records to process
+    :returns: the records that remain to be processed
+    """
+    chunk_size = max(api.to_int(chunk_size, 0), 0) or len(records)
+    samples = create_inbound_samples(shipment, records[:chunk_size])
+    logger.info("Created {} inbound samples in {}".format(
+        len(samples), api.get_path(shipment)))
+
+    remaining = records[chunk_size:]
+    if not remaining:
+        # No more records to process
+        close_inbound_shipment(shipment)
+    return remaining
+
+
+def close_inbound_shipment(shipment):
+    """Disallows the addition of more inbound samples to the shipment
+    """
+    # Disallow the "Add portal content" permission so no more InboundSample
+    # objects can be added (and the "Add new..." menu item is not displayed)
+    revoke_permission_for(shipment, AddPortalContent, [])
+
+
+def queue_or_create_inbound_samples(shipment, records, **kwargs):
+    """Adds and returns a queue task for the creation of the inbound samples
+    of the shipment if the queue is available. Otherwise, creates the inbound
+    samples right-away, closes the shipment and returns None
+    """
+    chunk_size = kwargs.pop("chunk_size", None)
+    chunk_size = get_queue_chunk_size("create_inbound_sample", chunk_size)
+    if 0 < chunk_size < len(records):
+        # queue is installed and ready
+        kwargs.update({
+            "records": records,
+            "chunk_size": chunk_size,
+            "unique": True,
+        })
+        return add_task(CREATE_INBOUND_SAMPLES_TASK, shipment, **kwargs)
 
-        return inbound_sample
+    create_inbound_samples(shipment, records)
+    close_inbound_shipment(shipment)
+    return None
+
+
+def get_import_status(shipment):
+    """Returns a dict with the status of the import of the inbound samples
+    sent by the referring laboratory for the shipment passed-in
+    """
+    created = len(get_inbound_samples_brains(shipment))
+    expected = IAnnotations(shipment).get(EXPECTED_SAMPLES_STORAGE, created)
+    queued = callable(is_queued) and is_queued(shipment)
+    return {
+        "uid": api.get_uid(shipment),
+        "shipment_id": shipment.getShipmentID(),
+        "expected": expected,
+        "created": created,
+        "queued": queued,
+        "complete": not queued and created >= expected,
+    }
@@ -22,15 +22,21 @@ import copy
 import json
 from datetime import datetime
 
+import transaction
 from senaite.core.workflow import ANALYSIS_WORKFLOW
 from senaite.jsonapi.exceptions import APIError
 from senaite.jsonapi.interfaces import IPushConsumer
 from senaite.referral.api import get_object_by_remote_uid
+from senaite.referral.api import get_remote_uid
 from senaite.referral.api import link_remote_resource
 from senaite.referral.api import unlink_remote_resource
+from senaite.referral.config import PROTOCOL_VERSION
+from senaite.referral.metrics import instrument_consumer
+from senaite.referral.reindex import reindex_on_commit
 from senaite.referral.remote.resource import RemoteResource
 from senaite.referral.utils import get_create_reference_analyses
 from senaite.referral.utils import get_services_mapping
+from ZODB.POSException import ConflictError
 from zope.interface import alsoProvides
 from zope.interface import implementer
 
@@ -53,17 +59,63 @@ class OutboundSampleConsumer(object):
 
     def __init__(self, data):
         self.data = data
+        self.results = None
 
+    @instrument_consumer("senaite.referral.outbound_sample")
     def process(self):
         """Processes the data sent via POST. Look for sample and updates their
-        analyses in accordance with the received data
+        analyses in accordance with the received data. If the data contains a
+        list of samples, each sample is processed on its own and the outcome
+        for each one is kept in `results`
         """
         # Validate data first
         data = self.get_data()
+        if "samples" in data:
+            return self.process_samples(data.get("samples"))
+
         self.validate(data)
+        sample_resource = RemoteResource(data.get("sample"))
+        return self.process_sample(sample_resource)
 
+    def process_samples(self, records):
+        """Processes the sample records passed-in. A failure while processing
+        a sample does not prevent the rest from being processed, but the
+        changes made for that sample are discarded
+        """
+        if not isinstance(records, (list, tuple)):
+            raise ValueError("Field is not a list: 'samples'")
+
+        self.results = []
+        for record in records:
+            result = {
+                "uid": record.get("uid"),
+                "referring_id": record.get("referring_id"),
+                "success": True,
+                "message": "",
+            }
+            savepoint = transaction.savepoint()
+            try:
+                self.validate_sample(record)
+                self.process_sample(RemoteResource(record))
+            except ConflictError:
+                # let the publisher retry the whole request
+                raise
+            except Exception as e:
+                savepoint.rollback()
+                message = getattr(e, "message", None) or str(e)
+                result.update({
+                    "success": False,
+                    "message": "{}: {}".format(type(e).__name__, message),
+                })
+            self.results.append(result)
+
+        return True
+
+    def process_sample(self, sample_resource):
+        """Updates the analyses of the counterpart sample in accordance with
+        the remote resource passed-in
+        """
         # Find the counterpart sample in current instance
-        sample_resource = RemoteResource(data.get("sample"))
         sample = self.get_sample(sample_resource)
 
         # If the sample is invalidated, update the retest instead
@@ -106,6 +158,10 @@ class OutboundSampleConsumer(object):
         analyses = sample_resource.get("analyses")
         analyses = sorted(analyses, key=lambda s: s.get("id"))
 
+        # load the analyses from the sample once, so records are matched
+        # against them without further searches
+        analyses_map = self.get_analyses_map(sample)
+
         # update the analyses from current instance
         for record in analyses:
 
@@ -113,10 +169,15 @@ class OutboundSampleConsumer(object):
             resource = RemoteResource(record)
 
             # get the analysis to update from the sample
-            analysis = self.find_analysis(sample, resource, create_missing)
+            analysis = self.find_analysis(sample, resource, create_missing,
+                                          analyses_map=analyses_map)
             if not analysis:
                 continue
 
+            # keep track of the remote uid, so retests of this analysis are
+            # found without searches
+            analyses_map["remote"][resource.UID] = analysis
+
             # link the remote resource to this analysis
             link_remote_resource(analysis, resource)
 
@@ -127,12 +188,21 @@ class OutboundSampleConsumer(object):
             # update the analysis
             try:
                 self.update_analysis(analysis, record)
+            except ConflictError:
+                raise
             except Exception as e:
                 raise APIError(500, "{}: {}".format(
                     type(e).__name__, str(e)))
 
         return True
 
+    @property
+    def protocol(self):
+        """Returns the version of the referral protocol the payload was sent
+        with. Former versions do not set the version explicitly
+        """
+        return api.to_int(self.data.get("protocol"), default=1)
+
     def get_data(self):
         out = {}
         for key in self.data.keys():
@@ -141,6 +211,10 @@ class OutboundSampleConsumer(object):
 
     def get_record(self, payload, id):
         record = payload.get(id)
+        if self.protocol >= PROTOCOL_VERSION:
+            # Payload was sent as a single JSON document. The values are
+            # already decoded and owned by this request, no need to copy
+            return record
         if isinstance(record, (list, tuple, list, dict)):
             return copy.deepcopy(record)
         try:
@@ -151,8 +225,12 @@ class OutboundSampleConsumer(object):
     def validate(self, payload):
         """Validates that the payload passed-in is meets the expected format
         """
+        self.validate_sample(payload.get("sample"))
+
+    def validate_sample(self, sample_record):
+        """Validates that the sample record passed-in meets the expected format
+        """
         field_names = ["referring_id", "analyses", "shipment_id"]
-        sample_record = payload.get("sample")
         self.validate_nonempty(field_names, sample_record)
 
         field_names = ["keyword", "formatted_result"]
@@ -209,42 +287,76 @@ class OutboundSampleConsumer(object):
         status = ["referred", "assigned", "unassigned"]
         return api.get_review_status(analysis) in status
 
-    def find_analysis(self, sample, resource, create_missing):
+    def get_analyses_map(self, sample):
+        """Returns a dict with the analyses from the sample passed-in, keyed by
+        remote uid ("remote"), by keyword ("keyword", the newest only) and by
+        uid ("uid"). Analyses are searched and woken up only once
+        """
+        analyses_map = {"remote": {}, "keyword": {}, "uid": {}}
+        query = {
+            "sort_on": "sortable_title",
+            "sort_order": "ascending",
+        }
+        for brain in sample.getAnalyses(**query):
+            analysis = api.get_object(brain)
+            self.map_analysis(analyses_map, analysis,
+                              remote_uid=get_remote_uid(analysis))
+        return analyses_map
+
+    def map_analysis(self, analyses_map, analysis, remote_uid=None):
+        """Adds the analysis passed-in to the analyses map. The analysis
+        replaces the one with same keyword, if any, so only analyses from the
+        sample that are newer than those mapped already must be passed-in
+        """
+        analyses_map["uid"][api.get_uid(analysis)] = analysis
+        analyses_map["keyword"][analysis.getKeyword()] = analysis
+        if remote_uid:
+            analyses_map["remote"][remote_uid] = analysis
+
+    def find_analysis(self, sample, resource, create_missing,
+                      analyses_map=None):
         """Finds and returns the first analysis from the provided sample that
         matches the given resource and is eligible for an update with data from
         the reference laboratory.
         """
-        analysis = resource.getObject()
+        if analyses_map is None:
+            analyses_map = self.get_analyses_map(sample)
+
+        # the analysis might be linked already, even from another sample (e.g
+        # the sample was invalidated). The latter is a lookup by key only
+        analysis = analyses_map["remote"].get(resource.UID)
+        if not analysis:
+            analysis = resource.getObject()
         if analysis:
             return analysis
 
         # do we have to create a retest?
         retest_of = resource.get("retest_of", default=None)
-        retest_of = get_object_by_remote_uid(retest_of, default=None)
+        if retest_of:
+            retest_of = analyses_map["remote"].get(retest_of) or \
+                get_object_by_remote_uid(retest_of, default=None)
         if retest_of:
             # create the retest
-            return create_retest(retest_of)
+            retest = create_retest(retest_of)
+            self.map_analysis(analyses_map, retest)
+            return retest
 
         # search by keyword
         keyword = resource.get("keyword")
         if not keyword:
             return None
 
-        query = {
-            "full_objects": True,
-            "sort_on": "sortable_title",
-            "sort_order": "ascending",
-            "getKeyword": keyword,
-        }
-        analyses = sample.getAnalyses(**query)
-        if not analyses and create_missing:
+        # return the newest
+        analysis = analyses_map["keyword"].get(keyword)
+        if not analysis and create_missing:
             services = get_services_mapping()
             service_uid = services.get(keyword)
             service = api.get_object(service_uid, default=None)
-            return create_analysis(sample, service) if service else None
-
-        # return the newest
-        return analyses[-1] if analyses else None
+            if not service:
+                return None
+            analysis = create_analysis(sample, service)
+            self.map_analysis(analyses_map, analysis)
+        return analysis
 
     def update_analysis(self, analysis, record):
         if not analysis:
@@ -306,7 +418,7 @@ class OutboundSampleConsumer(object):
         doActionFor(analysis, "verify")
 
         # Reindex the analysis
-        analysis.reindexObject()
+        reindex_on_commit(analysis)
 
     def is_invalidated(self, sample):
         """Returns whether the sample was invalidated in present laboratory
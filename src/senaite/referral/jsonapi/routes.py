@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import json
+import zlib
+
+from bika.lims.api.security import check_permission
+from Products.CMFCore.permissions import View
+from senaite.core.permissions import ManageBika
+from senaite.jsonapi import api
+from senaite.jsonapi import request as req
+from senaite.jsonapi.interfaces import IPushConsumer
+from senaite.jsonapi.v1 import add_route
+from senaite.referral.interfaces import IExternalLaboratory
+from senaite.referral.interfaces import IInboundSampleShipment
+from senaite.referral.jsonapi.inboundshipment import get_import_status
+from senaite.referral.retry import retry_failed_notifications
+from senaite.referral.utils import get_by_code
+from senaite.referral.utils import is_true
+from zope.component import queryAdapter
+
+# Max size in bytes of a compressed payload once decompressed. Prevents that
+# a small payload expands to a size the server cannot handle
+MAX_DECOMPRESSED_SIZE = 64 * 1024 * 1024
+
+
+def get_push_records(request):
+    """Returns the records sent with the push request. Payloads sent with
+    gzip content-encoding are a single JSON document, that is decoded at once
+    """
+    encoding = request.getHeader("Content-Encoding") or ""
+    if "gzip" not in encoding.lower():
+        return req.get_request_data()
+
+    try:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(request.get("BODY"),
+                                       MAX_DECOMPRESSED_SIZE + 1)
+        exceeded = len(body) > MAX_DECOMPRESSED_SIZE
+    except (TypeError, ValueError, zlib.error) as e:
+        api.fail(400, "Cannot decode the compressed payload: {}".format(
+            str(e)))
+
+    if exceeded:
+        api.fail(413, "Payload exceeds {} bytes once decompressed".format(
+            MAX_DECOMPRESSED_SIZE))
+
+    try:
+        record = json.loads(body)
+    except (TypeError, ValueError) as e:
+        api.fail(400, "Cannot decode the compressed payload: {}".format(
+            str(e)))
+
+    if not isinstance(record, dict):
+        api.fail(400, "Payload is not a JSON object")
+    return [record]
+
+
+@add_route("/referral/push", "senaite.referral.push", methods=["POST"])
+def push(context, request):
+    """Counterpart of senaite.jsonapi's push route that, besides the overall
+    success, returns the outcome of each item processed by the consumer, if
+    the consumer provides them via its `results` attribute
+    """
+    # disable CSRF
+    req.disable_csrf_protection()
+
+    # Cannot push being an anonymous user!
+    if api.is_anonymous():
+        api.fail(401, "Anonymous user")
+
+    # extract the data from the request
+    records = get_push_records(request)
+    if not records:
+        api.fail(500, "No data sent")
+
+    if len(records) > 1:
+        api.fail(500, "Push with multiple entries is not supported")
+
+    # Get the record containing the data for this push
+    record = records[0]
+
+    # Name of the adapter that will be able to handle this POST data
+    name = record.get("consumer")
+    if not name:
+        api.fail(500, "No consumer name provided")
+
+    consumer = queryAdapter(record, IPushConsumer, name=name)
+    if consumer is None:
+        api.fail(500, "No consumer registered for name={}".format(name))
+
+    try:
+        success = consumer.process()
+    except Exception as e:
+        api.fail(500, str(e))
+
+    response = {
+        "url": api.url_for("senaite.referral.push"),
+        "success": success,
+    }
+
+    results = getattr(consumer, "results", None)
+    if results is not None:
+        response["results"] = results
+    return response
+
+
+@add_route("/referral/retry", "senaite.referral.retry", methods=["POST"])
+def retry(context, request):
+    """Re-sends the failed notifications (POST requests) to the remote
+    laboratories. Accepts the optional parameters "laboratory" (UID or code),
+    "limit" and "force". Returns the summary of the retry
+    """
+    # disable CSRF
+    req.disable_csrf_protection()
+
+    # Only lab managers can retry the notifications
+    portal = api.get_portal()
+    if not check_permission(ManageBika, portal):
+        api.fail(401, "Not allowed")
+
+    data = req.get_json()
+    laboratory = data.get("laboratory")
+    if laboratory:
+        lab = api.get_object_by_uid(laboratory, default=None)
+        if not IExternalLaboratory.providedBy(lab):
+            lab = get_by_code("ExternalLaboratory", laboratory)
+        if not lab:
+            api.fail(404, "Laboratory not found: {}".format(laboratory))
+        laboratory = lab
+
+    limit = data.get("limit")
+    try:
+        limit = int(limit or 0)
+    except (TypeError, ValueError):
+        api.fail(400, "Limit is not valid: {}".format(limit))
+
+    force = is_true(data.get("force", False))
+    report = retry_failed_notifications(laboratory=laboratory, limit=limit,
+                                        force=force)
+    report["url"] = api.url_for("senaite.referral.retry")
+    return report
+
+
+@add_route("/referral/inbound_shipment/<string:uid>",
+           "senaite.referral.inbound_shipment", methods=["GET"])
+def inbound_shipment(context, request, uid=None):
+    """Returns the status of the import of the inbound samples for the inbound
+    shipment with the given UID, so the referring laboratory can poll until
+    all samples sent along with the shipment have been created
+    """
+    shipment = api.get_object_by_uid(uid, default=None)
+    if not IInboundSampleShipment.providedBy(shipment):
+        api.fail(404, "Inbound shipment not found: {}".format(uid))
+
+    if not check_permission(View, shipment):
+        api.fail(401, "Not allowed")
+
+    status = get_import_status(shipment)
+    status["url"] = api.url_for("senaite.referral.inbound_shipment", uid=uid)
+    return status
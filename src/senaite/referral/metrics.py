@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+import functools
+import threading
+import time
+from collections import deque
+
+from senaite.referral import logger
+from zope.globalrequest import getRequest
+
+from bika.lims import api
+
+# Number of most recent calls kept per laboratory and call name
+METRICS_BUFFER_SIZE = 500
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Direction of the calls
+OUTBOUND = "outbound"
+INBOUND = "inbound"
+
+
+def percentile(values, pct):
+    """Returns the percentile pct of the sorted list of values passed-in
+    """
+    if not values:
+        return 0
+    index = int(round((len(values) - 1) * pct / 100.0))
+    return values[index]
+
+
+def count_items(data):
+    """Returns the number of items (samples, analyses, etc.) of the payload
+    passed-in, that is the sum of the lengths of its list values
+    """
+    if not isinstance(data, dict):
+        return 0
+    return sum([len(val) for val in data.values()
+                if isinstance(val, (list, tuple))])
+
+
+class MetricsRegistry(object):
+    """Keeps the metrics of the calls to and from remote laboratories in
+    memory. Counters are cumulative since the start of the process, while the
+    most recent calls are kept in a ring buffer for each laboratory and call
+    name (consumer or endpoint). Does not access the database, so it can be
+    used from any thread
+    """
+
+    def __init__(self, size=METRICS_BUFFER_SIZE):
+        self._lock = threading.Lock()
+        self._size = size
+        self._series = {}
+
+    def _get_series(self, key):
+        series = self._series.get(key)
+        if series is None:
+            series = {
+                "count": 0,
+                "elapsed": 0,
+                "bytes": 0,
+                "items": 0,
+                "loads": 0,
+                "buckets": [0] * len(LATENCY_BUCKETS),
+                "errors": {},
+                "recent": deque(maxlen=self._size),
+            }
+            self._series[key] = series
+        return series
+
+    def record(self, direction, name, laboratory, elapsed, size=0, items=0,
+               loads=0, error=None):
+        """Records a call to or from the laboratory passed-in
+        """
+        key = (direction, name or "", laboratory or "")
+        with self._lock:
+            series = self._get_series(key)
+            series["count"] += 1
+            series["elapsed"] += elapsed
+            series["bytes"] += size
+            series["items"] += items
+            series["loads"] += loads
+            for idx, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    series["buckets"][idx] += 1
+            if error:
+                errors = series["errors"]
+                errors[error] = errors.get(error, 0) + 1
+            series["recent"].append((elapsed, size, items, loads, error))
+
+    def clear(self):
+        """Removes all the metrics
+        """
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        """Returns a list of dicts with the metrics of each laboratory and call
+        name, with the percentiles of the most recent calls
+        """
+        with self._lock:
+            items = [(key, dict(val, buckets=list(val["buckets"]),
+                                errors=dict(val["errors"]),
+                                recent=list(val["recent"])))
+                     for key, val in self._series.items()]
+
+        snapshot = []
+        for (direction, name, laboratory), series in sorted(items):
+            recent = series.pop("recent")
+            latencies = sorted([call[0] for call in recent])
+            sizes = sorted([call[1] for call in recent])
+            series.update({
+                "direction": direction,
+                "name": name,
+                "laboratory": laboratory,
+                "recent": {
+                    "count": len(recent),
+                    "failed": len([call for call in recent if call[4]]),
+                    "latency_p50": percentile(latencies, 50),
+                    "latency_p95": percentile(latencies, 95),
+                    "latency_p99": percentile(latencies, 99),
+                    "bytes_p50": percentile(sizes, 50),
+                    "bytes_p95": percentile(sizes, 95),
+                },
+            })
+            snapshot.append(series)
+        return snapshot
+
+
+# Metrics of the calls to and from remote laboratories of this process
+metrics_registry = MetricsRegistry()
+
+
+def record(direction, name, laboratory, elapsed, **kwargs):
+    """Records the metrics of a call to or from a remote laboratory. Never
+    fails, metrics must not interfere with the call itself
+    """
+    try:
+        metrics_registry.record(direction, name, laboratory, elapsed,
+                                **kwargs)
+    except Exception as e:
+        logger.warn("Cannot record metrics: {}".format(str(e)))
+
+
+def get_load_count():
+    """Returns the number of objects loaded from the database by the current
+    connection so far
+    """
+    jar = getattr(api.get_portal(), "_p_jar", None)
+    if jar is None:
+        return 0
+    loads, stores = jar.getTransferCounts()
+    return loads
+
+
+def get_request_size():
+    """Returns the size in bytes of the body of the current request
+    """
+    request = getRequest()
+    if request is None:
+        return 0
+    return api.to_int(request.get_header("Content-Length"), 0)
+
+
+def instrument_consumer(name):
+    """Decorator for the process function of push consumers that records the
+    latency, size of the request, number of items, database loads and
+    errors of each call
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(consumer, *args, **kwargs):
+            data = getattr(consumer, "raw_data", None) or consumer.data
+            loads = get_load_count()
+            start = time.time()
+            error = None
+            try:
+                return func(consumer, *args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                elapsed = time.time() - start
+                results = getattr(consumer, "results", None)
+                items = count_items(data)
+                if not items and isinstance(results, (list, tuple)):
+                    items = len(results)
+                record(INBOUND, name, data.get("lab_code"), elapsed,
+                       size=get_request_size(), items=items,
+                       loads=get_load_count() - loads, error=error)
+        return wrapper
+    return decorator
@@ -19,25 +19,79 @@
 # Some rights reserved, see README and LICENSE.
 
 import json
+import zlib
 from datetime import datetime
-from persistent.list import PersistentList
+
+from bika.lims import api
+from bika.lims.interfaces import IAnalysisRequest
+from BTrees.IOBTree import IOBTree
 from requests import Response
+from senaite.referral.catalog import INBOUND_SAMPLE_CATALOG
+from senaite.referral.interfaces import IRemoteContent
+from senaite.referral.reindex import reindex_on_commit
+from senaite.referral.utils import get_notifications_compression
+from senaite.referral.utils import get_notifications_max_content_size
+from senaite.referral.utils import get_notifications_retention
 from senaite.referral.utils import is_true
 from zope.annotation.interfaces import IAnnotations
 
+# Legacy storage, a PersistentList with the json-ified posts
 POSTS_STORAGE = "senaite.referral.http_posts"
 
+# Storage with the posts, keyed by sequence number
+POSTS_LOG_STORAGE = "senaite.referral.http_posts_log"
+
+# Storage with the summary of the last post
+LAST_POST_STORAGE = "senaite.referral.http_last_post"
+
+# Prefix of the posts that are stored compressed
+COMPRESSED_PREFIX = "zlib:"
+
+# Keys from the post that are kept in the summary of the last post
+SUMMARY_KEYS = ["url", "status", "reason", "message", "success", "datetime"]
 
-def get_posts_storage(obj):
-    """Returns the storage with the list of notifications (POST requests) sent
-    to a target laboratory for the given object
+# Status of the last post, as indexed in catalogs
+POST_SUCCEEDED = "succeeded"
+POST_FAILED = "failed"
+
+# Catalog indexes and columns that depend on the last post
+POST_INDEXES = [
+    "last_post_status",
+    "last_post_datetime",
+    "post_failures_count",
+]
+
+
+def get_posts_storage(obj, create=True):
+    """Returns the storage with the notifications (POST requests) sent to a
+    target laboratory for the given object, keyed by sequence number
     :param obj: Content object
-    :returns: PersistentList
+    :param create: whether to create the storage if it does not exist yet
+    :returns: IOBTree or None
     """
     annotation = IAnnotations(obj)
-    if annotation.get(POSTS_STORAGE) is None:
-        annotation[POSTS_STORAGE] = PersistentList()
-    return annotation[POSTS_STORAGE]
+    if annotation.get(POSTS_LOG_STORAGE) is None:
+        if not create:
+            return None
+        annotation[POSTS_LOG_STORAGE] = IOBTree()
+    return annotation[POSTS_LOG_STORAGE]
+
+
+def encode_post(data, compress=False):
+    """Returns the post passed-in in the format it is stored
+    """
+    value = json.dumps(data)
+    if compress:
+        value = COMPRESSED_PREFIX + zlib.compress(value)
+    return value
+
+
+def decode_post(value):
+    """Returns the post stored as the value passed-in as a dict
+    """
+    if value.startswith(COMPRESSED_PREFIX):
+        value = zlib.decompress(value[len(COMPRESSED_PREFIX):])
+    return json.loads(value)
 
 
 def get_posts(obj):
@@ -46,18 +100,100 @@ def get_posts(obj):
     :param obj: object the POST is about
     :returns: list of dicts
     """
-    posts = get_posts_storage(obj)
-    return map(json.loads, posts)
+    posts = get_posts_storage(obj, create=False)
+    if not posts:
+        return []
+    return map(decode_post, posts.values())
 
 
 def get_last_post(obj):
     """Returns the last post sent to a remote laboratory about the given object
     or None otherwise
     """
-    posts = get_posts(obj)
-    if posts:
-        return posts[-1]
-    return None
+    posts = get_posts_storage(obj, create=False)
+    if not posts:
+        return None
+    return decode_post(posts[posts.maxKey()])
+
+
+def get_last_post_summary(obj):
+    """Returns a dict with the status information (success, status, message,
+    etc.) of the last post sent to a remote laboratory about the given object,
+    but without the payload and the content of the response. Returns None if
+    no post was sent
+    """
+    summary = IAnnotations(obj).get(LAST_POST_STORAGE)
+    if not summary:
+        return None
+    return dict(summary)
+
+
+def get_post_summary(post, previous=None):
+    """Returns the summary of the post passed-in. The summary keeps track of
+    the number of consecutive failed posts, starting from the previous
+    summary, if any
+    """
+    summary = dict([(key, post.get(key)) for key in SUMMARY_KEYS])
+    failures = 0
+    if is_error(post):
+        failures = (previous or {}).get("failures", 0) + 1
+    summary["failures"] = failures
+    return summary
+
+
+def get_last_post_status(obj):
+    """Returns the status of the last post sent to a remote laboratory about
+    the given object: POST_SUCCEEDED, POST_FAILED or empty if no post was sent
+    """
+    summary = IAnnotations(obj).get(LAST_POST_STORAGE)
+    if not summary:
+        return ""
+    return POST_FAILED if is_error(summary) else POST_SUCCEEDED
+
+
+def get_last_post_datetime(obj):
+    """Returns the datetime in ISO format of the last post sent to a remote
+    laboratory about the given object or empty if no post was sent
+    """
+    summary = IAnnotations(obj).get(LAST_POST_STORAGE) or {}
+    return summary.get("datetime") or ""
+
+
+def get_post_failures_count(obj):
+    """Returns the number of consecutive failed posts sent to a remote
+    laboratory about the given object, since the last successful one
+    """
+    summary = IAnnotations(obj).get(LAST_POST_STORAGE) or {}
+    return summary.get("failures", 0)
+
+
+def set_last_post(obj, post):
+    """Stores the summary of the post passed-in as the last post sent to a
+    remote laboratory about the given object
+    """
+    annotation = IAnnotations(obj)
+    previous = annotation.get(LAST_POST_STORAGE)
+    annotation[LAST_POST_STORAGE] = get_post_summary(post, previous=previous)
+
+
+def reindex_post_status(obj):
+    """Reindexes the catalog indexes and metadata that depend on the last post
+    sent to a remote laboratory for the given object. Inbound samples reflect
+    the status of their sample counterpart, so they are reindexed as well
+    """
+    reindex_on_commit(obj, idxs=POST_INDEXES)
+    if not IAnalysisRequest.providedBy(obj):
+        return
+
+    # Most samples have no inbound sample counterpart. Only those linked to
+    # remote content or received through an inbound shipment might have one
+    if not IRemoteContent.providedBy(obj) and not obj.hasInboundShipment():
+        return
+
+    query = {"portal_type": "InboundSample", "sample_uid": api.get_uid(obj)}
+    for brain in api.search(query, INBOUND_SAMPLE_CATALOG):
+        inbound_sample = api.get_object(brain)
+        reindex_on_commit(inbound_sample, idxs=POST_INDEXES)
 
 
 def is_error(post):
@@ -141,9 +277,87 @@ def save_post(obj, payload, data_or_response):
         "payload": payload,
     })
 
-    # json-ify
-    data = json.dumps(data)
+    # Do not bloat the database with large responses
+    data = cap_post_content(data)
 
     # Get the storage and append this post
     storage = get_posts_storage(obj)
-    storage.append(data)
+    seq = storage.maxKey() + 1 if storage else 1
+    storage[seq] = encode_post(data, compress=get_notifications_compression())
+
+    # Keep the summary of the last post for faster access
+    set_last_post(obj, data)
+
+    # Discard oldest posts, if required
+    purge_posts(obj)
+
+    # Keep catalogs in sync with the status of the last post
+    reindex_post_status(obj)
+
+
+def cap_post_content(data, max_size=None):
+    """Returns a copy of the post passed-in with the content of the response
+    truncated to max_size characters. The json-decoded content is kept only
+    if its size does not exceed max_size either, otherwise only the values
+    that are not containers (e.g. message, success) are kept
+    """
+    if max_size is None:
+        max_size = get_notifications_max_content_size()
+    if max_size < 1:
+        return data
+
+    data = dict(data)
+    content = data.get("content") or ""
+    if len(content) > max_size:
+        data["content"] = content[:max_size]
+        data["content_size"] = len(content)
+
+    content_json = data.get("content_json")
+    if isinstance(content_json, dict) and content_json:
+        if len(json.dumps(content_json)) > max_size:
+            data["content_json"] = dict([
+                (key, value) for key, value in content_json.items()
+                if not isinstance(value, (list, tuple, dict))
+            ])
+    return data
+
+
+def purge_posts(obj, retention=None):
+    """Removes the oldest posts sent to a remote laboratory about the given
+    object, keeping only the number of posts set by retention
+    """
+    if retention is None:
+        retention = get_notifications_retention()
+    if retention < 1:
+        return
+
+    storage = get_posts_storage(obj, create=False)
+    if not storage or len(storage) <= retention:
+        return
+
+    max_key = storage.maxKey() - retention
+    for seq in list(storage.keys(max=max_key)):
+        del storage[seq]
+
+
+def migrate_posts(obj):
+    """Moves the posts from the legacy storage to the current one for the
+    object passed-in. Returns whether the object had posts to migrate
+    """
+    annotation = IAnnotations(obj)
+    legacy = annotation.get(POSTS_STORAGE)
+    if legacy is None:
+        return False
+
+    compress = get_notifications_compression()
+    storage = get_posts_storage(obj)
+    seq = storage.maxKey() if storage else 0
+    for value in legacy:
+        data = json.loads(value)
+        seq += 1
+        storage[seq] = encode_post(data, compress=compress)
+        set_last_post(obj, data)
+
+    del annotation[POSTS_STORAGE]
+    purge_posts(obj)
+    return True
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import transaction
+from AccessControl.SecurityManagement import newSecurityManager
+from AccessControl.SecurityManagement import noSecurityManager
+from AccessControl.SpecialUsers import system as system_user
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from senaite.referral import logger
+from senaite.referral.utils import get_outbox_max_attempts
+from Testing.makerequest import makerequest
+from ZODB.POSException import ConflictError
+from zope.annotation.interfaces import IAnnotations
+from zope.component.hooks import setSite
+from zope.globalrequest import setRequest
+
+from bika.lims import api
+
+OUTBOX_STORAGE = "senaite.referral.outbox"
+
+# Index of the outbox records by the time they are due for delivery, as a set
+# of (due time, key) tuples
+OUTBOX_DUE_STORAGE = "senaite.referral.outbox_due"
+
+# Base delay in seconds before a notification that could not be delivered
+# because of a connectivity error is retried. The delay is doubled on each
+# attempt
+OUTBOX_RETRY_DELAY = 60
+
+# Number of times a commit is retried on ConflictError
+OUTBOX_COMMIT_RETRIES = 3
+
+# Workers currently running in this process, keyed by site path
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_outbox(portal=None, create=False):
+    """Returns the storage that keeps the notifications (POST requests) that
+    are pending of delivery to remote laboratories. Returns an empty dict if
+    the storage does not exist yet and create is False
+    :returns: OOBTree or dict
+    """
+    portal = portal or api.get_portal()
+    annotation = IAnnotations(portal)
+    if annotation.get(OUTBOX_STORAGE) is None:
+        if not create:
+            return {}
+        annotation[OUTBOX_STORAGE] = OOBTree()
+    return annotation[OUTBOX_STORAGE]
+
+
+def get_due_index(portal=None, create=False):
+    """Returns the index of the outbox records by the time they are due for
+    delivery. Returns an empty tuple if the index does not exist yet and
+    create is False
+    :returns: OOTreeSet or tuple
+    """
+    portal = portal or api.get_portal()
+    annotation = IAnnotations(portal)
+    if annotation.get(OUTBOX_DUE_STORAGE) is None:
+        if not create:
+            return ()
+        annotation[OUTBOX_DUE_STORAGE] = OOTreeSet()
+    return annotation[OUTBOX_DUE_STORAGE]
+
+
+def get_due_time(record):
+    """Returns the time (in seconds since the epoch) from which the record
+    passed-in can be delivered: the time of the next attempt or the time the
+    lease of the worker that is delivering the record expires
+    """
+    return max(record.get("next_attempt", 0), record.get("lease", 0))
+
+
+def new_key(uid=None):
+    """Returns a new unique key for an outbox record. Keys start with the uid
+    passed-in or a random one, so records added concurrently are spread
+    across the buckets of the outbox instead of conflicting in the last one
+    """
+    return "{}-{}".format(uid or uuid.uuid4().hex, uuid.uuid4().hex)
+
+
+def set_record(key, record, portal=None):
+    """Stores the outbox record passed-in with the given key and keeps the
+    index of records by due time up-to-date
+    """
+    outbox = get_outbox(portal, create=True)
+    index = get_due_index(portal, create=True)
+    existing = outbox.get(key)
+    if existing is not None:
+        entry = (get_due_time(existing), key)
+        if entry in index:
+            index.remove(entry)
+    outbox[key] = record
+    index.insert((get_due_time(record), key))
+
+
+def index_outbox(portal=None):
+    """Builds the index of records by due time if the outbox exists, but the
+    index does not, e.g. records added by a former version
+    """
+    outbox = get_outbox(portal)
+    if not outbox or get_due_index(portal):
+        return
+    index = get_due_index(portal, create=True)
+    for key, record in outbox.items():
+        index.insert((get_due_time(record), key))
+
+
+def enqueue(obj, laboratory, payload, timeout=5, endpoint="push", delay=0):
+    """Adds a notification (POST request) about the object or objects
+    passed-in to the outbox, to be delivered to the remote laboratory after
+    the current transaction is committed, but not before the delay (in
+    seconds) passed-in
+    :returns: the key of the record added to the outbox
+    """
+    objects = obj if isinstance(obj, (list, tuple)) else [obj]
+    record = {
+        "uids": map(api.get_uid, objects),
+        "laboratory": api.get_uid(laboratory),
+        "payload": payload,
+        "timeout": timeout,
+        "endpoint": endpoint,
+        "created": datetime.now().isoformat(),
+        "attempts": 0,
+        "next_attempt": time.time() + delay if delay > 0 else 0,
+        "lease": 0,
+    }
+    key = new_key(record["uids"][0] if record["uids"] else None)
+    set_record(key, record)
+
+    # Start the delivery as soon as the current transaction is committed
+    register_after_commit_hook()
+    return key
+
+
+def register_after_commit_hook():
+    """Registers a hook that starts the delivery of the outbox notifications
+    after current transaction is successfully committed
+    """
+    txn = transaction.get()
+    for hook, args, kwargs in txn.getAfterCommitHooks():
+        if hook is after_commit_hook:
+            return
+
+    portal = api.get_portal()
+    db = portal._p_jar.db()
+    site_path = api.get_path(portal)
+    txn.addAfterCommitHook(after_commit_hook, args=(db, site_path))
+
+
+def after_commit_hook(status, db, site_path):
+    """Starts the outbox worker if the transaction was committed
+    """
+    if not status:
+        return
+    try:
+        start_worker(db, site_path)
+    except Exception as e:
+        # never fail after a successful commit
+        logger.error("Cannot start outbox worker: {}".format(str(e)))
+
+
+def start_worker(db, site_path):
+    """Starts a worker thread that delivers the notifications from the outbox
+    of the site passed-in, unless there is one running already
+    """
+    with _workers_lock:
+        worker = _workers.get(site_path)
+        if worker and worker.is_alive():
+            # make the running worker to do another pass
+            worker.wakeup()
+            return worker
+
+        worker = OutboxWorker(db, site_path)
+        _workers[site_path] = worker
+        worker.start()
+        return worker
+
+
+def get_due_keys(portal=None, now=None):
+    """Returns an iterator of the keys of the outbox records that are due for
+    delivery, without waking up the records
+    """
+    now = now or time.time()
+    for due, key in get_due_index(portal):
+        if due > now:
+            # the index is sorted by due time
+            break
+        yield key
+
+
+def get_pending_keys(portal=None, limit=None):
+    """Returns the keys of the outbox records that are ready for delivery,
+    sorted from oldest to newest. Only the records that are due are read
+    """
+    outbox = get_outbox(portal)
+    pending = []
+    for key in get_due_keys(portal):
+        record = outbox.get(key)
+        if record is not None:
+            pending.append((record.get("created", ""), key))
+
+    keys = [key for created, key in sorted(pending)]
+    if limit:
+        keys = keys[:limit]
+    return keys
+
+
+def process_outbox(portal=None, limit=None):
+    """Delivers the notifications from the outbox that are ready. Commits the
+    transaction after each delivery
+    :returns: the number of records processed
+    """
+    commit(index_outbox, portal)
+    keys = get_pending_keys(portal, limit=limit)
+    for key in keys:
+        deliver(key, portal=portal)
+    return len(keys)
+
+
+def commit(func, *args):
+    """Calls the function passed-in and commits the transaction. Retries the
+    whole thing if a ConflictError arises
+    :returns: the value returned by the function or None if not committed
+    """
+    for attempt in range(OUTBOX_COMMIT_RETRIES):
+        try:
+            value = func(*args)
+            transaction.commit()
+            return value
+        except ConflictError:
+            transaction.abort()
+            logger.warn("Conflict error on outbox commit. Retrying {}/{}"
+                        .format(attempt + 1, OUTBOX_COMMIT_RETRIES))
+    return None
+
+
+def deliver(key, portal=None):
+    """Sends the notification from the outbox with the given key to the
+    remote laboratory and stores the result through the remote lab. Only
+    connectivity errors are retried
+    """
+    # Prevent circular dependencies
+    from senaite.referral.remotelab import get_remote_connection
+
+    def claim():
+        outbox = get_outbox(portal)
+        record = outbox.get(key)
+        if not record or record.get("lease", 0) > time.time():
+            return None
+        record = dict(record)
+        timeout = api.to_int(record.get("timeout"), 5)
+        record["lease"] = time.time() + timeout * 2
+        set_record(key, record, portal)
+        return record
+
+    # Claim the record, so no other worker or ZEO client delivers it
+    record = commit(claim)
+    if not record:
+        return
+
+    objects = [api.get_object_by_uid(uid, default=None)
+               for uid in record.get("uids", [])]
+    objects = filter(None, objects)
+    laboratory = api.get_object_by_uid(record["laboratory"], default=None)
+    remote_lab = get_remote_connection(laboratory)
+    if not all([objects, remote_lab]):
+        logger.error("Cannot deliver outbox record {}: object or remote lab "
+                     "not found".format(key))
+        commit(remove, key, portal)
+        return
+
+    if remote_lab.is_circuit_open():
+        # the remote lab is unreachable. Wait until the circuit can be probed
+        # again, without consuming an attempt nor storing a failure
+        def postpone():
+            updated = dict(record)
+            updated.update({
+                "next_attempt": time.time() + remote_lab.get_circuit_delay(),
+                "lease": 0,
+            })
+            set_record(key, updated, portal)
+
+        commit(postpone)
+        return
+
+    payload = record["payload"]
+    response = remote_lab.post(payload, timeout=record.get("timeout", 5),
+                               endpoint=record.get("endpoint", "push"))
+
+    def store():
+        remote_lab.store(objects, payload, response)
+
+        # Only retry if the remote laboratory could not be reached
+        attempts = record.get("attempts", 0) + 1
+        if isinstance(response, dict) and attempts < get_outbox_max_attempts():
+            updated = dict(record)
+            delay = OUTBOX_RETRY_DELAY * (2 ** (attempts - 1))
+            updated.update({
+                "attempts": attempts,
+                "next_attempt": time.time() + delay,
+                "lease": 0,
+            })
+            set_record(key, updated, portal)
+        else:
+            remove(key, portal)
+
+    commit(store)
+
+
+def remove(key, portal=None):
+    """Removes the record with the given key from the outbox
+    """
+    outbox = get_outbox(portal)
+    record = outbox.get(key)
+    if record is None:
+        return
+    del outbox[key]
+    index = get_due_index(portal)
+    entry = (get_due_time(record), key)
+    if entry in index:
+        index.remove(entry)
+
+
+class OutboxWorker(threading.Thread):
+    """Thread that delivers the notifications from the outbox of a site with
+    its own connection to the database
+    """
+
+    def __init__(self, db, site_path):
+        super(OutboxWorker, self).__init__(name="referral-outbox-worker")
+        self.daemon = True
+        self.db = db
+        self.site_path = site_path
+        self._wakeup = threading.Event()
+
+    def wakeup(self):
+        """Tells the worker to do another pass before finishing
+        """
+        self._wakeup.set()
+
+    def run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                self.process()
+            except Exception as e:
+                logger.error("Outbox worker failed: {}".format(str(e)))
+
+            with _workers_lock:
+                if not self._wakeup.is_set():
+                    _workers.pop(self.site_path, None)
+                    return
+
+    def process(self):
+        """Opens a new connection to the database and delivers the pending
+        notifications of the site
+        """
+        connection = self.db.open()
+        try:
+            app = makerequest(connection.root()["Application"])
+            site = app.unrestrictedTraverse(self.site_path)
+            setSite(site)
+            setRequest(app.REQUEST)
+            newSecurityManager(None, system_user)
+            process_outbox(site)
+        finally:
+            transaction.abort()
+            noSecurityManager()
+            setSite(None)
+            setRequest(None)
+            connection.close()
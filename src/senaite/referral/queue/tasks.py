@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2022 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from senaite.queue.adapters import QueuedActionTaskAdapter
+from senaite.queue.api import add_action_task
+from senaite.queue.api import add_task
+from senaite.queue.interfaces import IQueuedTaskAdapter
+from senaite.queue.queue import get_chunks
+from senaite.referral.jsonapi.consumer import do_queued_action
+from senaite.referral.jsonapi.consumer import report_outcomes
+from senaite.referral.jsonapi.inboundshipment import \
+    create_inbound_samples_chunk
+from zope.interface import implementer
+
+from bika.lims import api
+
+
+@implementer(IQueuedTaskAdapter)
+class CreateInboundSamplesTaskAdapter(object):
+    """Adapter for the creation of the inbound samples of an inbound shipment
+    received from a referring laboratory
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    def process(self, task):
+        """Creates the inbound samples for the first chunk of records from the
+        task and adds a new task for the remaining records, if any
+        """
+        records = task.get("records") or []
+        chunk_size = task.get("chunk_size")
+
+        # Process the first chunk
+        remaining = create_inbound_samples_chunk(self.context, records,
+                                                 chunk_size)
+        if not remaining:
+            return
+
+        # Add remaining records to the queue
+        kwargs = {
+            "records": remaining,
+            "chunk_size": chunk_size,
+            "priority": task.priority,
+        }
+        add_task(task.name, self.context, **kwargs)
+
+
+@implementer(IQueuedTaskAdapter)
+class RemoteActionTaskAdapter(object):
+    """Adapter for the generic action tasks bound to an external laboratory.
+    These are the actions requested by the remote laboratory that were
+    deferred to the queue by the referral consumer
+    """
+
+    def __init__(self, context):
+        self.context = context
+
+    def process(self, task):
+        """Performs the action for the first chunk of objects of the task and
+        adds a new task for the remaining objects, if any. Outcomes are sent
+        back to the remote laboratory once all objects have been processed
+        """
+        lab_code = task.get("lab_code")
+        if not lab_code:
+            # Not requested by the remote laboratory
+            return QueuedActionTaskAdapter(self.context).process(task)
+
+        # Guards only allow some transitions on POSTs from remote labs
+        request = api.get_request()
+        request.set("lab_code", lab_code)
+
+        action = task["action"]
+        uids = task.get("uids") or []
+        chunks = get_chunks(uids, api.to_int(task.get("chunk_size"), 0))
+
+        # Process the first chunk
+        remote_uids = task.get("remote_uids") or {}
+        outcomes = list(task.get("outcomes") or [])
+        for uid in chunks[0]:
+            success, message = do_queued_action(uid, action)
+            outcomes.append([remote_uids.get(uid), success, message, action])
+
+        if not chunks[1]:
+            # No more objects to process, notify the remote laboratory
+            report_outcomes(self.context, outcomes)
+            return
+
+        # Add remaining objects to the queue
+        kwargs = {
+            "outcomes": outcomes,
+            "remote_uids": remote_uids,
+            "lab_code": lab_code,
+            "chunk_size": task.get("chunk_size"),
+            "priority": task.priority,
+        }
+        add_action_task(chunks[1], action, self.context, **kwargs)
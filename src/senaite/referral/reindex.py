@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from collections import OrderedDict
+
+import transaction
+from transaction.interfaces import IDataManagerSavepoint
+from transaction.interfaces import ISavepointDataManager
+from zope.interface import implementer
+
+from bika.lims import api
+
+
+def get_reindex_queue():
+    """Returns the queue of objects to reindex for the current transaction
+    """
+    txn = transaction.get()
+    for hook, args, kwargs in txn.getBeforeCommitHooks():
+        # objects might be added to the queue while flushing (e.g. from
+        # another before commit hook), so skip the queues flushed already
+        if hook is flush and not args[0].flushed:
+            queue = args[0]
+            queue.join(txn)
+            return queue
+
+    queue = ReindexQueue()
+    queue.join(txn)
+    txn.addBeforeCommitHook(flush, args=(queue,))
+    return queue
+
+
+def reindex_on_commit(obj, idxs=None):
+    """Schedules the reindex of the object passed-in for when the current
+    transaction is about to commit. If idxs is None, the object is reindexed
+    in full. Otherwise, only the given indexes (and metadata) are reindexed
+    """
+    get_reindex_queue().add(obj, idxs=idxs)
+
+
+def flush_reindex_queue():
+    """Reindexes the objects scheduled for reindex in the current transaction
+    right-away, for when up-to-date catalogs are required before commit
+    """
+    get_reindex_queue().flush()
+
+
+def flush(queue):
+    """Reindexes the objects from the queue passed-in
+    """
+    queue.flush()
+    queue.flushed = True
+
+
+@implementer(ISavepointDataManager)
+class ReindexQueue(object):
+    """Collects the objects to reindex within a transaction, so each object is
+    reindexed only once, with the union of the indexes requested. Joins the
+    transaction as a data manager, so the objects queued after a savepoint
+    are discarded when the savepoint is rolled back
+    """
+
+    def __init__(self):
+        self.objects = OrderedDict()
+        self.flushed = False
+        self.joined = False
+        self.transaction_manager = transaction.manager
+
+    def join(self, txn):
+        """Joins the transaction passed-in, unless joined already
+        """
+        if not self.joined:
+            txn.join(self)
+            self.joined = True
+
+    def add(self, obj, idxs=None):
+        """Adds the object to the queue. If idxs is None, the object will be
+        reindexed in full
+        """
+        key = api.get_uid(obj)
+        if idxs is not None:
+            idxs = set(idxs)
+
+        if key in self.objects:
+            obj, queued = self.objects[key]
+            if queued is None or idxs is None:
+                idxs = None
+            else:
+                idxs = queued.union(idxs)
+
+        self.objects[key] = (obj, idxs)
+
+    def flush(self):
+        """Reindexes the objects from the queue and empties it
+        """
+        while self.objects:
+            key, (obj, idxs) = self.objects.popitem(last=False)
+            if idxs is None:
+                obj.reindexObject()
+            elif idxs:
+                obj.reindexObject(idxs=sorted(idxs))
+
+    def savepoint(self):
+        """Returns a snapshot of the queue, to restore it on rollback
+        """
+        return ReindexQueueSavepoint(self)
+
+    def abort(self, txn):
+        """Discards the objects from the queue. Called when the transaction
+        is aborted or a savepoint taken before this queue joined is rolled
+        back, so it has to join again if more objects are queued
+        """
+        self.objects.clear()
+        self.joined = False
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        # objects are reindexed before commit, nothing to do here
+        pass
+
+    def tpc_vote(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        self.joined = False
+
+    def tpc_abort(self, txn):
+        self.abort(txn)
+
+    def sortKey(self):
+        return "senaite.referral.reindex:{}".format(id(self))
+
+
+@implementer(IDataManagerSavepoint)
+class ReindexQueueSavepoint(object):
+    """Snapshot of the reindex queue when a savepoint was taken
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.objects = OrderedDict(queue.objects)
+
+    def rollback(self):
+        """Restores the queue to the state it had when the savepoint was taken
+        """
+        self.queue.objects = OrderedDict(self.objects)
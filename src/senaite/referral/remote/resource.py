@@ -2,7 +2,9 @@
 
 import copy
 
+from bika.lims.api import parse_json
 from bika.lims.api import to_utf8
+from six import string_types
 from senaite.core.api import dtime
 from senaite.referral.api import get_object_by_remote_uid
 from senaite.referral.interfaces import IRemoteResource
@@ -13,12 +15,25 @@ _marker = object()
 
 @implementer(IRemoteResource)
 class RemoteResource(object):
-    """Object that wraps a dict representation of a referral object from a
-    remote laboratory
+    """Read-only view of the dict representation of a referral object from a
+    remote laboratory. The wrapped data is neither copied nor modified, and
+    when given as a JSON string, is only decoded when first accessed
     """
+    __slots__ = ("_raw", "_decoded")
 
     def __init__(self, data):
-        self._data = copy.deepcopy(data) if data else {}
+        self._raw = data
+        self._decoded = None
+
+    @property
+    def _data(self):
+        if self._decoded is None:
+            data = self._raw
+            if isinstance(data, string_types):
+                data = parse_json(data, default=None)
+            self._decoded = data or {}
+            self._raw = None
+        return self._decoded
 
     @property
     def id(self):
@@ -75,12 +90,18 @@ class RemoteResource(object):
         """
         return get_object_by_remote_uid(self.UID, default=None)
 
-    def to_dict(self):
-        """Returns a dict representation of this object
+    def to_dict(self, deep=True):
+        """Returns a dict representation of this object. If deep is False, the
+        wrapped dict is returned, that must not be modified
         """
+        if not deep:
+            return self._data
         return copy.deepcopy(self._data)
 
     def get_raw(self, field_name, default=None):
+        """Returns the value for the given field as is. Values are shared with
+        the wrapped data and must not be modified
+        """
         return self._data.get(field_name, default)
 
     def get(self, field_name, default=None):
@@ -19,26 +19,57 @@
 # Some rights reserved, see README and LICENSE.
 
 import math
+import time
 
+import transaction
 from bika.lims import api
 from bika.lims.interfaces import IAnalysisRequest
 from bika.lims.utils import format_supsub
 from bika.lims.utils.analysis import format_uncertainty
+from collections import OrderedDict
 from collections import defaultdict
 from requests.auth import HTTPBasicAuth
 from senaite.app.supermodel import SuperModel
 from senaite.core.api.dtime import date_to_string
 from senaite.referral import logger
+from senaite.referral import metrics
+from senaite.referral.dispatcher import get_dispatcher
+from senaite.referral.health import get_health
+from senaite.referral.health import health_registry
+from senaite.referral.health import persist_health
 from senaite.referral.interfaces import IExternalLaboratory
+from senaite.referral.interfaces import IReferralObjectInfo
 from senaite.referral.notifications import get_post_base_info
+from senaite.referral.notifications import get_post_info
 from senaite.referral.notifications import save_post
+from senaite.referral.outbox import enqueue
 from senaite.referral.remotesession import RemoteSession
+from senaite.referral.utils import get_circuit_cooldown
+from senaite.referral.utils import get_circuit_failure_threshold
 from senaite.referral.utils import get_lab_code
+from senaite.referral.utils import get_metadata
+from senaite.referral.utils import get_notifications_log_sampling
 from senaite.referral.utils import get_notify_hidden
 from senaite.referral.utils import get_notify_retested
 from senaite.referral.utils import get_notify_unrequested
+from senaite.referral.utils import get_session_idle_timeout
+from senaite.referral.utils import get_session_keep_alive
+from senaite.referral.utils import get_session_pool_size
+from senaite.referral.utils import get_setup_titles
 from senaite.referral.utils import get_user_info
+from senaite.referral.utils import get_users_info
+from senaite.referral.utils import is_outbox_enabled
 from senaite.referral.utils import is_valid_url
+from zope.component import queryAdapter
+
+# Max number of samples to send together in a single POST
+RESULTS_BATCH_SIZE = 50
+
+# Indexed statuses of the analyses that might be notified to the referring
+# laboratory. Analyses being verified are still indexed as "to_be_verified"
+NOTIFY_STATUSES = ["to_be_verified", "verified", "published"]
+
+_marker = object()
 
 
 def get_remote_connection(laboratory):
@@ -78,9 +109,10 @@ def get_object_info(obj):
     }
 
     # Find out if there is a specific adapter converter
-    # adapter = queryAdapter(obj, IReferralObjectInfo)
-    # if adapter:
-    #     return adapter.to_dict()
+    adapter = queryAdapter(obj, IReferralObjectInfo)
+    if adapter:
+        basic_info.update(adapter.to_dict())
+        return basic_info
 
     # Rely on supermodel
     sm = SuperModel(obj)
@@ -98,12 +130,76 @@ def skip_post_action_for(obj):
     return uid in uids
 
 
+def update_analyses_on_commit(laboratory, sample):
+    """Schedules the update of the analyses of the sample passed-in in the
+    remote laboratory for when the current transaction is about to commit.
+    Samples scheduled for same laboratory within the transaction are sent
+    together in as few POST requests as possible
+    """
+    batches = get_results_batches()
+    lab_uid = api.get_uid(laboratory)
+    batch = batches.setdefault(lab_uid, OrderedDict())
+    batch[api.get_uid(sample)] = True
+
+
+def get_results_batches():
+    """Returns the samples scheduled for the update of analyses in remote
+    laboratories within the current transaction, grouped by laboratory
+    """
+    txn = transaction.get()
+    for hook, args, kwargs in txn.getBeforeCommitHooks():
+        if hook is send_results_batches:
+            return args[0]
+
+    batches = OrderedDict()
+    txn.addBeforeCommitHook(send_results_batches, args=(batches,))
+    return batches
+
+
+def send_results_batches(batches):
+    """Sends the results of the samples grouped by laboratory passed-in to the
+    remote laboratories, in chunks of RESULTS_BATCH_SIZE samples
+    """
+    for lab_uid, uids in batches.items():
+        laboratory = api.get_object_by_uid(lab_uid, default=None)
+        remote_lab = get_remote_connection(laboratory)
+        if not remote_lab:
+            continue
+
+        samples = [api.get_object_by_uid(uid, default=None) for uid in uids]
+        samples = filter(None, samples)
+        for num in range(0, len(samples), RESULTS_BATCH_SIZE):
+            chunk = samples[num:num+RESULTS_BATCH_SIZE]
+            remote_lab.update_analyses_batch(chunk)
+
+
 class RemoteLab(object):
 
     _session = None
 
     def __init__(self, external_laboratory):
         self.laboratory = external_laboratory
+        self.uid = api.get_uid(external_laboratory)
+        self.code = external_laboratory.getCode()
+
+        # Circuit breaker settings. Read them here, cause POSTs might be sent
+        # from a thread other than the main one, without database access
+        self.failure_threshold = get_circuit_failure_threshold()
+        self.cooldown = get_circuit_cooldown()
+
+        # Whether the remote laboratory accepts compressed notifications
+        self.compress = external_laboratory.getCompressedNotifications()
+
+        # Percentage of POSTs with the whole payload written to the log
+        self.log_sampling = get_notifications_log_sampling()
+
+        # Settings of the pooled HTTP session with the remote laboratory
+        self.pool_size = get_session_pool_size()
+        self.keep_alive = get_session_keep_alive()
+        self.idle_timeout = get_session_idle_timeout()
+
+        # Make the health of the laboratory known by this process
+        health_registry.seed(self.uid, get_health(external_laboratory))
 
     @property
     def laboratory_url(self):
@@ -115,7 +211,13 @@ class RemoteLab(object):
             username = self.laboratory.getUsername()
             password = self.laboratory.getPassword()
             auth = HTTPBasicAuth(username, password)
-            self._session = RemoteSession(self.laboratory_url, auth)
+            key = api.get_uid(self.laboratory)
+            self._session = RemoteSession(self.laboratory_url, auth, key=key,
+                                          log_sampling=self.log_sampling,
+                                          label=self.code,
+                                          pool_size=self.pool_size,
+                                          keep_alive=self.keep_alive,
+                                          idle_timeout=self.idle_timeout)
         return self._session
 
     def do_action(self, obj, action, timeout=5):
@@ -193,14 +295,46 @@ class RemoteLab(object):
         """Update the analyses from the remote laboratory with the information
         provided with the sample passed-in
         """
+        payload = {
+            "consumer": "senaite.referral.outbound_sample",
+            "sample": self.get_results_info(sample),
+        }
+        self.notify(sample, payload, timeout=timeout)
+
+    def update_analyses_batch(self, samples, timeout=None):
+        """Update the analyses from the remote laboratory with the information
+        provided with the samples passed-in, all them in a single POST
+        """
+        samples = filter(None, samples)
+        if not samples:
+            return
+
+        timeout = api.to_int(timeout, default=0)
+        if timeout < 1:
+            # infer the timeout based on the number of samples
+            timeout = math.ceil((math.log(len(samples))+1)*5)
+
+        payload = {
+            "consumer": "senaite.referral.outbound_sample",
+            "samples": map(self.get_results_info, samples),
+        }
+        self.notify(samples, payload, timeout=timeout,
+                    endpoint="referral/push")
+
+    def get_results_info(self, sample):
+        """Returns a dict with the results of the sample passed-in, suitable
+        for being injected into a POST payload
+        """
         skip_unrequested = not get_notify_unrequested()
         skip_retested = not get_notify_retested()
         skip_hidden = not get_notify_hidden()
 
         def get_valid_analyses(sample):
-            # Get the analyses to notify about to the reference laboratory
+            # Get the analyses to notify about to the reference laboratory.
+            # Candidates are filtered with catalog metadata first, so only the
+            # analyses to be notified are woken-up
             query = {
-                "full_objects": True,
+                "full_objects": False,
                 "sort_on": "sortable_title",
                 "sort_order": "ascending",
             }
@@ -210,21 +344,41 @@ class RemoteLab(object):
                 inbound_sample = sample.getInboundSample()
                 query["getServiceUID"] = inbound_sample.getRawServices()
 
+            brains = sample.getAnalyses(**query)
+
+            # UIDs of the analyses that have been retested
+            retested = map(lambda b: get_metadata(b, "getRetestOfUID"), brains)
+            retested = filter(None, retested)
+
             analyses = []
-            for analysis in sample.getAnalyses(**query):
+            for brain in brains:
+
+                # Skip invalid status?
+                # The indexed status of analyses being verified is still the
+                # old one (to_be_verified), so this is only a first filter
+                status = get_metadata(brain, "review_state")
+                if status and status not in NOTIFY_STATUSES:
+                    continue
 
                 # Skip hidden?
                 # Be aware that retests are flagged as hidden by default
-                if skip_hidden and analysis.getHidden():
+                hidden = get_metadata(brain, "getHidden", default=_marker)
+                if skip_hidden and hidden is True:
                     continue
 
                 # Skip retested?
                 # If retested are skipped, current instance notifies about
                 # the final result, that is the last retest
+                if skip_retested and api.get_uid(brain) in retested:
+                    continue
+
+                analysis = api.get_object(brain)
+                if skip_hidden and hidden is _marker and analysis.getHidden():
+                    continue
+
                 if skip_retested and analysis.isRetested():
                     continue
 
-                # Skip invalid status?
                 # XX We do this instead of including review_state in a query
                 #    because this action usually happens when analyses are
                 #    verified and at this point, their indexed status is still
@@ -323,8 +477,7 @@ class RemoteLab(object):
             """Returns a list of dicts each one representing a verifier
             """
             verifiers = analysis.getVerificators() or []
-            verifiers_info = [get_user_info(verifier) for verifier in verifiers]
-            verifiers_info = filter(None, verifiers_info)
+            verifiers_info = get_users_info(verifiers).values()
 
             # Update with current's lab code
             lab_code = get_lab_code()
@@ -352,26 +505,115 @@ class RemoteLab(object):
             return " ".join(values)
 
         def get_instrument(analysis):
-            instrument = analysis.getInstrument()
-            if instrument:
-                return api.get_title(instrument)
-            return None
+            uid = analysis.getRawInstrument()
+            return titles.get(uid) if uid else None
 
         def get_method(analysis):
-            method = analysis.getMethod()
-            if method:
-                return api.get_title(method)
-            return None
+            uid = analysis.getRawMethod()
+            return titles.get(uid) if uid else None
 
-        payload = {
-            "consumer": "senaite.referral.outbound_sample",
-            "sample": get_sample_info(sample),
-        }
-        self.notify(sample, payload, timeout=timeout)
+        # Titles of instruments and methods, keyed by UID
+        titles = get_setup_titles()
+
+        return get_sample_info(sample)
 
-    def notify(self, obj, payload, timeout=5):
+    def notify(self, obj, payload, timeout=5, endpoint="push"):
         """Sends a post for the given payload and stores the response to the
-        object passed-in
+        object or objects passed-in. The post is sent before the transaction
+        is committed or, if the outbox is enabled, added to the outbox and
+        delivered after the transaction is committed. Posts are always added
+        to the outbox while the circuit for the remote laboratory is open
+        """
+        data = self.get_notification_data(payload)
+        if self.is_circuit_open():
+            # The remote laboratory is unreachable. Defer the notification to
+            # the outbox until the circuit can be probed again, so it is not
+            # sent just to store a failure
+            delay = self.get_circuit_delay()
+            logger.warn("Circuit open for {}: notification deferred {:.0f}s"
+                        .format(self.code, delay))
+            enqueue(obj, self.laboratory, data, timeout=timeout,
+                    endpoint=endpoint, delay=delay)
+            return
+
+        if is_outbox_enabled():
+            enqueue(obj, self.laboratory, data, timeout=timeout,
+                    endpoint=endpoint)
+            return
+
+        # Do the POST request when the transaction is about to be committed,
+        # concurrently with those for other laboratories. The response is
+        # stored then, so we can keep track of the POSTs made for this given
+        # object and retry if necessary
+        get_dispatcher().add(self, obj, data, timeout=timeout,
+                             endpoint=endpoint)
+
+    def is_circuit_open(self):
+        """Returns whether no requests are allowed to the remote laboratory
+        because of too many consecutive failures
+        """
+        return health_registry.is_open(self.uid, self.failure_threshold,
+                                       self.cooldown)
+
+    def get_circuit_delay(self):
+        """Returns the seconds to wait before a request to the remote
+        laboratory is allowed again
+        """
+        reopen = health_registry.get_reopen_time(self.uid, self.cooldown)
+        return max(reopen - time.time(), 0)
+
+    def store(self, obj, data, response):
+        """Stores the response of the POST with the given data to the object
+        or objects passed-in. For POSTs with multiple samples, each sample
+        gets its own outcome and the single-sample payload
+        """
+        # Keep track of the health of the remote laboratory
+        persist_health(self.laboratory)
+
+        objects = obj if isinstance(obj, (list, tuple)) else [obj]
+        consumer = data.get("consumer")
+        samples = data.get("samples")
+        if consumer != "senaite.referral.outbound_sample" \
+                or not isinstance(samples, (list, tuple)):
+            for obj in objects:
+                save_post(obj, data, response)
+            return
+
+        info = response
+        if not isinstance(response, dict):
+            info = get_post_info(response)
+
+        # Per-sample outcomes reported by the remote laboratory
+        results = info.get("content_json", {}).get("results") or []
+        results = dict([(res.get("uid"), res) for res in results])
+
+        # Sample records sent, keyed by uid
+        records = dict([(rec.get("uid"), rec) for rec in samples])
+
+        for obj in objects:
+            uid = api.get_uid(obj)
+            payload = dict(data)
+            payload.pop("samples")
+            payload["sample"] = records.get(uid)
+
+            post = dict(info)
+            result = results.get(uid)
+            if result:
+                post.update({
+                    "content_json": result,
+                    "success": result.get("success", False),
+                    "message": result.get("message", ""),
+                })
+            elif post.get("success"):
+                post.update({
+                    "success": False,
+                    "message": "No result for {}".format(api.get_id(obj)),
+                })
+            save_post(obj, payload, post)
+
+    def get_notification_data(self, payload):
+        """Returns the data to send to the remote laboratory for the payload
+        passed-in, with the reserved parameters in place
         """
         # Be sure we have the basics in place in the payload
         data = {"consumer": "senaite.referral.consumer"}
@@ -382,22 +624,55 @@ class RemoteLab(object):
             "remote_lab": api.get_uid(self.laboratory),
             "lab_code": get_lab_code()
         })
+        return data
+
+    def post(self, data, timeout=5, endpoint="push"):
+        """Sends a POST request with the data passed-in to the remote
+        laboratory. Returns the response or a dict-like object with the
+        information of the error if the remote laboratory cannot be reached.
+        No request is done while the circuit for the remote laboratory is
+        open because of too many consecutive failures
+        """
+        if self.compress and endpoint == "push":
+            # senaite.jsonapi's push does not support compressed payloads
+            endpoint = "referral/push"
+
+        url = self.session.get_api_url(endpoint)
+        allowed = health_registry.allow(self.uid, self.failure_threshold,
+                                        self.cooldown)
+        if not allowed:
+            # Dummy response
+            response = get_post_base_info()
+            response.update({
+                "url": url,
+                "status": 503,
+                "reason": "Circuit open",
+                "message": "Remote laboratory is unreachable. Too many "
+                           "consecutive failures",
+                "success": False,
+            })
+            logger.warn("Circuit open for {}: POST skipped".format(url))
+            metrics.record(metrics.OUTBOUND, data.get("consumer"), self.code,
+                           0, items=metrics.count_items(data),
+                           error="Circuit open")
+            return response
 
-        # Do the POST request and store the response for later use if required
+        start = time.time()
         try:
-            response = self.session.post("push", data, timeout=timeout)
+            response = self.session.post(endpoint, data, timeout=timeout,
+                                         compress=self.compress)
         except Exception as e:
             # Dummy response
             response = get_post_base_info()
             response.update({
-                "url": self.session.get_api_url("push"),
+                "url": url,
                 "status": 500,
                 "reason": type(e).__name__,
                 "message": str(e),
                 "success": False,
+                "elapsed": time.time() - start,
             })
             logger.error(str(e))
 
-        # Store the response, so we can keep track of the POSTs made for this
-        # given object and retry if necessary
-        save_post(obj, data, response)
+        health_registry.record(self.uid, response, self.failure_threshold)
+        return response
@@ -18,20 +18,214 @@
 # Copyright 2021-2022 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+import hashlib
 import json
+import logging
+import random
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 
 import requests
+from requests.adapters import HTTPAdapter
 from senaite.referral import logger
+from senaite.referral import metrics
+from senaite.referral.config import PROTOCOL_VERSION
+import six
 from six import string_types
 
 
+class SessionPool(object):
+    """Process-wide pool of HTTP sessions, one per external laboratory.
+
+    Sessions are shared by all the threads of the current (ZEO client) process
+    so that consecutive POSTs to the same remote laboratory reuse the TCP/TLS
+    connections instead of doing a handshake for every single request. Each
+    session is bound to a fingerprint (url and credentials) of the laboratory:
+    when the fingerprint changes, the stale session is replaced.
+
+    Sessions are leased while in use. A session that is replaced, invalidated
+    or evicted while leased by another thread is only closed when the last
+    lease is released, and idle sessions are never evicted while leased.
+
+    The pool does not read the settings from the registry, cause sessions are
+    requested from threads without database access. Callers pass them in
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._sessions = {}
+        # number of leases of each session, keyed by session id
+        self._leases = {}
+        # sessions removed from the pool while leased, keyed by session id
+        self._retired = {}
+
+    def get(self, key, fingerprint, pool_size=10, keep_alive=True,
+            idle_timeout=300):
+        """Returns the HTTP session for the given key and fingerprint. The
+        session is not leased, use `lease` when the session is to be used
+        """
+        now = time.time()
+        with self._lock:
+            # close the sessions that have not been used for a while
+            self.evict_idle(idle_timeout, now=now)
+
+            fp, session, last_used = self._sessions.get(key, (None, None, 0))
+            if session is not None and fp != fingerprint:
+                # url or credentials changed
+                self._close(key)
+                session = None
+
+            if session is None:
+                session = self.new_session(pool_size, keep_alive)
+
+            self._sessions[key] = (fingerprint, session, now)
+            return session
+
+    @contextmanager
+    def lease(self, key, fingerprint, pool_size=10, keep_alive=True,
+              idle_timeout=300):
+        """Context manager that returns the HTTP session for the given key and
+        fingerprint, that is neither closed nor evicted while in use
+        """
+        with self._lock:
+            session = self.get(key, fingerprint, pool_size=pool_size,
+                               keep_alive=keep_alive,
+                               idle_timeout=idle_timeout)
+            sid = id(session)
+            self._leases[sid] = self._leases.get(sid, 0) + 1
+        try:
+            yield session
+        finally:
+            self.release(key, session)
+
+    def release(self, key, session):
+        """Releases a lease of the session passed-in. The session is closed if
+        it was removed from the pool and this was the last lease
+        """
+        with self._lock:
+            sid = id(session)
+            leases = self._leases.get(sid, 0) - 1
+            if leases > 0:
+                self._leases[sid] = leases
+                return
+
+            self._leases.pop(sid, None)
+            retired = self._retired.pop(sid, None)
+            if retired is not None:
+                self._close_session(retired)
+                return
+
+            # the session has been used until now
+            fp, pooled, last_used = self._sessions.get(key, (None, None, 0))
+            if pooled is session:
+                self._sessions[key] = (fp, session, time.time())
+
+    def is_leased(self, session):
+        """Returns whether the session passed-in is in use
+        """
+        with self._lock:
+            return self._leases.get(id(session), 0) > 0
+
+    def new_session(self, pool_size=10, keep_alive=True):
+        """Returns a new HTTP session with a pooled adapter that keeps up to
+        `pool_size` connections with the remote host
+        """
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not keep_alive:
+            session.headers.update({"Connection": "close"})
+        return session
+
+    def invalidate(self, key):
+        """Removes the session for the given key, if any. The session is
+        closed as soon as it is no longer in use
+        """
+        with self._lock:
+            self._close(key)
+
+    def evict_idle(self, timeout, now=None):
+        """Closes and removes the sessions that are not in use and have been
+        idle for longer than the timeout (in seconds) passed-in
+        """
+        if timeout <= 0:
+            return
+        now = now or time.time()
+        with self._lock:
+            for key, (fp, session, last_used) in list(self._sessions.items()):
+                if self.is_leased(session):
+                    continue
+                if now - last_used > timeout:
+                    self._close(key)
+
+    def clear(self):
+        """Removes all sessions. Sessions are closed as soon as they are no
+        longer in use
+        """
+        with self._lock:
+            for key in list(self._sessions.keys()):
+                self._close(key)
+
+    def _close(self, key):
+        fp, session, last_used = self._sessions.pop(key, (None, None, 0))
+        if session is None:
+            return
+        if self.is_leased(session):
+            # still in use by another thread, close on release
+            self._retired[id(session)] = session
+            return
+        self._close_session(session)
+
+    def _close_session(self, session):
+        try:
+            session.close()
+        except Exception as e:
+            logger.warn("Cannot close HTTP session: {}".format(str(e)))
+
+
+# Pool of HTTP sessions shared across requests within the current process
+session_pool = SessionPool()
+
+
+def invalidate_session(key):
+    """Closes the pooled HTTP session for the given key, if any
+    """
+    session_pool.invalidate(key)
+
+
 class RemoteSession(object):
 
     session = None
 
-    def __init__(self, host, auth):
+    def __init__(self, host, auth, key=None, log_sampling=0, label=None,
+                 pool_size=10, keep_alive=True, idle_timeout=300):
         self.host = host
         self.auth = auth
+        self.key = key
+        # settings of the pooled HTTP session
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.idle_timeout = idle_timeout
+        # name of the remote laboratory in metrics
+        self.label = label
+        # percentage of POSTs with the whole payload written to the log
+        self.log_sampling = log_sampling
+
+    def http(self):
+        """Returns a context manager with the pooled HTTP session to use for
+        the requests, leased while in use
+        """
+        key = self.key or self.host
+        auth = getattr(self.auth, "username", None), \
+            getattr(self.auth, "password", None)
+        # replace the pooled session as well if its settings changed
+        fingerprint = (self.host, ) + auth + (self.pool_size, self.keep_alive)
+        return session_pool.lease(key, fingerprint, pool_size=self.pool_size,
+                                  keep_alive=self.keep_alive,
+                                  idle_timeout=self.idle_timeout)
 
     def get_api_url(self, endpoint):
         """Returns the API url of the remote instance and endpoint
@@ -51,14 +245,89 @@ class RemoteSession(object):
             output[key] = value
         return output
 
-    def post(self, endpoint, payload, timeout=5):
+    def compress(self, data):
+        """Returns the data passed-in as a single JSON document compressed with
+        gzip, with the version of the protocol in place
+        """
+        data = dict(data, protocol=PROTOCOL_VERSION)
+        document = json.dumps(data)
+        if isinstance(document, six.text_type):
+            document = document.encode("utf-8")
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return compressor.compress(document) + compressor.flush()
+
+    def get_payload_info(self, payload, body):
+        """Returns a dict with the size, the number of items of each list and
+        the digest of the payload passed-in, suitable for logging
+        """
+        digest = body
+        if isinstance(digest, six.text_type):
+            digest = digest.encode("utf-8")
+        items = ["{}:{}".format(key, len(value))
+                 for key, value in sorted(payload.items())
+                 if isinstance(value, (list, tuple))]
+        return {
+            "consumer": payload.get("consumer", ""),
+            "size": len(body),
+            "count": metrics.count_items(payload),
+            "items": ",".join(items) or "-",
+            "digest": hashlib.sha1(digest).hexdigest()[:12],
+        }
+
+    def is_sampled(self):
+        """Returns whether the whole payload of the current POST has to be
+        written to the log
+        """
+        if logger.isEnabledFor(logging.DEBUG):
+            return True
+        return random.random() * 100 < self.log_sampling
+
+    def post(self, endpoint, payload, timeout=5, compress=False):
         url = self.get_api_url(endpoint)
-        payload = self.jsonify(payload)
+        headers = {"Content-Type": "application/json"}
+
+        if compress:
+            # Send the payload as a single gzip-compressed JSON document
+            body = self.compress(payload)
+            headers["Content-Encoding"] = "gzip"
+        else:
+            data = dict(payload)
+            data.pop("protocol", None)
+            body = json.dumps(self.jsonify(data))
+
+        if self.is_sampled():
+            logger.info("[POST PAYLOAD] {} {}".format(url, repr(payload)))
+
+        info = self.get_payload_info(payload, body)
+        info.update({
+            "url": url,
+            "compressed": compress,
+            "status": None,
+            "error": None,
+        })
 
         # Send the POST request
-        logger.info("[POST] {}".format(url))
-        logger.info("[POST PAYLOAD] {}".format(repr(payload)))
-        resp = requests.post(url, json=payload, auth=self.auth, timeout=timeout)
+        start = time.time()
+        try:
+            with self.http() as http:
+                resp = http.post(url, data=body, headers=headers,
+                                 auth=self.auth, timeout=timeout)
+            info["status"] = resp.status_code
+            if resp.status_code >= 400:
+                info["error"] = "HTTP {}".format(resp.status_code)
+        except Exception as e:
+            info["error"] = type(e).__name__
+            raise
+        finally:
+            info["elapsed"] = time.time() - start
+            metrics.record(metrics.OUTBOUND, info["consumer"],
+                           self.label or self.key, info["elapsed"],
+                           size=info["size"], items=info["count"],
+                           error=info["error"])
+            logger.info(
+                "[POST] {url} status={status} elapsed={elapsed:.3f}s "
+                "size={size} compressed={compressed} consumer={consumer} "
+                "items={items} digest={digest}".format(**info))
 
         # Return the response
         return resp
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+import math
+import random
+from collections import OrderedDict
+from datetime import datetime
+
+from senaite.referral import logger
+from senaite.referral.catalog import INBOUND_SAMPLE_CATALOG
+from senaite.referral.catalog import SHIPMENT_CATALOG
+from senaite.referral.dispatcher import dispatch_requests
+from senaite.referral.interfaces import IExternalLaboratory
+from senaite.referral.interfaces import IInboundSampleShipment
+from senaite.referral.interfaces import IOutboundSampleShipment
+from senaite.referral.notifications import get_last_post
+from senaite.referral.notifications import get_last_post_status
+from senaite.referral.notifications import get_last_post_summary
+from senaite.referral.notifications import is_error
+from senaite.referral.notifications import POST_FAILED
+from senaite.referral.notifications import POST_SUCCEEDED
+from senaite.referral.remotelab import get_remote_connection
+from senaite.referral.remotelab import RESULTS_BATCH_SIZE
+from senaite.referral.utils import get_retry_backoff
+from senaite.referral.utils import get_retry_backoff_max
+from senaite.referral.utils import get_retry_max_workers
+
+from bika.lims import api
+from bika.lims.interfaces import IAnalysisRequest
+
+# Number of objects processed after which the progress is logged
+LOG_PROGRESS_EVERY = 50
+
+
+def get_failed_uids(laboratory=None):
+    """Returns the UIDs of the shipments and samples for which the last
+    notification (POST request) failed, optionally filtered by laboratory.
+    Relies on catalogs only
+    """
+    query = {"last_post_status": POST_FAILED}
+    if laboratory:
+        query["laboratory_uid"] = api.get_uid(laboratory)
+
+    # Inbound and outbound shipments
+    brains = api.search(query, SHIPMENT_CATALOG)
+    uids = [api.get_uid(brain) for brain in brains]
+
+    # Samples, through their inbound sample counterparts
+    query["portal_type"] = "InboundSample"
+    for brain in api.search(query, INBOUND_SAMPLE_CATALOG):
+        uids.extend(filter(api.is_uid, brain.sample_uid or []))
+
+    # Remove duplicates while keeping the order
+    return OrderedDict.fromkeys(uids).keys()
+
+
+def to_datetime(value):
+    """Converts the ISO-formatted datetime passed-in to a datetime object.
+    Returns None if not valid
+    """
+    for fmt in ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+def get_retry_delay(failures, seed=None):
+    """Returns the seconds to wait before retrying a notification that failed
+    the number of consecutive times passed-in. The delay grows exponentially
+    up to the maximum delay and has a random jitter, so retries of many
+    notifications that failed together are spread over time. The jitter is
+    always the same for a given seed
+    """
+    delay = get_retry_backoff() * 2 ** max(failures - 1, 0)
+    delay = min(delay, get_retry_backoff_max())
+    return random.Random(seed).uniform(delay / 2.0, delay)
+
+
+def is_retry_due(obj):
+    """Returns whether the last notification (POST request) for the given
+    object failed and enough time passed since then to retry
+    """
+    summary = get_last_post_summary(obj)
+    if not summary or not is_error(summary):
+        return False
+
+    sent = to_datetime(summary.get("datetime"))
+    if not sent:
+        return True
+
+    elapsed = datetime.now() - sent
+    elapsed = elapsed.days * 86400 + elapsed.seconds
+
+    # seed the jitter with the object and the failures, so the delay does not
+    # change each time we check whether the retry is due
+    failures = summary.get("failures", 1)
+    seed = "{}-{}".format(api.get_uid(obj), failures)
+    return elapsed >= get_retry_delay(failures, seed=seed)
+
+
+def get_notification_laboratory(obj, payload):
+    """Returns the external laboratory the notification (POST request) about
+    the given object with the payload passed-in was sent to
+    """
+    laboratory = api.get_object_by_uid(payload.get("remote_lab"), None)
+    if IExternalLaboratory.providedBy(laboratory):
+        return laboratory
+
+    if IAnalysisRequest.providedBy(obj):
+        obj = obj.getInboundShipment()
+
+    if IInboundSampleShipment.providedBy(obj):
+        return obj.getReferringLaboratory()
+
+    elif IOutboundSampleShipment.providedBy(obj):
+        return obj.getReferenceLaboratory()
+
+    return None
+
+
+def get_timeout_for(num_objects):
+    """Returns the timeout for a POST request about the number of objects
+    passed-in
+    """
+    return math.ceil((math.log(max(num_objects, 1))+1)*5)
+
+
+def get_requests(remote_lab, items):
+    """Returns the list of requests to send to the remote lab for the items
+    (object, payload) passed-in, as tuples of (remote_lab, objects, payload,
+    endpoint). The results of samples are sent together when the remote lab
+    supports batched notifications
+    """
+    requests = []
+    batched = []
+    batch = remote_lab.laboratory.getBatchNotifications()
+    for obj, payload in items:
+        consumer = payload.get("consumer")
+        if batch and consumer == "senaite.referral.outbound_sample" \
+                and payload.get("sample"):
+            batched.append((obj, payload))
+            continue
+        requests.append((remote_lab, [obj], payload, "push"))
+
+    for num in range(0, len(batched), RESULTS_BATCH_SIZE):
+        chunk = batched[num:num+RESULTS_BATCH_SIZE]
+        payload = dict(chunk[0][1])
+        payload.pop("sample")
+        payload["samples"] = [item[1]["sample"] for item in chunk]
+        objects = [item[0] for item in chunk]
+        requests.append((remote_lab, objects, payload, "referral/push"))
+
+    return requests
+
+
+def retry_notifications(objects, force=False):
+    """Re-sends the last notification (POST request) of the objects passed-in
+    to the remote laboratories. Notifications are grouped by laboratory and
+    sent concurrently, while the responses are stored from current thread.
+    Unless force is True, only the failed notifications that are due for a
+    retry in accordance with the backoff policy are re-sent
+    :returns: dict with the summary of the retry
+    """
+    report = {
+        "total": len(objects),
+        "retried": 0,
+        "succeeded": 0,
+        "failed": 0,
+        "skipped": 0,
+        "errors": [],
+    }
+
+    # Group the notifications to retry by laboratory
+    groups = OrderedDict()
+    for obj in objects:
+        if not force and not is_retry_due(obj):
+            report["skipped"] += 1
+            continue
+
+        post = get_last_post(obj) or {}
+        payload = post.get("payload")
+        if not payload:
+            report["skipped"] += 1
+            report["errors"].append(
+                "No payload found for {}".format(api.get_id(obj)))
+            continue
+
+        laboratory = get_notification_laboratory(obj, payload)
+        remote_lab = get_remote_connection(laboratory)
+        if not remote_lab:
+            report["skipped"] += 1
+            report["errors"].append(
+                "No remote laboratory found for {}".format(api.get_id(obj)))
+            continue
+
+        lab_uid = api.get_uid(laboratory)
+        if lab_uid not in groups:
+            groups[lab_uid] = (remote_lab, [])
+        groups[lab_uid][1].append((obj, payload))
+
+    requests = []
+    for remote_lab, items in groups.values():
+        requests.extend(get_requests(remote_lab, items))
+
+    # Send the requests concurrently, but with a bounded number of workers
+    groups = []
+    for remote_lab, objects, payload, endpoint in requests:
+        timeout = get_timeout_for(len(objects))
+        groups.append([(remote_lab, payload, timeout, endpoint)])
+
+    workers = get_retry_max_workers()
+    responses = dispatch_requests(groups, max_workers=workers)
+    for num, response in enumerate(responses):
+
+        # Store the response from the main thread
+        remote_lab, objects, payload, endpoint = requests[num]
+        remote_lab.store(objects, payload, response[0])
+
+        for obj in objects:
+            status = get_last_post_status(obj)
+            report["retried"] += 1
+            if status == POST_SUCCEEDED:
+                report["succeeded"] += 1
+            else:
+                report["failed"] += 1
+
+        if num and num % LOG_PROGRESS_EVERY == 0:
+            logger.info("Retried notifications: {}/{}".format(
+                report["retried"], report["total"]))
+
+    logger.info("Retried notifications: {retried}/{total} (succeeded: "
+                "{succeeded}, failed: {failed}, skipped: {skipped})"
+                .format(**report))
+    return report
+
+
+def retry_failed_notifications(laboratory=None, limit=None, force=False):
+    """Re-sends the failed notifications (POST requests) to the remote
+    laboratories, optionally filtered by laboratory. Unless force is True,
+    only the notifications that are due for a retry are re-sent
+    :returns: dict with the summary of the retry
+    """
+    uids = get_failed_uids(laboratory)
+    objects = []
+    missing = 0
+    for uid in uids:
+        obj = api.get_object_by_uid(uid, default=None)
+        if not obj:
+            missing += 1
+            continue
+        if not force and not is_retry_due(obj):
+            continue
+        objects.append(obj)
+        if limit and len(objects) >= limit:
+            break
+
+    report = retry_notifications(objects, force=True)
+
+    # Objects not retried because of the limit or not being due are still in
+    # failed status. The status of those retried is read from the objects,
+    # cause catalogs are not updated until the transaction is committed
+    failed = [obj for obj in objects
+              if get_last_post_status(obj) == POST_FAILED]
+    report["pending"] = len(uids) - missing - len(objects) + len(failed)
+    return report
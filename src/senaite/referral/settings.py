@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from plone.registry.interfaces import IRegistry
+from senaite.referral import PRODUCT_NAME
+from senaite.referral.browser.controlpanel import IReferralControlPanel
+from zope.annotation.interfaces import IAnnotations
+from zope.component import queryUtility
+from zope.schema import getFieldsInOrder
+from zope.schema.interfaces import IBool
+from zope.schema.interfaces import IInt
+
+from bika.lims import api
+
+# Key of the request annotation where the settings snapshot is kept
+SETTINGS_STORAGE = "senaite.referral.settings"
+
+
+class ReferralSettings(object):
+    """Snapshot of the senaite.referral settings from the registry. All the
+    records of the control panel are read at once, with values converted to
+    the type of the control panel field. Other records are read on demand
+    """
+
+    def __init__(self):
+        self._values = {}
+        self._registry = queryUtility(IRegistry)
+        for name, field in getFieldsInOrder(IReferralControlPanel):
+            value = self.read(name)
+            self._values[name] = self.to_type(field, value)
+
+    def read(self, name, default=None):
+        """Returns the value of the record from the registry
+        """
+        if self._registry is None:
+            return default
+        key = "{}.{}".format(PRODUCT_NAME, name)
+        return self._registry.get(key, default)
+
+    def to_type(self, field, value):
+        """Converts the value to the type of the field passed-in
+        """
+        if value is None:
+            return field.default
+        if IBool.providedBy(field):
+            return bool(value)
+        if IInt.providedBy(field):
+            return api.to_int(value, field.default)
+        return value
+
+    def get(self, name, default=None):
+        """Returns the value of the setting with the given name
+        """
+        if name not in self._values:
+            self._values[name] = self.read(name)
+        value = self._values[name]
+        if value is None:
+            return default
+        return value
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.get(name)
+
+
+def get_settings():
+    """Returns the settings of senaite.referral. The settings are read once
+    per request
+    """
+    request = api.get_request()
+    annotation = IAnnotations(request, None)
+    if annotation is None:
+        # no request or not annotatable
+        return ReferralSettings()
+
+    settings = annotation.get(SETTINGS_STORAGE)
+    if settings is None:
+        settings = ReferralSettings()
+        annotation[SETTINGS_STORAGE] = settings
+    return settings
+
+
+def invalidate_settings():
+    """Discards the settings read within the current request, if any
+    """
+    request = api.get_request()
+    annotation = IAnnotations(request, None)
+    if annotation is not None:
+        annotation.pop(SETTINGS_STORAGE, None)
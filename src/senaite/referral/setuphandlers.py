@@ -21,9 +21,10 @@
 from collections import OrderedDict
 import copy  # noqa
 
-from bika.lims.api import UID_CATALOG
+from bika.lims.api import PORTAL_CATALOG
 from plone.registry.interfaces import IRegistry
 from senaite.core.api.workflow import update_workflow
+from senaite.core.catalog import SAMPLE_CATALOG
 from senaite.core.registry import get_registry_record
 from senaite.core.registry import set_registry_record
 from senaite.core.setuphandlers import setup_core_catalogs
@@ -69,11 +70,19 @@ CATALOGS = (
 
 # Tuples of (catalog, index_name, index_attribute, index_type)
 INDEXES = [
-    (UID_CATALOG, "remote_uid", "remote_uid", "FieldIndex")
+    (PORTAL_CATALOG, "code", "code", "FieldIndex"),
+    (PORTAL_CATALOG, "is_reference", "is_reference", "BooleanIndex"),
+    (PORTAL_CATALOG, "is_referring", "is_referring", "BooleanIndex"),
+    (SAMPLE_CATALOG, "last_post_status", "last_post_status", "FieldIndex"),
+    (SAMPLE_CATALOG, "post_failures_count", "post_failures_count",
+     "FieldIndex"),
 ]
 
 # Tuples of (catalog, column_name)
 COLUMNS = [
+    (SAMPLE_CATALOG, "last_post_datetime"),
+    (SAMPLE_CATALOG, "last_post_status"),
+    (SAMPLE_CATALOG, "post_failures_count"),
 ]
 
 # Tuples of (folder_id, folder_title_msgid, portal_type)
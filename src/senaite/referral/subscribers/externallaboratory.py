@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+from bika.lims import api
+from senaite.referral.health import health_registry
+from senaite.referral.health import reset_health
+from senaite.referral.health import update_connection
+from senaite.referral.remotesession import invalidate_session
+
+
+def on_modified(laboratory, event):
+    """Event handler executed when an ExternalLaboratory is modified. If the
+    url or the credentials changed, closes the pooled HTTP session with the
+    remote laboratory, so a new one is created on next POST. The health is
+    reset too, so the next POST is sent even if the circuit was open
+    """
+    if not update_connection(laboratory):
+        # other fields changed, keep the health of the connection
+        return
+    invalidate_session(api.get_uid(laboratory))
+    reset_health(laboratory)
+
+
+def on_removed(laboratory, event):
+    """Event handler executed when an ExternalLaboratory is removed. Closes
+    the pooled HTTP session with the remote laboratory, if any
+    """
+    invalidate_session(api.get_uid(laboratory))
+    health_registry.forget(api.get_uid(laboratory))
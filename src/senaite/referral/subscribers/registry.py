@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from senaite.referral import PRODUCT_NAME
+from senaite.referral.settings import invalidate_settings
+
+
+def on_record_modified(event):
+    """Event handler executed when a registry record is modified. Discards
+    the settings of senaite.referral read within the current request
+    """
+    name = getattr(event.record, "__name__", "") or ""
+    if name.startswith("{}.".format(PRODUCT_NAME)):
+        invalidate_settings()
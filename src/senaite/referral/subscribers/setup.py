@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.REFERRAL.
+#
+# SENAITE.REFERRAL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the Free
+# Software Foundation, version 2.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Copyright 2021-2023 by it's authors.
+# Some rights reserved, see README and LICENSE.
+
+
+from senaite.referral.cache import USERS_GENERATION_STORAGE
+from senaite.referral.cache import invalidate
+
+
+def on_setup_changed(obj, event):
+    """Event handler executed when a setup object the cached mappings depend
+    on (e.g. AnalysisService, SampleType, Instrument or Method) is added,
+    modified, removed or transitioned. Invalidates the cached mappings in all
+    processes
+    """
+    invalidate()
+
+
+def on_contact_changed(contact, event):
+    """Event handler executed when a LabContact is modified or removed.
+    Invalidates the cached information of users in all processes
+    """
+    invalidate(storage=USERS_GENERATION_STORAGE)
+
+
+def on_user_changed(event):
+    """Event handler executed when the properties of a user are updated or
+    the user is removed. Invalidates the cached information of users in all
+    processes
+    """
+    invalidate(storage=USERS_GENERATION_STORAGE)
@@ -18,22 +18,33 @@
 # Copyright 2021-2023 by it's authors.
 # Some rights reserved, see README and LICENSE.
 
+import transaction
 from bika.lims import api
 from bika.lims.api import UID_CATALOG
 from bika.lims.utils import changeWorkflowState
 from plone import api as ploneapi
+from plone.registry.interfaces import IRegistry
+from senaite.core.catalog import ANALYSIS_CATALOG
+from senaite.core.catalog import SAMPLE_CATALOG
 from senaite.core.upgrade import upgradestep
 from senaite.core.upgrade.utils import UpgradeUtils
 from senaite.referral import logger
 from senaite.referral import PRODUCT_NAME
+from senaite.referral.api import get_remote_uid
+from senaite.referral.api import get_remote_uids_storage
 from senaite.referral.catalog import INBOUND_SAMPLE_CATALOG
 from senaite.referral.catalog import SHIPMENT_CATALOG
 from senaite.referral.config import PRODUCT_NAME as product
+from senaite.referral.interfaces import IRemoteContent
+from senaite.referral.notifications import migrate_posts
+from senaite.referral.notifications import POST_INDEXES
 from senaite.referral.setuphandlers import setup_ajax_transitions
+from senaite.referral.setuphandlers import setup_catalogs
 from senaite.referral.setuphandlers import setup_workflows
 from senaite.referral.utils import get_notify_unrequested
 from senaite.referral.utils import get_sample_types_mapping
 from senaite.referral.utils import get_services_mapping
+from zope.component import getUtility
 
 version = "2.0.0"
 profile = "profile-{0}:default".format(product)
@@ -205,3 +216,238 @@ def setup_outbound_samples_order(tool):
     setup = portal.portal_setup
     setup.runImportStepFromProfile(profile, "plone.app.registry")
     logger.info("Setup order of outbound samples [DONE]")
+
+
+def setup_session_pool(tool):
+    logger.info("Setup HTTP connections pool settings ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup HTTP connections pool settings [DONE]")
+
+
+def setup_outbox(tool):
+    logger.info("Setup notifications outbox settings ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup notifications outbox settings [DONE]")
+
+
+def setup_notifications_log(tool):
+    """Setup the settings for the history of notifications and moves the
+    notifications (POST requests) from the legacy storage to the new one
+    """
+    logger.info("Setup notifications history ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+
+    # Migrate the notifications from shipments and samples
+    migrate_notifications(SHIPMENT_CATALOG, ["InboundSampleShipment",
+                                             "OutboundSampleShipment"])
+    migrate_notifications(SAMPLE_CATALOG, ["AnalysisRequest"])
+
+    logger.info("Setup notifications history [DONE]")
+
+
+def migrate_notifications(catalog, portal_types):
+    """Moves the notifications (POST requests) of the objects from the given
+    catalog and portal types from the legacy storage to the new one
+    """
+    query = {"portal_type": portal_types}
+    brains = api.search(query, catalog)
+    total = len(brains)
+    for num, brain in enumerate(brains):
+        if num and num % 100 == 0:
+            logger.info("Processed objects: {}/{}".format(num, total))
+            # free memory
+            transaction.savepoint(optimistic=True)
+
+        obj = api.get_object(brain, default=None)
+        if not obj:
+            continue
+
+        migrate_posts(obj)
+        obj._p_deactivate()
+
+
+def setup_notifications_status(tool):
+    """Adds the indexes and columns for the status of the last notification
+    (POST request) to catalogs and reindexes the objects notified already
+    """
+    logger.info("Setup notifications status indexes ...")
+    portal = tool.aq_inner.aq_parent
+    setup_catalogs(portal)
+
+    def reindex(obj):
+        if obj:
+            obj.reindexObject(idxs=POST_INDEXES)
+            obj._p_deactivate()
+
+    # Shipments and the samples from outbound shipments
+    brains = api.search({}, SHIPMENT_CATALOG)
+    total = len(brains)
+    for num, brain in enumerate(brains):
+        if num and num % 100 == 0:
+            logger.info("Processed shipments: {}/{}".format(num, total))
+            transaction.savepoint(optimistic=True)
+
+        shipment = api.get_object(brain)
+        if api.get_portal_type(shipment) == "OutboundSampleShipment":
+            for uid in shipment.getRawSamples():
+                reindex(api.get_object_by_uid(uid, default=None))
+        reindex(shipment)
+
+    # Inbound samples and their sample counterparts
+    brains = api.search({"portal_type": "InboundSample"},
+                        INBOUND_SAMPLE_CATALOG)
+    total = len(brains)
+    for num, brain in enumerate(brains):
+        if num and num % 100 == 0:
+            logger.info("Processed inbound samples: {}/{}".format(num, total))
+            transaction.savepoint(optimistic=True)
+
+        inbound_sample = api.get_object(brain)
+        reindex(inbound_sample.getSample())
+        reindex(inbound_sample)
+
+    logger.info("Setup notifications status indexes [DONE]")
+
+
+def setup_retry_notifications(tool):
+    logger.info("Setup retry of notifications settings ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup retry of notifications settings [DONE]")
+
+
+def setup_dispatcher(tool):
+    logger.info("Setup notifications dispatcher settings ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup notifications dispatcher settings [DONE]")
+
+
+def setup_circuit_breaker(tool):
+    logger.info("Setup circuit breaker settings ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup circuit breaker settings [DONE]")
+
+
+def setup_chunk_size_create_inbound_sample(tool):
+    logger.info("Setup chunk size for inbound sample creation ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup chunk size for inbound sample creation [DONE]")
+
+
+def setup_chunk_size_referral_consumer(tool):
+    logger.info("Setup chunk size for remote actions ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup chunk size for remote actions [DONE]")
+
+
+def setup_external_laboratories_indexes(tool):
+    """Adds the indexes for the code and roles of external laboratories to
+    portal_catalog and reindexes the existing external laboratories
+    """
+    logger.info("Setup external laboratories indexes ...")
+    portal = tool.aq_inner.aq_parent
+    setup_catalogs(portal)
+
+    query = {"portal_type": "ExternalLaboratory"}
+    for brain in api.search(query, "portal_catalog"):
+        obj = api.get_object(brain)
+        obj.reindexObject(idxs=["code", "is_reference", "is_referring"])
+
+    logger.info("Setup external laboratories indexes [DONE]")
+
+
+def setup_notifications_logging(tool):
+    logger.info("Setup bounded notifications logging ...")
+    portal = tool.aq_inner.aq_parent
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, "plone.app.registry")
+    logger.info("Setup bounded notifications logging [DONE]")
+
+
+def remove_chunk_size_ship(tool):
+    """Removes the record for the chunk size of shipping samples, if any.
+    Samples are shipped within the same request, so the view can tell which
+    samples were not shipped
+    """
+    logger.info("Remove chunk size for shipping samples ...")
+    registry = getUtility(IRegistry)
+    key = "senaite.referral.chunk_size_ship"
+    if key in registry.records:
+        del registry.records[key]
+    logger.info("Remove chunk size for shipping samples [DONE]")
+
+
+def migrate_outbound_shipments_samples(tool):
+    """Moves the samples assigned to outbound shipments from the legacy field
+    to the conflict-resistant storage, keeping their order
+    """
+    logger.info("Migrate samples of outbound shipments ...")
+    query = {"portal_type": "OutboundSampleShipment"}
+    brains = api.search(query, SHIPMENT_CATALOG)
+    total = len(brains)
+    for num, brain in enumerate(brains):
+        if num and num % 100 == 0:
+            logger.info("Processed shipments: {}/{}".format(num, total))
+            transaction.savepoint(optimistic=True)
+
+        shipment = api.get_object(brain)
+        shipment._get_samples_storage(create=True)
+        shipment._p_deactivate()
+
+    logger.info("Migrate samples of outbound shipments [DONE]")
+
+
+def migrate_remote_uid_index(tool):
+    """Maps the remote UIDs stored in the referral annotations of samples and
+    analyses to the UIDs of the local objects and removes the 'remote_uid'
+    index from 'uid_catalog', that is no longer maintained
+    """
+    logger.info("Migrate remote uids to the mapping of remote uids ...")
+    storage = get_remote_uids_storage(create=True)
+    duplicates = set()
+    query = {"object_provides": IRemoteContent.__identifier__}
+    for catalog in [SAMPLE_CATALOG, ANALYSIS_CATALOG]:
+        brains = api.search(query, catalog)
+        total = len(brains)
+        for num, brain in enumerate(brains):
+            if num and num % 100 == 0:
+                logger.info("Processed objects: {}/{}".format(num, total))
+                transaction.commit()
+
+            obj = api.get_object(brain)
+            uid = api.get_uid(obj)
+            remote_uid = get_remote_uid(obj)
+            obj._p_deactivate()
+            if not remote_uid or remote_uid in duplicates:
+                continue
+
+            if storage.get(remote_uid, uid) != uid:
+                logger.warn("Cannot migrate remote uid {}: linked to more "
+                            "than one object".format(remote_uid))
+                duplicates.add(remote_uid)
+                del storage[remote_uid]
+                continue
+
+            storage[remote_uid] = uid
+
+    index = "remote_uid"
+    uc = api.get_tool(UID_CATALOG)
+    if index in uc.indexes():
+        uc.delIndex(index)
+
+    logger.info("Migrate remote uids to the mapping of remote uids [DONE]")
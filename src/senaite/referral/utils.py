@@ -23,10 +23,15 @@ import copy
 import json
 from datetime import datetime
 
-from plone.api.exc import InvalidParameterError
+from Missing import MV
 from senaite.core.p3compat import cmp
 from senaite.referral import messageFactory as _
-from senaite.referral import PRODUCT_NAME
+from senaite.referral.cache import LRUCache
+from senaite.referral.cache import USERS_GENERATION_STORAGE
+from senaite.referral.cache import get_generation
+from senaite.referral.cache import is_dirty
+from senaite.referral.cache import setup_cache
+from senaite.referral.settings import get_settings
 from six import string_types
 from six.moves.urllib import parse
 from slugify import slugify
@@ -36,12 +41,19 @@ from bika.lims.utils import render_html_attributes
 from bika.lims.utils import t as _t
 from bika.lims.utils import to_utf8
 from bika.lims.workflow import getTransitionDate
+from bika.lims.catalog import CATALOG_ANALYSIS_REQUEST_LISTING
 from bika.lims.catalog import SETUP_CATALOG
 
 _marker = object()
 
 RESPONSES_ATTR_NAME = "_referal_post_responses"
 
+# Types of catalog indexes that only match the whole value passed-in
+EXACT_MATCH_INDEXES = ("FieldIndex", "BooleanIndex")
+
+# Information of users, keyed by (site path, generation, user id or username)
+user_info_cache = LRUCache(size=256)
+
 
 def set_field_value(instance, field_name, value):
     """Sets the value to a Schema field
@@ -103,11 +115,26 @@ def get_by_code(portal_type, code, catalog="portal_catalog"):
 
 
 def search_with_filters(query, catalog, first_only=False):
-    """Returns the objects for the code passed-in, if any
+    """Returns the objects that match with the query and filters passed-in.
+    Filters with a field or boolean index counterpart in the catalog are
+    resolved by the catalog. The rest are checked against each object
     """
     qry = copy.deepcopy(query)
     filters = qry.pop("filters", {})
 
+    # Delegate the filters to the catalog when possible. Only indexes that
+    # match the whole value exactly, other indexes (e.g. ZCTextIndex) would
+    # return objects with values that are only similar
+    indexes = api.get_tool(catalog)._catalog.indexes
+    for key in list(filters.keys()):
+        index = indexes.get(key)
+        if getattr(index, "meta_type", None) not in EXACT_MATCH_INDEXES:
+            continue
+        if isinstance(filters[key], (list, tuple, dict)):
+            # the catalog would return the objects that match any value
+            continue
+        qry[key] = filters.pop(key)
+
     def is_match(obj):
         for key, value in filters.items():
             obj_value = get_field_value(obj, key)
@@ -182,25 +209,20 @@ def get_image_url(name):
 def get_lab_code():
     """Returns the code of the current lab instance
     """
-    key = "{}.code".format(PRODUCT_NAME)
-    return api.get_registry_record(key)
+    return get_settings().get("code")
 
 
 def is_manual_inbound_shipment_permitted():
     """Returns whether the manual creation of inbound shipments is permitted
     """
-    key = "{}.manual_inbound_permitted".format(PRODUCT_NAME)
-    return api.get_registry_record(key, default=False)
+    return get_settings().get("manual_inbound_permitted", False)
 
 
 def get_chunk_size_for(action):
     """Returns the chunk_size for the given action
     """
-    try:
-        key = "{}.chunk_size_{}".format(PRODUCT_NAME, action)
-        chunk_size = api.get_registry_record(key, default=5)
-    except InvalidParameterError:
-        chunk_size = 5
+    name = "chunk_size_{}".format(action)
+    chunk_size = get_settings().get(name, 5)
     return api.to_int(chunk_size, 5)
 
 
@@ -258,15 +280,65 @@ def is_true(value):
     return is_true(str(value))
 
 
+def get_user_key(user_or_username):
+    """Returns the user id or username that identifies the user passed-in
+    """
+    if not user_or_username:
+        return None
+    if isinstance(user_or_username, string_types):
+        return user_or_username
+    return user_or_username.getId()
+
+
 def get_user_info(user_or_username, default=_marker):
-    """Returns a dict with the properties of the user passed-in
+    """Returns a dict with the properties of the user passed-in. The
+    properties are cached until a user or lab contact is changed
     """
-    user = api.get_user(user_or_username)
-    if not user:
+    key = get_user_key(user_or_username)
+    portal = api.get_portal()
+    generation = get_generation(portal, storage=USERS_GENERATION_STORAGE)
+    cache_key = (api.get_path(portal), generation, key)
+    properties = user_info_cache.get(cache_key, _marker)
+    if properties is _marker:
+        properties = resolve_user_info(user_or_username)
+        dirty = is_dirty(portal, storage=USERS_GENERATION_STORAGE)
+        if key and not dirty:
+            user_info_cache.set(cache_key, properties)
+
+    if not properties:
         if default is _marker:
             raise ValueError("No valid user: {}".format(repr(user_or_username)))
         return default
 
+    # callers are allowed to modify the returned dict
+    return dict(properties)
+
+
+def get_users_info(users_or_usernames):
+    """Returns a dict with the user ids or usernames passed-in as keys and the
+    properties of each user as values. Each user is resolved only once and
+    users that cannot be resolved are omitted
+    """
+    users_info = collections.OrderedDict()
+    for user_or_username in users_or_usernames:
+        key = get_user_key(user_or_username)
+        if key in users_info:
+            continue
+        info = get_user_info(user_or_username, default=None)
+        if info:
+            users_info[key] = info
+    return users_info
+
+
+def resolve_user_info(user_or_username):
+    """Returns a dict with the properties of the user passed-in, with the
+    fullname and email from the lab contact the user is linked to, if any.
+    Returns None if the user cannot be resolved
+    """
+    user = api.get_user(user_or_username)
+    if not user:
+        return None
+
     username = user.getUserName() or user_or_username
     properties = {
         "userid": user.getId(),
@@ -286,20 +358,23 @@ def get_user_info(user_or_username, default=_marker):
     return properties
 
 
+@setup_cache("sample_types_mapping")
 def get_sample_types_mapping():
     """Returns a dict with sample type titles, ids and prefixes as keys and
     values as sample type UIDs to facilitate the retrieval by id, prefix or
-    title
+    title. The mapping is cached until a sample type is changed
     """
     sample_types = dict()
     query = {"portal_type": "SampleType", "is_active": True}
     brains = api.search(query, SETUP_CATALOG)
     for brain in brains:
-        obj = api.get_object(brain)
-        uid = api.get_uid(obj)
-        obj_id = api.get_id(obj)
-        title = api.get_title(obj)
-        prefix = obj.getPrefix()
+        uid = api.get_uid(brain)
+        obj_id = api.get_id(brain)
+        title = api.get_title(brain)
+        prefix = getattr(brain, "getPrefix", None)
+        if prefix is None:
+            # prefix is not available as metadata
+            prefix = api.get_object(brain).getPrefix()
         sample_types[obj_id] = uid
         sample_types[title] = uid
         sample_types[prefix] = uid
@@ -307,10 +382,11 @@ def get_sample_types_mapping():
     return sample_types
 
 
+@setup_cache("services_mapping")
 def get_services_mapping():
     """Returns a dict with service ids, titles and keywords as keys and values
     as service UIDs to facilitate the retrieval of services by title, keyword
-    or by id
+    or by id. The mapping is cached until an analysis service is changed
     """
     services = dict()
     query = {"portal_type": "AnalysisService", "is_active": True}
@@ -327,6 +403,28 @@ def get_services_mapping():
     return services
 
 
+@setup_cache("setup_titles")
+def get_setup_titles():
+    """Returns a dict with the UIDs of instruments and methods as keys and
+    their titles as values. The mapping is cached until an instrument or a
+    method is changed
+    """
+    query = {"portal_type": ["Instrument", "Method"]}
+    brains = api.search(query, SETUP_CATALOG)
+    return dict([(api.get_uid(brain), api.get_title(brain))
+                 for brain in brains])
+
+
+def get_metadata(brain, column, default=None):
+    """Returns the value of the metadata column of the catalog brain passed-in
+    or the default value if the catalog does not have such column
+    """
+    value = getattr(brain, column, MV)
+    if value is MV:
+        return default
+    return value
+
+
 def search_sample_type(term, full_object=False):
     """Returns the Sample Type that matches with the given term, if any.
     Returns None otherwise
@@ -342,40 +440,154 @@ def get_create_reference_analyses():
     """Returns whether the system has to create analyses if results are
     notified by reference lab, but the sample does not have them
     """
-    key = "{}.create_reference_analyses".format(PRODUCT_NAME)
-    return api.get_registry_record(key, default=False)
+    return get_settings().get("create_reference_analyses", False)
 
 
 def get_notify_unrequested():
     """Returns whether the system has to include analyses that weren't
     initially requested when notifying back results to the referring laboratory
     """
-    key = "{}.notify_unrequested_analyses".format(PRODUCT_NAME)
-    return api.get_registry_record(key, default=False)
+    return get_settings().get("notify_unrequested_analyses", False)
 
 
 def get_notify_retested():
     """Returns whether the system has to include retested analyses when
     notifying back results to the referring laboratory
     """
-    key = "{}.notify_retested_analyses".format(PRODUCT_NAME)
-    return api.get_registry_record(key, default=False)
+    return get_settings().get("notify_retested_analyses", False)
 
 
 def get_notify_hidden():
     """Returns whether the system has to include hidden analyses when notifying
     back results to the referring laboratory
     """
-    key = "{}.notify_hidden_analyses".format(PRODUCT_NAME)
-    return api.get_registry_record(key, default=False)
+    return get_settings().get("notify_hidden_analyses", False)
 
 
 def get_outbound_samples_order():
     """Returns the default sorting strategy to use when adding samples to an
     outbound shipment.
     """
-    key = "{}.outbound_samples_order".format(PRODUCT_NAME)
-    return api.get_registry_record(key, default="keep")
+    return get_settings().get("outbound_samples_order", "keep")
+
+
+def get_session_pool_size():
+    """Returns the maximum number of connections to keep in the pool for each
+    remote laboratory
+    """
+    size = get_settings().get("session_pool_size", 10)
+    return max(api.to_int(size, 10), 1)
+
+
+def get_session_keep_alive():
+    """Returns whether the connections with remote laboratories have to be
+    kept alive for reuse in further requests
+    """
+    return get_settings().get("session_keep_alive", True)
+
+
+def get_session_idle_timeout():
+    """Returns the number of seconds a connection with a remote laboratory
+    can remain unused before being closed
+    """
+    timeout = get_settings().get("session_idle_timeout", 300)
+    return api.to_int(timeout, 300)
+
+
+def is_outbox_enabled():
+    """Returns whether notifications to remote laboratories have to be added
+    to the outbox and delivered after the transaction is committed
+    """
+    return get_settings().get("outbox_enabled", False)
+
+
+def get_outbox_max_attempts():
+    """Returns the maximum number of attempts to deliver a notification from
+    the outbox when the remote laboratory cannot be reached
+    """
+    attempts = get_settings().get("outbox_max_attempts", 5)
+    return max(api.to_int(attempts, 5), 1)
+
+
+def get_notifications_retention():
+    """Returns the maximum number of notifications (POST requests) to keep in
+    the history of each object. Returns 0 if unlimited
+    """
+    retention = get_settings().get("notifications_retention", 20)
+    return max(api.to_int(retention, 20), 0)
+
+
+def get_notifications_compression():
+    """Returns whether the notifications (POST requests) kept in the history
+    of each object have to be stored compressed
+    """
+    return get_settings().get("notifications_compression", False)
+
+
+def get_notifications_max_content_size():
+    """Returns the maximum number of characters of the responses from remote
+    laboratories to keep in the history of notifications. Returns 0 if
+    unlimited
+    """
+    size = get_settings().get("notifications_max_content_size", 10240)
+    return max(api.to_int(size, 10240), 0)
+
+
+def get_notifications_log_sampling():
+    """Returns the percentage of notifications (POST requests) whose whole
+    payload has to be written to the log
+    """
+    sampling = get_settings().get("notifications_log_sampling", 0)
+    return min(max(api.to_int(sampling, 0), 0), 100)
+
+
+def get_retry_max_workers():
+    """Returns the maximum number of failed notifications (POST requests) to
+    re-send concurrently on retry
+    """
+    workers = get_settings().get("retry_max_workers", 4)
+    return max(api.to_int(workers, 4), 1)
+
+
+def get_retry_backoff():
+    """Returns the base time in seconds to wait before the automatic retry of
+    a failed notification (POST request)
+    """
+    backoff = get_settings().get("retry_backoff", 300)
+    return max(api.to_int(backoff, 300), 1)
+
+
+def get_retry_backoff_max():
+    """Returns the maximum time in seconds to wait before the automatic retry
+    of a failed notification (POST request)
+    """
+    backoff = get_settings().get("retry_backoff_max", 21600)
+    return max(api.to_int(backoff, 21600), 1)
+
+
+def get_dispatch_max_workers():
+    """Returns the maximum number of remote laboratories to notify
+    concurrently
+    """
+    workers = get_settings().get("dispatch_max_workers", 4)
+    return max(api.to_int(workers, 4), 1)
+
+
+def get_circuit_failure_threshold():
+    """Returns the number of consecutive failures after which no more POST
+    requests are sent to a remote laboratory for a while. Returns 0 if POST
+    requests have to be sent always
+    """
+    threshold = get_settings().get("circuit_failure_threshold", 5)
+    return max(api.to_int(threshold, 5), 0)
+
+
+def get_circuit_cooldown():
+    """Returns the seconds to wait before sending a POST request again to a
+    remote laboratory that could not be reached
+    """
+    cooldown = get_settings().get("circuit_cooldown", 300)
+    return max(api.to_int(cooldown, 300), 1)
 
 
 def cmp_by_id(x, y):
@@ -405,3 +617,43 @@ def cmp_by_created(x, y):
     # compare creation dates and fallback to ID if equal
     comp = cmp(created_a, created_b)
     return comp if comp != 0 else cmp_by_id(x, y)
+
+
+def get_sample_sort_key(brain_or_object, order):
+    """Returns the key to sort the sample passed-in in accordance with the
+    order ("sid" or "created"), as a string. Relies on catalog metadata when
+    a brain is passed-in, so the object is not woken up
+    """
+    sid = get_metadata(brain_or_object, "getId")
+    if sid is None:
+        brain_or_object = api.get_object(brain_or_object)
+        sid = api.get_id(brain_or_object)
+    if order != "created":
+        return sid
+
+    created = get_metadata(brain_or_object, "created")
+    if created is None:
+        created = api.get_creation_date(api.get_object(brain_or_object))
+    return "{:017.6f}-{}".format(created.timeTime(), sid)
+
+
+def get_samples_sort_keys(samples, order, start=0):
+    """Returns a dict with the keys to sort the samples passed-in in
+    accordance with the order ("sid" or "created"), keyed by uid. The keys are
+    resolved with a single catalog search. For other values of order, the
+    keys are sequential numbers from start, so they keep the order of the
+    samples passed-in
+    """
+    uids = list(map(api.get_uid, samples))
+    if order not in ["sid", "created"]:
+        return dict([(uid, "{:012d}".format(start + num))
+                     for num, uid in enumerate(uids)])
+
+    query = {"UID": uids}
+    brains = api.search(query, CATALOG_ANALYSIS_REQUEST_LISTING)
+    brains = dict([(api.get_uid(brain), brain) for brain in brains])
+    return dict([
+        (uid, get_sample_sort_key(brains.get(uid) or uid, order))
+        for uid in uids
+    ])
+
@@ -58,6 +58,12 @@ class ReferenceLaboratoriesVocabulary(object):
             "sort_on": "sortable_title",
             "sort_order": "ascending",
         }
+        catalog = api.get_tool("portal_catalog")
+        if "is_reference" in catalog.indexes():
+            # Only those external labs that can act as reference labs
+            query["is_reference"] = True
+            return to_simple_vocabulary(query, "portal_catalog")
+
         items = []
         for brain in api.search(query, "portal_catalog"):
             obj = api.get_object(brain)
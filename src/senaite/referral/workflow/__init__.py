@@ -29,6 +29,7 @@ from senaite.core.workflow import ANALYSIS_WORKFLOW
 from senaite.core.workflow import SAMPLE_WORKFLOW
 from senaite.referral import logger
 from senaite.referral.interfaces import IOutboundSampleShipment
+from senaite.referral.reindex import reindex_on_commit
 from senaite.referral.utils import get_chunk_size_for
 from zope.event import notify
 from zope.lifecycleevent import modified
@@ -40,6 +41,9 @@ except ImportError:
     # Queue is not installed
     is_queue_ready = None
 
+# Indexes affected by a change of the workflow status
+WORKFLOW_INDEXES = ["allowedRolesAndUsers", "is_active", "review_state"]
+
 
 def TransitionEventHandler(before_after, obj, mod, event): # noqa lowercase
     if not event.transition:
@@ -93,7 +97,42 @@ def ship_sample(sample, shipment):
     doActionFor(sample, "ship")
 
     # Reindex the sample
-    sample.reindexObject()
+    reindex_on_commit(sample, idxs=WORKFLOW_INDEXES)
+
+
+def ship_samples(samples, shipment):
+    """Adds the samples to the shipment at once and ships them. Samples that
+    cannot be shipped are removed from the shipment
+    :returns: the list of samples that were shipped
+    """
+    samples = list(map(api.get_object, samples))
+    for sample in samples:
+        if not IAnalysisRequest.providedBy(sample):
+            portal_type = api.get_portal_type(sample)
+            raise ValueError("Type not supported: {}".format(portal_type))
+
+    shipment = api.get_object(shipment)
+    if not IOutboundSampleShipment.providedBy(shipment):
+        portal_type = api.get_portal_type(shipment)
+        raise ValueError("Type not supported: {}".format(portal_type))
+
+    # Add the samples to the shipment with a single sort and assignment
+    shipment.addSamples(samples)
+
+    # Assign the shipment to the samples and ship them. The samples are
+    # already in the shipment, so they are not added again
+    shipped = []
+    for sample in samples:
+        sample.setOutboundShipment(shipment)
+        success, message = doActionFor(sample, "ship")
+        if not success:
+            # the sample cannot be shipped (e.g. not received yet)
+            sample.setOutboundShipment(None)
+            continue
+        reindex_on_commit(sample, idxs=WORKFLOW_INDEXES)
+        shipped.append(sample)
+
+    return shipped
 
 
 def restore_referred_sample(sample):
@@ -120,7 +159,17 @@ def restore_referred_sample(sample):
     modified(sample)
 
     # Reindex the sample
-    sample.reindexObject()
+    reindex_on_commit(sample, idxs=WORKFLOW_INDEXES)
+
+
+def get_queue_chunk_size(action, chunk_size=None):
+    """Returns the number of objects to process at once when the action is
+    done asynchronously. Returns 0 if the queue is not installed or ready
+    """
+    if not callable(is_queue_ready) or not is_queue_ready():
+        return 0
+    chunk_size = api.to_int(chunk_size, default=get_chunk_size_for(action))
+    return max(chunk_size, 0)
 
 
 def do_queue_or_action_for(objects, action, **kwargs):
@@ -134,16 +183,14 @@ def do_queue_or_action_for(objects, action, **kwargs):
     if not objects:
         return
 
-    if callable(is_queue_ready) and is_queue_ready():
+    chunk_size = get_queue_chunk_size(action, kwargs.pop("chunk_size", None))
+    if chunk_size > 0:
         # queue is installed and ready
         kwargs["delay"] = kwargs.get("delay", 10)
+        kwargs["chunk_size"] = chunk_size
         context = kwargs.pop("context", objects[0])
-        chunk_size = kwargs.pop("chunk_size", None)
-        chunk_size = api.to_int(chunk_size, default=get_chunk_size_for(action))
-        if chunk_size > 0:
-            kwargs["chunk_size"] = chunk_size
-            context = api.get_object(context)
-            return add_action_task(objects, action, context=context, **kwargs)
+        context = api.get_object(context)
+        return add_action_task(objects, action, context=context, **kwargs)
 
     # perform the workflow action
     for obj in objects:
@@ -185,5 +232,5 @@ def change_workflow_state(content, wf_id, state_id, **kwargs):
         notify(AfterTransitionEvent(content, workflow, old_state, new_state,
                                     transition, wf_state, None))
 
-    # Map changes to catalog
-    content.reindexObject()
+    # Map changes to catalog on commit. Permissions might have changed too
+    reindex_on_commit(content, idxs=WORKFLOW_INDEXES)
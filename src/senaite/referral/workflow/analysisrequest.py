@@ -25,6 +25,7 @@ from senaite.referral import check_installed
 from senaite.referral.interfaces import IInboundSampleShipment
 from senaite.referral.interfaces import IOutboundSampleShipment
 from senaite.referral.remotelab import get_remote_connection
+from senaite.referral.remotelab import update_analyses_on_commit
 from senaite.referral.workflow import change_workflow_state
 from senaite.referral.workflow import restore_referred_sample
 from senaite.referral.workflow import ship_sample
@@ -92,8 +93,13 @@ def after_verify(sample):
     if not remote_lab:
         return
 
-    # Update the results for this sample in the remote lab
-    remote_lab.update_analyses(sample)
+    # Update the results for this sample in the remote lab. Send the results
+    # together with those from other samples verified within same transaction
+    # if the remote lab supports this
+    if lab.getBatchNotifications():
+        update_analyses_on_commit(lab, sample)
+    else:
+        remote_lab.update_analyses(sample)
 
 
 def after_reject(sample):